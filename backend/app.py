@@ -1,99 +1,280 @@
 import datetime
-import uuid
-from flask import Flask, request, Response, redirect, render_template, send_from_directory, jsonify, url_for
+import io
+from flask import Flask, Blueprint, request, Response, render_template, send_from_directory, jsonify, stream_with_context
 import secrets
 from flask_mail import Mail, Message
-from flask_bcrypt import Bcrypt
 from flask_jwt_extended import create_access_token, JWTManager
 from flask_cors import CORS
 import pymongo
+from pymongo import ReturnDocument
 from pymongo.server_api import ServerApi
+from pymongo.errors import PyMongoError, WaitQueueTimeoutError
 from dotenv import load_dotenv
 import os
-import json
-from threading import Thread
-import requests
 from flask import Flask, request, jsonify
-import firebase_admin
-from firebase_admin import credentials, auth
 from utils.imageUploader import upload_file
-from bson import ObjectId
+from utils.indexes import ensure_indexes, check_query_plans
+from utils.directory import UserDirectory
+from utils.profiles import ProfileCache
+from utils.cache import SnapshotCache
+from utils.jobs import JobQueue
+from utils.db import LazyClient, client_options, replica_read_preference, run_in_transaction
+from utils.resets import PasswordResets
+from utils.doctor_search import DoctorSearch, rating_update, parse_fee
+from utils.feedback import Feedback, parse_rating, public_view as public_feedback
+from utils.leaderboard import IndexLeaderboard, RedisLeaderboard, histogram
+from utils.schedule import Schedules, ScheduleCreated, SlotConflict, calendar_range, parse_timestamp
+from utils.responses import OrjsonProvider, Compressor, stream_json
+from utils.metrics import REGISTRY, MongoCommandListener, PoolMetrics, RequestMetrics
+from utils.outbox import Outbox
+from utils.hashing import PasswordHasher, HashingBusy
+from utils.tokens import CertificateStore, TokenVerifier, InvalidToken
+from utils.presence import PresenceRegistry, RedisPresenceStore, MemoryPresenceStore, redis_from_env
+from utils.events import EventBus, channel_for, sse_stream, appointment_event, watch_appointments
+from utils.whatsapp import WhatsAppDispatcher, transport_from_env
+from threading import Thread
+from utils.appointments import Appointments, fill_counterpart_names
+from bisect import bisect_right
 
 load_dotenv()
-secret_key = secrets.token_hex(16)
-
-app = Flask(__name__)
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SECRET_KEY'] = secret_key
 SECRET_KEY = os.getenv('SECRET')
 
-app.config['MAIL_SERVER']='smtp.gmail.com'
-app.config['MAIL_PORT'] = os.getenv('PORT')
-app.config['MAIL_USERNAME'] = os.getenv('HOST_EMAIL')
-app.config['MAIL_PASSWORD'] = os.getenv('PASSWORD')
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_DEFAULT_SENDER'] = app.config['MAIL_USERNAME']
-mail = Mail(app)
+# Routes are registered on this blueprint and mounted by create_app()
+api = Blueprint('api', __name__)
+mail = Mail()
+jwt = JWTManager()
 
-jwt = JWTManager(app)
-
-CORS(app, supports_credentials=True)
-bcrypt = Bcrypt(app)
+hasher = PasswordHasher(
+    workers=int(os.getenv('HASH_WORKERS', 0)) or None,
+    rounds=int(os.getenv('BCRYPT_LOG_ROUNDS', 12)),
+    max_pending=int(os.getenv('HASH_MAX_PENDING', 0)) or None,
+)
 
 URI = os.getenv("DBURL")
-
-firebase_config = {
-    "type": os.getenv("FIREBASE_TYPE"),
-    "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-    "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-    "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace('\\n', '\n'),  
-    "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-    "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-    "auth_uri": os.getenv("FIREBASE_AUTH_URI"),
-    "token_uri": os.getenv("FIREBASE_TOKEN_URI"),
-    "auth_provider_x509_cert_url": os.getenv("FIREBASE_AUTH_PROVIDER_CERT_URL"),
-    "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_CERT_URL"),
-    "universe_domain": os.getenv("FIREBASE_UNIVERSE_DOMAIN"),
-}
-
-if firebase_config:
+MONGO_DB = os.getenv("MONGO_DB", "medicare")
+
+# Google sign-in tokens are verified against prefetched certificates and cached until they expire
+token_verifier = TokenVerifier(
+    os.getenv("FIREBASE_PROJECT_ID"),
+    CertificateStore(),
+    max_entries=int(os.getenv('TOKEN_CACHE_SIZE', 10000)),
+)
+
+# One client per process, created on first use so after gunicorn forks its
+# workers; pool size, wait queue timeout and compression come from MONGO_* variables
+pool_metrics = PoolMetrics()
+client = LazyClient(lambda: pymongo.MongoClient(
+    URI,
+    server_api=ServerApi('1'),
+    event_listeners=[MongoCommandListener(), pool_metrics],
+    **client_options(),
+))
+
+db = client.database(MONGO_DB)
+# Multi-document transactions need a replica set or sharded cluster. When
+# MONGO_TRANSACTIONS isn't set they're used only if the server supports them
+MONGO_TRANSACTIONS = os.getenv('MONGO_TRANSACTIONS')
+MONGO_TRANSACTIONS = None if MONGO_TRANSACTIONS is None else MONGO_TRANSACTIONS.lower() == 'true'
+doctors = db.doctors
+patients = db.patients
+website_feedback = db.website_feedback
+feedback = Feedback(website_feedback, db.feedback_rollups)
+# Testimonial carousel; other workers' submissions show up within the ttl
+featured_feedback = SnapshotCache(
+    lambda: feedback.featured(int(os.getenv('FEATURED_FEEDBACK_LIMIT', 10))),
+    ttl=int(os.getenv('FEATURED_FEEDBACK_TTL', 300)),
+)
+directory = UserDirectory(patients, doctors)
+# Read-only routes that can tolerate replication lag (get_status,
+# completed_meets) read from secondaries when MONGO_SECONDARY_READS is set
+REPLICA_READS = replica_read_preference()
+replica_doctors = doctors.with_options(read_preference=REPLICA_READS)
+replica_patients = patients.with_options(read_preference=REPLICA_READS)
+replica_directory = UserDirectory(replica_patients, replica_doctors)
+password_resets = PasswordResets(db.password_resets, ttl=int(os.getenv('RESET_TOKEN_TTL', 3600)))
+appointments = Appointments(db.appointments)
+appointment_history = Appointments(db.appointments.with_options(read_preference=REPLICA_READS))
+doctor_search = DoctorSearch(doctors)
+schedules = Schedules(
+    db.schedules,
+    slot_minutes=int(os.getenv('SLOT_MINUTES', 60)),
+    instant_minutes=int(os.getenv('INSTANT_MEET_MINUTES', 30)),
+)
+redis_client = redis_from_env()
+# Username, phone, gender, picture and role by email, written through on profile changes
+profiles = ProfileCache(
+    directory,
+    max_entries=int(os.getenv('PROFILE_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('PROFILE_CACHE_TTL', 300)),
+    local_ttl=int(os.getenv('PROFILE_CACHE_LOCAL_TTL', 10)),
+    redis_client=redis_client,
+)
+# Top-rated doctors, from Redis sorted sets when Redis is configured
+leaderboard = RedisLeaderboard(redis_client, doctors) if redis_client is not None else IndexLeaderboard(doctors)
+LEADERBOARD_FIELDS = {'email': 1, 'rating': 1, 'appointments': 1, 'specialization': 1, 'verified': 1}
+presence = PresenceRegistry(
+    doctors,
+    RedisPresenceStore(redis_client) if redis_client else MemoryPresenceStore(),
+    ttl=int(os.getenv('PRESENCE_TTL', 120)),
+    flush_interval=int(os.getenv('PRESENCE_FLUSH_SECONDS', 15)),
+)
+
+# Meet, presence and appointment changes are pushed to /events subscribers
+events = EventBus(redis_client)
+APPOINTMENT_CHANGE_STREAM = os.getenv('EVENTS_CHANGE_STREAM', 'false').lower() == 'true'
+if APPOINTMENT_CHANGE_STREAM:
+    client.on_connect.append(lambda _: watch_appointments(events, db.appointments))
+
+def publish_presence(email):
+    events.publish(channel_for('presence', email), 'presence', dict(presence.get(email), email=email))
+
+presence.listeners.append(publish_presence)
+
+def publish_appointment(appointment):
+    # With the change stream enabled, appointment events come from MongoDB instead
+    if APPOINTMENT_CHANGE_STREAM or not appointment:
+        return
+    data = appointment_event(appointment)
+    for role, field in (('doctor', 'demail'), ('patient', 'pemail')):
+        if data.get(field):
+            events.publish(channel_for(role, data[field]), 'appointment', data)
+# Bound to the app by create_app()
+outbox = Outbox(db.outbox, None, mail, workers=int(os.getenv('MAIL_WORKERS', 2)))
+whatsapp = WhatsAppDispatcher(
+    db.whatsapp_queue,
+    transport_from_env(),
+    workers=int(os.getenv('WHATSAPP_WORKERS', 4)),
+    coalesce_window=float(os.getenv('WHATSAPP_COALESCE_SECONDS', 2)),
+)
+
+def whatsapp_message(message):
+    # Queued and sent in the background; a notification that can't be
+    # queued doesn't fail the request that triggered it
     try:
-        cred = credentials.Certificate(firebase_config)
-        firebase_admin.initialize_app(cred)
-        print("Firebase initialized successfully!")
-    except json.JSONDecodeError as e:
-        print(f"JSON Decode Error: {e}")
-else:
-    print("Error: Firebase credentials not found in environment variables.")
-
-client = pymongo.MongoClient(URI, server_api=ServerApi('1'))
-
-doctors = client.get_database("medicare").doctors
-patients = client.get_database("medicare").patients
-website_feedback = client.get_database("medicare").website_feedback
+        whatsapp.send(message)
+    except PyMongoError as e:
+        print(f"Error queueing WhatsApp message to {message.get('to')}: {e}")
 
 YOUR_DOMAIN = os.getenv('DOMAIN') 
 
 
-# Test MongoDB connection
-try:
-    client.admin.command('ping')
-    print("MongoDB connection successful!")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
-
-@app.get("/")
+def provision_indexes(_):
+    # Runs once per process when it first connects, in the background so the
+    # request that opened the connection isn't held up.
+    # Can also be run with `python -m utils.indexes`.
+    def run():
+        try:
+            ensure_indexes(db)
+        except Exception as e:
+            print(f"Error creating MongoDB indexes: {e}")
+    Thread(target=run, name='ensure-indexes', daemon=True).start()
+
+if os.getenv('ENSURE_INDEXES', 'true').lower() == 'true':
+    client.on_connect.append(provision_indexes)
+
+def create_app(config=None):
+    """
+    Builds the Flask app around the module's routes and components. Nothing
+    here touches MongoDB, Firebase or Cloudinary: clients are created on
+    first use in each process, and /ready reports whether they're reachable.
+
+    :param config: optional mapping applied over the environment's config
+    """
+    app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SECRET_KEY'] = secrets.token_hex(16)
+
+    app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = os.getenv('PORT')
+    app.config['MAIL_USERNAME'] = os.getenv('HOST_EMAIL')
+    app.config['MAIL_PASSWORD'] = os.getenv('PASSWORD')
+    app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'true').lower() == 'true'
+    app.config['MAIL_DEFAULT_SENDER'] = app.config['MAIL_USERNAME']
+    if config:
+        app.config.update(config)
+    mail.init_app(app)
+    jwt.init_app(app)
+
+    CORS(app, supports_credentials=True)
+    # gzip/brotli for JSON and text responses of at least COMPRESS_MIN_SIZE bytes
+    Compressor(app, threshold=int(os.getenv('COMPRESS_MIN_SIZE', 1024)))
+    # Per-route latency and MongoDB command counts; SLOW_REQUEST_MS enables the slow-request log
+    RequestMetrics(app, slow_ms=float(os.getenv('SLOW_REQUEST_MS')) if os.getenv('SLOW_REQUEST_MS') else None)
+    app.register_blueprint(api)
+    outbox.app = app
+
+    # In test mode refuse to start if any route query is a collection scan
+    if os.getenv('QUERY_PLAN_GUARD', 'false').lower() == 'true':
+        check_query_plans(db)
+    return app
+
+@api.get("/")
 def getInfo():
     return "WelCome to 💖medicare server !!!! "
 
-@app.before_request
+@api.get("/ready")
+def ready():
+    # "/" only says the process is up; this checks what requests depend on
+    checks = {}
+    try:
+        client.admin.command('ping')
+        checks['mongo'] = 'ok'
+    except Exception as e:
+        checks['mongo'] = str(e)
+    if redis_client is not None:
+        try:
+            redis_client.ping()
+            checks['redis'] = 'ok'
+        except Exception as e:
+            checks['redis'] = str(e)
+    status = 200 if all(check == 'ok' for check in checks.values()) else 503
+    return jsonify(checks), status
+
+@api.app_errorhandler(SlotConflict)
+def slot_conflict(e):
+    return jsonify({'error': str(e)}), 409
+
+@api.app_errorhandler(HashingBusy)
+def hashing_busy(e):
+    return jsonify({'message': 'Server is busy, please try again'}), 503, {'Retry-After': '1'}
+
+@api.app_errorhandler(WaitQueueTimeoutError)
+def mongo_pool_exhausted(e):
+    # Every pooled connection stayed busy for MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return jsonify({'message': 'Server is busy, please try again'}), 503, {'Retry-After': '1'}
+
+# Existing component stats, exposed as gauges on every scrape
+REGISTRY.gauges('medicare_hashing', lambda: hasher.stats())
+REGISTRY.gauges('medicare_profile_cache', lambda: profiles.stats())
+REGISTRY.gauges('medicare_mongo_pool', lambda: pool_metrics.stats())
+REGISTRY.gauges('medicare_token_cache', lambda: token_verifier.stats())
+REGISTRY.gauges('medicare_outbox', lambda: outbox.stats())
+REGISTRY.gauges('medicare_doctor_directory', lambda: {'hits': doctor_directory.hits, 'misses': doctor_directory.misses})
+REGISTRY.gauges('medicare_featured_feedback', lambda: {'hits': featured_feedback.hits, 'misses': featured_feedback.misses})
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/auth/token_cache/stats', methods=['GET'])
+def token_cache_stats():
+    return jsonify(token_verifier.stats()), 200
+
+@api.route('/hashing/stats', methods=['GET'])
+def hashing_stats():
+    return jsonify(hasher.stats()), 200
+
+@api.before_app_request
 def before_request():
+    # Certificates are prefetched by each worker once it starts serving
+    token_verifier.certificates.start()
     if request.method == 'OPTIONS':
         return Response()
 
 # ----------- Authentication routes ----------------
 
-@app.route('/register', methods=['POST'])
+@api.route('/register', methods=['POST'])
 def register():
     data = None
     cloudinary_url = None
@@ -104,9 +285,9 @@ def register():
     # Firebase Google Register
     if 'id_token' in data:
         try:
-            decoded_token = auth.verify_id_token(data['id_token'])
+            decoded_token = token_verifier.verify(data['id_token'])
             email = decoded_token.get('email')
-        except:
+        except InvalidToken:
             return jsonify({'message': 'Invalid Firebase token'}), 401
     else:
         email = data.get('email')
@@ -121,11 +302,11 @@ def register():
 
     # Custom Register
     if data['registerer'] == 'patient':
-        if doctors.find_one({'email': email}) or patients.find_one({'email': email}):
+        if directory.exists(email):
             return jsonify({'message': 'User already exists'}), 400
         
         if 'id_token' not in data:
-            hashed_password = bcrypt.generate_password_hash(data['passwd']).decode('utf-8')
+            hashed_password = hasher.hash(data['passwd'])
             data['passwd'] = hashed_password
         
         # Default values
@@ -137,7 +318,6 @@ def register():
         data.setdefault('wallet', 0)
         data.setdefault('meet', False)
         data.setdefault('wallet_history', [])
-        data.setdefault('upcomingAppointments', [])
         if cloudinary_url:
             data['profile_picture'] = cloudinary_url
         if 'specialization' in data:
@@ -146,6 +326,7 @@ def register():
             del data['doctorId']
         
         patients.insert_one(data)
+        profiles.put(data, 'patient')
 
         if 'phone' in data:
             whatsapp_message({
@@ -165,11 +346,11 @@ def register():
         }), 200
     
     elif data['registerer'] == 'doctor':
-        if patients.find_one({'email': email}) or doctors.find_one({'email': email}):
+        if directory.exists(email):
             return jsonify({'message': 'User already exists'}), 400
 
         if 'id_token' not in data:
-            hashed_password = bcrypt.generate_password_hash(data['passwd']).decode('utf-8')
+            hashed_password = hasher.hash(data['passwd'])
             data['passwd'] = hashed_password
         
         # Default values
@@ -179,9 +360,13 @@ def register():
         data.setdefault('phone', '')
         data.setdefault('appointments', 0)
         data.setdefault('stars', 0)
+        data.setdefault('rating', 0)
         data.setdefault('status', 'offline')
-        data.setdefault('upcomingAppointments', [])
         data.setdefault('fee', 0)
+        try:
+            data['fee'] = parse_fee(data['fee'])
+        except ValueError:
+            return jsonify({'message': 'Fee must be a number'}), 400
         data.setdefault('verified', False)
         data.setdefault('cart', [])
         data.setdefault('wallet_history', [])
@@ -192,6 +377,8 @@ def register():
             data['profile_picture'] = cloudinary_url
 
         doctors.insert_one(data)
+        doctor_directory.invalidate()
+        profiles.put(data, 'doctor')
 
         return jsonify({
             'message': 'User created successfully',
@@ -209,7 +396,12 @@ def register():
     else:
         return jsonify({'message': 'Invalid registerer type'}), 400
 
-@app.route('/login', methods=['POST'])
+LOGIN_PROJECTION = {
+    'passwd': 1, 'username': 1, 'gender': 1, 'phone': 1, 'email': 1, 'age': 1,
+    'specialization': 1, 'doctorId': 1, 'verified': 1, 'profile_picture': 1,
+}
+
+@api.route('/login', methods=['POST'])
 def login():
     if not request.is_json:
         return jsonify({"msg": "Missing JSON in request"}), 400
@@ -218,9 +410,9 @@ def login():
     # Firebase Google Login
     if 'id_token' in data:
         try:
-            decoded_token = auth.verify_id_token(data['id_token'])
+            decoded_token = token_verifier.verify(data['id_token'])
             email = decoded_token.get('email')
-        except:
+        except InvalidToken:
             return jsonify({'message': 'Invalid Firebase token'}), 401
     else:
         email = data.get('email')
@@ -229,9 +421,21 @@ def login():
         return jsonify({'message': 'Email is required'}), 400
     
     # Custom Login
-    var = patients.find_one({'email': email})
-    if var:
-        if 'id_token' in data or ('passwd' in data and bcrypt.check_password_hash(var['passwd'], data['passwd'])):
+    var = directory.find_by_email(email, LOGIN_PROJECTION)
+    # Accounts created with Google sign-in have no password hash
+    stored_hash = var.get('passwd') if var else None
+    if stored_hash and 'id_token' not in data and data.get('passwd') and hasher.check(stored_hash, data['passwd']):
+        # Upgrade hashes made with an older work factor
+        if hasher.needs_rehash(stored_hash):
+            collection = directory.collection_for(var['usertype'])
+            hasher.rehash_in_background(data['passwd'], lambda hashed: collection.update_one({'email': email}, {'$set': {'passwd': hashed}}))
+        authenticated = True
+    else:
+        authenticated = 'id_token' in data
+
+    if var and var['usertype'] == 'patient':
+        if authenticated:
+            profiles.put(var)
             access_token = create_access_token(identity=email)
             return jsonify({
                 'message': 'User logged in successfully',
@@ -246,11 +450,11 @@ def login():
             }), 200
         return jsonify({'message': 'Invalid password'}), 400
 
-    var = doctors.find_one({'email': email})
-    if var:
-        if 'id_token' in data or ('passwd' in data and bcrypt.check_password_hash(var['passwd'], data['passwd'])):
+    if var and var['usertype'] == 'doctor':
+        if authenticated:
             # Update doctor status only if login is successful
-            doctors.update_one({'email': email}, {'$set': {'status': 'online'}})
+            presence.heartbeat(email)
+            profiles.put(var)
             access_token = create_access_token(identity=email)
             return jsonify({
                 'message': 'User logged in successfully',
@@ -269,227 +473,377 @@ def login():
 
     return jsonify({'message': 'Invalid username or password'}), 401
         
-@app.route('/verify', methods=['POST'])
+@api.route('/verify', methods=['POST'])
 def verify():
     data = request.get_json()
     email = data['email']
     
-    # Find the document with the given email
-    var = doctors.find_one({'email': email})
-    
-    if var:
-        # If the document exists, check if 'verified' field exists
-        if 'verified' not in var:
-            # If 'verified' field doesn't exist, add it and set to True
-            doctors.update_one({'email': email}, {'$set': {'verified': True}})
-        else:
-            # If 'verified' exists, just ensure it's set to True
-            doctors.update_one({'email': email}, {'$set': {'verified': True}})
-        
+    # Mark the doctor verified, reading back what the leaderboard needs
+    doctor = doctors.find_one_and_update(
+        {'email': email},
+        {'$set': {'verified': True}},
+        projection=LEADERBOARD_FIELDS,
+        return_document=ReturnDocument.AFTER,
+    )
+
+    if doctor:
+        doctor_directory.invalidate()
+        leaderboard.record(doctor)
         verified = True  # Since we just set it to True
     else:
         verified = False  # If the document doesn't exist, treat as unverified
     
     return jsonify({'message': 'verification details', "verified": verified}), 200
 
-@app.route('/forgot_password', methods=['POST'])
+@api.route('/forgot_password', methods=['POST'])
 def forgot_password():
     data = request.get_json()
     print(data)
     email = data['email']
     print(email)
     
-    user = patients.find_one({'email': email}) or doctors.find_one({'email': email})
+    user = directory.find_by_email(email, {'_id': 1})
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
-    # Generate a password reset token
-    token = secrets.token_urlsafe(16)
-
-    # Store the token in the user's document with an expiration time
-    expiration_time = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
-    patients.update_one({'email': email}, {'$set': {'reset_token': token, 'reset_token_expiration': expiration_time}})
-    doctors.update_one({'email': email}, {'$set': {'reset_token': token, 'reset_token_expiration': expiration_time}})
+    # Generate a password reset token; it expires on its own via a TTL index
+    token = password_resets.issue(email, user['usertype'])
 
     # Send the token to the user's email
-    reset_url = url_for('reset_password', token=token, _external=True)
     msg = Message("Password Reset Request",
                     sender=os.getenv('HOST_EMAIL'),
                     recipients=[email])
     msg.body = f"To reset your password, visit the following link: https://pratik0112-medicare.vercel.app/reset-password/{token}"
-    mail.send(msg)
+    outbox.send(msg)
 
     return jsonify({'message': 'Password reset link sent'}), 200
 
-@app.route('/reset_password/<token>', methods=['POST'])
+@api.route('/reset_password/<token>', methods=['POST'])
 def reset_password(token):
-    data = request.get_json()
-    new_password = data['password']
-    hashed_password = bcrypt.generate_password_hash(new_password).decode('utf-8')
+    data = request.get_json(silent=True) or {}
+    new_password = data.get('password')
+    if not new_password:
+        return jsonify({'message': 'Password is required'}), 400
 
-    # Find the user with the token and check if it's still valid
-    user = patients.find_one({'reset_token': token, 'reset_token_expiration': {'$gt': datetime.datetime.utcnow()}}) or \
-           doctors.find_one({'reset_token': token, 'reset_token_expiration': {'$gt': datetime.datetime.utcnow()}})
-    
-    if not user:
+    # Hash before consuming the token, so a busy hashing pool doesn't burn the link
+    hashed_password = hasher.hash(new_password)
+
+    # Consume the token if it's still valid
+    reset = password_resets.redeem(token)
+
+    if not reset:
         return jsonify({'message': 'The reset link is invalid or has expired'}), 400
 
-    # Update the user's password and remove the reset token
-    patients.update_one({'reset_token': token}, {'$set': {'passwd': hashed_password}, '$unset': {'reset_token': "", 'reset_token_expiration': ""}})
-    doctors.update_one({'reset_token': token}, {'$set': {'passwd': hashed_password}, '$unset': {'reset_token': "", 'reset_token_expiration': ""}})
+    # Update the user's password
+    directory.collection_for(reset['usertype']).update_one({'email': reset['email']}, {'$set': {'passwd': hashed_password}})
 
     return jsonify({'message': 'Password has been reset'}), 200
 
         
-@app.route('/doc_status', methods=['PUT'])
+@api.route('/doc_status', methods=['PUT'])
 def doc_status():
     data = request.get_json()
     user = data['email']
-    doctors.update_one({'email': user}, {'$set': {'status': 'offline'}})
+    presence.set_offline(user)
     return jsonify({'message': 'Doctor status updated successfully'}), 200
 
-@app.route('/get_status', methods=['GET'])
+DOCTOR_DIRECTORY_PROJECTION = {
+    'email': 1, 'username': 1, 'specialization': 1, 'gender': 1,
+    'phone': 1, 'appointments': 1, 'stars': 1, 'fee': 1, 'status': 1, 'meet': 1,
+}
+
+def load_doctor_directory():
+    # Verified doctors ordered by _id; the _id string doubles as the page cursor
+    cursors = []
+    details = []
+    for count, i in enumerate(replica_doctors.find({'verified': True}, DOCTOR_DIRECTORY_PROJECTION).sort('_id', 1), start=1):
+        cursors.append(str(i['_id']))
+        details.append({"email": i["email"], "status": i.get("status", "offline"), "username": i.get("username", ""), "specialization": i.get("specialization", ""), "gender": i.get("gender", ""), "phone": i.get("phone", ""), "isInMeet": i.get("meet", False), "noOfAppointments": i.get("appointments", 0), "noOfStars": i.get("stars", 0), "id": count, 'fee': i.get('fee', 199)})
+    return cursors, details
+
+doctor_directory = SnapshotCache(load_doctor_directory, ttl=int(os.getenv('DOCTOR_DIRECTORY_TTL', 10)))
+
+@api.route('/get_status', methods=['GET'])
 def get_status():
+    cursors, details = doctor_directory.get()
+    response = {}
+
+    # Optional cursor pagination: ?limit=<n>&cursor=<last id of previous page>
+    limit = request.args.get('limit', type=int)
+    if limit:
+        start = bisect_right(cursors, request.args.get('cursor', ''))
+        end = start + max(limit, 1)
+        details = details[start:end]
+        response['next_cursor'] = cursors[end - 1] if end < len(cursors) else None
+
+    # Overlay live presence over the persisted status in the snapshot
+    live = presence.overlay([d['email'] for d in details])
+    response['details'] = [
+        dict(d, status=live[d['email']].get('status', d['status']), isInMeet=live[d['email']].get('meet', d['isInMeet']))
+        if d['email'] in live else d
+        for d in details
+    ]
+    resp = jsonify(response)
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+# Most result pages fetched to fill one /doctors/search page when live
+# presence filters some of them out
+SEARCH_MAX_FETCHES = 5
+
+@api.route('/doctors/search', methods=['GET'])
+def search_doctors():
+    args = request.args
+    try:
+        limit = min(max(args.get('limit', 20, type=int), 1), 100)
+        order = args.get('order')
+        if order not in (None, 'asc', 'desc'):
+            raise ValueError(f"Unknown order: {order}")
+        online = args.get('online')
+        online = None if online is None else online.lower() == 'true'
+        filters = dict(
+            sort=args.get('sort', 'rating'),
+            descending=None if order is None else order == 'desc',
+            specialization=args.get('specialization'),
+            gender=args.get('gender'),
+            min_fee=args.get('min_fee', type=float),
+            max_fee=args.get('max_fee', type=float),
+            online=online,
+            min_rating=args.get('min_rating', type=float),
+        )
+        details = []
+        next_cursor = args.get('cursor')
+        # The query filters on the persisted status, live presence may disagree
+        # and drop some doctors; fetch further until the page is full
+        for _ in range(SEARCH_MAX_FETCHES):
+            found, next_cursor = doctor_search.search(limit=limit - len(details), cursor=next_cursor, **filters)
+            details += search_details(found, online)
+            if next_cursor is None or len(details) >= limit:
+                break
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'details': details, 'next_cursor': next_cursor}), 200
+
+def search_details(found, online=None):
+    """Search results with live presence overlaid, which is fresher than the persisted status."""
+    live = presence.overlay([d['email'] for d in found])
     details = []
-    count = 0
-    for i in doctors.find():
-        if i.get('verified', False):
-            count += 1
-            details.append({"email": i["email"], "status": i.get("status", "offline"), "username": i["username"], "specialization": i["specialization"], "gender": i["gender"], "phone": i["phone"], "isInMeet": i["meet"], "noOfAppointments": i["appointments"], "noOfStars": i["stars"], "id": count, 'fee': i.get('fee', 199)})
-    # print(details)
-    return jsonify({"details": details}), 200
-
-def send_message_async(msg):
-    with app.app_context():
-        mail.send(msg)
-        # os.remove(os.path.join(app.root_path, 'upload', 'Receipt.pdf'))
-
-@app.get('/media/<path:path>')
+    for i in found:
+        current = live.get(i['email'], {})
+        status = current.get('status', i.get('status', 'offline'))
+        meet = current.get('meet', i.get('meet', False))
+        if online is not None and (status == 'online') != online:
+            continue
+        details.append({"email": i["email"], "status": status, "username": i.get("username", ""), "specialization": i.get("specialization", ""), "gender": i.get("gender", ""), "phone": i.get("phone", ""), "isInMeet": meet, "noOfAppointments": i.get("appointments", 0), "noOfStars": i.get("stars", 0), "rating": i.get("rating", 0), 'fee': i.get('fee', 199)})
+    return details
+
+@api.route('/doctors/top', methods=['GET'])
+def top_doctors():
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    found = leaderboard.top(request.args.get('specialization'), limit)
+    details = [{"email": i["email"], "username": i.get("username", ""), "specialization": i.get("specialization", ""), "gender": i.get("gender", ""), "profile_picture": i.get("profile_picture"), "noOfAppointments": i.get("appointments", 0), "rating": i.get("rating", 0), "histogram": histogram(i), 'fee': i.get('fee', 199)} for i in found]
+    return jsonify({'details': details}), 200
+
+@api.route('/doctors/working_hours', methods=['GET', 'PUT'])
+def working_hours():
+    if request.method == 'GET':
+        demail = request.args.get('demail')
+        if not demail:
+            return jsonify({'error': 'demail is required'}), 400
+        schedule = schedules.get(demail)
+        return jsonify({'working_hours': schedule['working_hours'], 'slot_minutes': schedule['slot_minutes']}), 200
+
+    data = request.get_json()
+    if not data or not data.get('demail') or not isinstance(data.get('working_hours'), dict):
+        return jsonify({'error': 'demail and working_hours are required'}), 400
+    try:
+        updated = schedules.set_working_hours(data['demail'], data['working_hours'], data.get('slot_minutes'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(updated, message='Working hours updated successfully')), 200
+
+@api.route('/doctors/free_slots', methods=['GET'])
+def free_slots():
+    demail = request.args.get('demail')
+    if not demail:
+        return jsonify({'error': 'demail is required'}), 400
+    days = min(max(request.args.get('days', 7, type=int), 1), 31)
+    try:
+        date_from = datetime.date.fromisoformat(request.args['from']) if 'from' in request.args else datetime.datetime.now(schedules.tz).date()
+    except ValueError:
+        return jsonify({'error': 'from must be a YYYY-MM-DD date'}), 400
+    return jsonify({'slots': schedules.free_slots(demail, date_from, days)}), 200
+
+@api.get('/media/<path:path>')
 def send_media(path):
     return send_from_directory(
         directory='upload', path=path
     )
 
-@app.route('/mail_file', methods=['POST'])
+# The PDF travels in the job document, so any worker on any host can
+# deliver it; documents are limited to 16MB
+PRESCRIPTION_MAX_BYTES = int(os.getenv('PRESCRIPTION_MAX_BYTES', 8 * 1024 * 1024))
+
+def drop_prescription_file(job):
+    try:
+        jobs.collection.update_one({'_id': job['_id']}, {'$unset': {'payload.file': ''}})
+    except PyMongoError as e:
+        print(f"Error dropping prescription file of job {job['_id']}: {e}")
+
+def deliver_prescription(job):
+    payload = job['payload']
+    meetLink = payload['meetLink']
+
+    # Upload the file to Cloudinary
+    def upload():
+        file_url = upload_file(io.BytesIO(payload['file']))
+        if "http" not in file_url:
+            raise RuntimeError(f"File upload failed: {file_url}")
+        return file_url
+    file_url = jobs.step(job, 'upload', upload)
+
+    # Add the prescription link to the appointment, upcoming or completed
+    def attach_prescription():
+        appointment = appointments.set_prescription(meetLink, file_url)
+        if not appointment:
+            print("No appointment found for meetlink", meetLink)
+        publish_appointment(appointment)
+        return appointment is not None
+    jobs.step(job, 'prescription', attach_prescription)
+
+    pat = profiles.get(payload['pemail'])
+    if not pat or pat['usertype'] != 'patient':
+        raise RuntimeError(f"Patient {payload['pemail']} not found")
+
+    # Send the WhatsApp message with the PDF link
+    # Queued synchronously; if that fails the step is retried with the job
+    def send_whatsapp():
+        return whatsapp.send({
+            "to": f"whatsapp:{pat['phone']}",
+            "body": f"Thank you for taking our consultancy. Please find your prescription here: {file_url}",
+        })
+    jobs.step(job, 'whatsapp', send_whatsapp)
+
+    # Queue the receipt PDF email to the patient
+    def send_email():
+        with outbox.app.app_context():
+            msg = Message(
+                "Receipt cum Prescription for your Consultancy",
+                recipients=[payload['pemail']]
+            )
+            msg.html = render_template('email.html', Name=pat['username'])
+            msg.attach("Receipt.pdf", "application/pdf", bytes(payload['file']))
+            return outbox.send(msg)
+    jobs.step(job, 'email', send_email)
+
+    drop_prescription_file(job)
+    return {'prescription': file_url}
+
+jobs = JobQueue(
+    db.jobs,
+    {'prescription': deliver_prescription},
+    workers=int(os.getenv('JOB_WORKERS', 2)),
+    on_failed=drop_prescription_file,
+)
+
+@api.route('/mail_file', methods=['POST'])
 def mail_file():
     # Get form data
     demail = request.form.get("demail")
     pemail = request.form.get("pemail")
     meetLink = request.form.get("meetLink")
-    print("meetlink......", meetLink)
     f = request.files['file']
-    
-    # Save the uploaded file
-    file_path = os.path.join(app.root_path, 'Receipt.pdf')
-    f.save(file_path)
 
-    # Upload the file to Cloudinary
-    file_url = upload_file(file_path)
-
-    if "http" not in file_url:
-        return jsonify({"error": "File upload failed", "details": file_url}), 500
-    
-    # Retrieve patient and doctor details from the database
-    pat = patients.find_one({'email': pemail})
-    doc = doctors.find_one({'email': demail})
-
-    if not pat or not doc:
+    # Check both users exist, usually without a round trip
+    found = {u['usertype']: u for u in profiles.get_many([pemail, demail]).values()}
+    if 'patient' not in found or 'doctor' not in found:
         return jsonify({"error": "Doctor or Patient not found"}), 404
 
-    appointment_found = False 
-
-    # Find the upcoming appointment based on meetLink
-    for appointment in pat.get('upcomingAppointments', []):
-        print("patient appointments", appointment)
-        if appointment.get('link') == meetLink:
-            print("found in pat......")
-            appointment['prescription'] = file_url  # Add prescription link
-            appointment_found = True
-            break
-
-    for appointment in doc.get('upcomingAppointments', []):
-        print("doc appointments", appointment)
-        if appointment.get('link') == meetLink:
-            print("found in doc......")
-            appointment['prescription'] = file_url  # Add prescription link
-            appointment_found = True
-            break
-
-    # If not found in upcomingAppointments, check completedMeets
-    if not appointment_found:
-        for appointment in pat.get('completedMeets', []):
-            if appointment.get('link') == meetLink:
-                print("found in completedMeets (patient)......")
-                appointment['prescription'] = file_url  # Add prescription link
-                appointment_found = True
-                break
+    # The worker uploads, records and delivers the PDF stored with the job
+    data = f.read(PRESCRIPTION_MAX_BYTES + 1)
+    if len(data) > PRESCRIPTION_MAX_BYTES:
+        return jsonify({"error": "Prescription file is too large"}), 413
 
-        for appointment in doc.get('completedMeets', []):
-            if appointment.get('link') == meetLink:
-                print("found in completedMeets (doctor)......")
-                appointment['prescription'] = file_url  # Add prescription link
-                appointment_found = True
-                break
-
-    # If appointment was found, update the database
-    if appointment_found:
-        patients.update_one({'email': pemail}, {"$set": {"upcomingAppointments": pat.get('upcomingAppointments', []), "completedMeets": pat.get('completedMeets', [])}})
-        doctors.update_one({'email': demail}, {"$set": {"upcomingAppointments": doc.get('upcomingAppointments', []), "completedMeets": doc.get('completedMeets', [])}})
-
-    # Prepare the email message
-    msg = Message(
-        "Receipt cum Prescription for your Consultancy",
-        recipients=[pemail]
-    )
-    
-    # Render the email HTML template with patient's username
-    msg.html = render_template('email.html', Name=pat['username'])
-    
-    # Prepare and send the WhatsApp message with the PDF link
-    whatsapp_message({
-        "to": f"whatsapp:{pat['phone']}",
-        "body": f"Thank you for taking our consultancy. Please find your prescription here: {file_url}",
+    job_id = jobs.enqueue('prescription', {
+        'demail': demail,
+        'pemail': pemail,
+        'meetLink': meetLink,
+        'file': data,
     })
-    
-    # Attach the receipt PDF to the email message
-    with app.open_resource(file_path) as fp:
-        msg.attach("Receipt.pdf", "application/pdf", fp.read())
-    thread = Thread(target=send_message_async, args=(msg,))
-    thread.start()
+    return jsonify({"message": "Prescription queued", "job_id": job_id}), 202
 
-    # Delete the local file after sending the email
-    try:
-        os.remove(file_path)
-    except Exception as e:
-        print(f"Error deleting file: {e}")
-    
-    return jsonify({"message": "Success"}), 200
+@api.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({
+        "job_id": job_id,
+        "status": job['status'],
+        "attempts": job['attempts'],
+        "steps": list(job.get('steps', {})),
+        "error": job.get('last_error'),
+        "result": job.get('result'),
+    }), 200
 
 # ----------- appointment routes -----------------
 
-@app.route('/doctor_apo', methods=['POST', 'PUT'])
+def book_slot(link, demail, date, time, instant=False, **fields):
+    """
+    Reserves the doctor's slot and books the appointment in one transaction.
+    Scheduled slots must fall within the doctor's working hours; instant
+    meets only need the doctor to be free. An instant meet for a link that
+    is already booked (joining a scheduled meet) keeps the original slot.
+
+    :raises SlotConflict: if the slot is taken or outside working hours
+    :raises ValueError: if the date or time can't be parsed
+    """
+    def book(session):
+        if instant and appointments.find(link, session=session):
+            return appointments.book(link, session=session, demail=demail, **fields)
+        schedule = None if instant else schedules.get(demail, session)
+        start, end = schedules.slot(date, time, instant, schedule)
+        if schedule is not None and not schedules.within_hours(schedule, start, end):
+            raise SlotConflict(f"{date} {time} is outside the doctor's working hours")
+        schedules.reserve(demail, link, start, end, session)
+        if instant:
+            fields['kind'] = 'instant'
+        try:
+            return appointments.book(link, session=session, demail=demail, date=date, time=time, starts_at=start, ends_at=end, **fields)
+        except Exception:
+            if session is None:
+                # No transaction to abort; give the slot back by hand
+                schedules.release(demail, link)
+            raise
+
+    try:
+        return run_in_transaction(client, book, MONGO_TRANSACTIONS)
+    except ScheduleCreated:
+        # The schedule exists now, so the second attempt updates it
+        return run_in_transaction(client, book, MONGO_TRANSACTIONS)
+
+@api.route('/doctor_apo', methods=['POST', 'PUT'])
 def doctor_apo():
     data = request.get_json()
     email = data['demail']
-    doc = doctors.find_one({'email': email})
 
     if request.method == 'POST':
-        return jsonify({'message': 'Doctor Appointments', 'upcomingAppointments': doc['upcomingAppointments']}), 200
+        return jsonify({'message': 'Doctor Appointments', 'upcomingAppointments': appointments.list('doctor', email)}), 200
     else:
-        doc['upcomingAppointments'].append({
-            "date": data['date'],
-            "time": data['time'],
-            "patient": data['patient'],
-            "demail": data['demail'],
-            "link": data['link'],
-        })
-        doctors.update_one({'email': email}, {'$set': {'upcomingAppointments': doc['upcomingAppointments']}})
+        booking = {"patient": data['patient']}
+        if data.get('pemail'):
+            booking['pemail'] = data['pemail']
+        try:
+            appointment = book_slot(data['link'], data['demail'], data['date'], data['time'], **booking)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        publish_appointment(appointment)
         return jsonify({
             'message': 'Doctor status updated successfully',
-            'upcomingAppointments': doc['upcomingAppointments']
+            'upcomingAppointments': appointments.list('doctor', email)
         }), 200
 
-@app.route('/update_doctor_ratings', methods=['PUT'])
+@api.route('/update_doctor_ratings', methods=['PUT'])
 def doctor_app():
     data = request.get_json()
 
@@ -502,72 +856,62 @@ def doctor_app():
     # Validate required fields
     if not all([pemail, demail, meet_link, stars]):
         return jsonify({'error': 'Missing required fields'}), 400
+    try:
+        stars = int(stars)
+    except (TypeError, ValueError):
+        stars = 0
+    if not 1 <= stars <= 5:
+        return jsonify({'error': 'Stars must be between 1 and 5'}), 400
+
+    def complete(session):
+        # Update doctor's ratings, appointment count, average rating and star
+        # histogram, reading back the username in the same round trip for the
+        # snapshot and the new rating for the leaderboard
+        doctor = doctors.find_one_and_update(
+            {'email': demail},
+            rating_update(stars),
+            projection=dict(LEADERBOARD_FIELDS, _id=0, username=1),
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if not doctor:
+            raise LookupError('Doctor rating update failed')
+
+        # Atomically move the upcoming appointment to completed with its stars
+        # and both usernames
+        patient = patients.find_one({'email': pemail}, {'username': 1, '_id': 0}, session=session) or {}
+        names = {'doctor': doctor.get('username', 'Unknown'), 'patient': patient.get('username', 'Unknown')}
+        appointment = appointments.complete(meet_link, demail, pemail, stars, names, session=session)
+        if not appointment:
+            if session is None:
+                # No transaction to abort; undo the rating by hand
+                doctors.update_one({'email': demail}, rating_update(stars, count=-1))
+            raise LookupError('Appointment does not exist or is already completed')
+        # The meet is over; free whatever remains of its slot
+        schedules.release(demail, meet_link, session)
+        return doctor, appointment
 
-    # Find patient's upcoming appointment
-    patient_doc = patients.find_one({'email': pemail, 'upcomingAppointments.link': meet_link})
-    if not patient_doc:
-        return jsonify({'error': 'Patient not found or appointment does not exist'}), 404
-
-    # Find doctor's upcoming appointment
-    doctor_doc = doctors.find_one({'email': demail, 'upcomingAppointments.link': meet_link})
-    if not doctor_doc:
-        return jsonify({'error': 'Doctor not found or appointment does not exist'}), 404
-
-    # Retrieve the appointment object from patient's record
-    appointment = next(
-        (appt for appt in patient_doc.get('upcomingAppointments', []) if appt['link'] == meet_link),
-        None
-    )
-
-    if not appointment:
-        return jsonify({'error': 'Appointment details not found'}), 404
-
-    # Add stars to appointment
-    appointment['stars'] = stars
-
-    # Remove appointment from patient's upcomingAppointments
-    patients.update_one(
-        {'email': pemail},
-        {'$pull': {'upcomingAppointments': {'link': meet_link}}}
-    )
-
-    # Remove appointment from doctor's upcomingAppointments
-    doctors.update_one(
-        {'email': demail},
-        {'$pull': {'upcomingAppointments': {'link': meet_link}}}
-    )
-
-    # Append to patient's completedMeet
-    patients.update_one(
-        {'email': pemail},
-        {'$push': {'completedMeets': appointment}}
-    )
-
-    # Append to doctor's completedMeet
-    doctors.update_one(
-        {'email': demail},
-        {'$push': {'completedMeets': appointment}}
-    )
-
-    # Update doctor's ratings and appointment count
-    rating_update = doctors.update_one(
-        {'email': demail},
-        {'$inc': {'appointments': 1, 'stars': stars}}
-    )
-
-    if rating_update.matched_count == 0:
-        return jsonify({'error': 'Doctor rating update failed'}), 404
+    try:
+        doctor, appointment = run_in_transaction(client, complete, MONGO_TRANSACTIONS)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    publish_appointment(appointment)
+    leaderboard.record(dict(doctor, email=demail))
+    doctor_directory.invalidate()
 
     return jsonify({'message': 'Appointment completed and ratings updated successfully'}), 200
 
-@app.route('/set_appointment', methods=['POST', 'PUT'])
+@api.route('/set_appointment', methods=['POST', 'PUT'])
 def set_appointment():
     data = request.get_json()
     demail = data['demail']
     pemail = data['pemail']
 
-    doc = doctors.find_one({'email': demail})
-    pat = patients.find_one({'email': pemail})
+    found = profiles.get_many([demail, pemail])
+    doc = found.get(demail)
+    pat = found.get(pemail)
+    if not doc or doc['usertype'] != 'doctor' or not pat or pat['usertype'] != 'patient':
+        return jsonify({"error": "Doctor or Patient not found"}), 404
 
     whatsapp_message({
         "to": f"whatsapp:{pat['phone']}",
@@ -578,26 +922,41 @@ def set_appointment():
         'message': 'Appoitment Fixed Successfully', 
     }), 200
 
-@app.route('/patient_apo', methods=['POST', 'PUT'])
+@api.route('/patient_apo', methods=['POST', 'PUT'])
 def patient_apo():
     data = request.get_json()
     email = data['email']
-    pat = patients.find_one({'email': email})
 
     if request.method == 'POST':
-        return jsonify({'message': 'Patient Appointments', 'appointments': pat['upcomingAppointments']}), 200
+        return jsonify({'message': 'Patient Appointments', 'appointments': appointments.list('patient', email)}), 200
     else:
-        pat['upcomingAppointments'].append({
-            "date": data['date'],
-            "time": data['time'],
-            "doctor": data['doctor'],
-            "demail": data['demail'],
-            "link": data['link'],
-        })
-        patients.update_one({'email': email}, {'$set': {'upcomingAppointments': pat['upcomingAppointments']}})
+        try:
+            appointment = book_slot(data['link'], data['demail'], data['date'], data['time'], doctor=data['doctor'], pemail=email)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        publish_appointment(appointment)
         return jsonify({'message': 'Patient status updated successfully'}), 200
     
-@app.route('/completed_meets', methods=['POST'])
+@api.route('/calendar/<role>/<view>', methods=['GET'])
+def calendar(role, view):
+    # ?email=<user>&date=<YYYY-MM-DD inside the day, week or month>
+    email = request.args.get('email')
+    if role not in ('doctor', 'patient') or not email:
+        return jsonify({'error': 'role must be doctor or patient and email is required'}), 400
+    try:
+        day = datetime.date.fromisoformat(request.args['date']) if 'date' in request.args else datetime.datetime.now(schedules.tz).date()
+        start, end = calendar_range(view, day, schedules.tz)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Appointments are streamed off the index in order instead of being
+    # collected into one list first
+    found = appointments.calendar(role, email, start, end)
+    return Response(stream_with_context(stream_json({'from': start, 'to': end}, 'appointments', found)), mimetype='application/json')
+
+COMPLETED_MEETS_BATCH = 500
+
+@api.route('/completed_meets', methods=['POST'])
 def completed_meets():
     data = request.get_json()
 
@@ -606,126 +965,170 @@ def completed_meets():
 
     useremail = data['useremail']
 
-    # Check if user is a doctor
-    doctor = doctors.find_one({'email': useremail}, {'completedMeets': 1, '_id': 0})
-    if doctor:
-        completed_meets = doctor.get('completedMeets', [])
-        
-        # Fetch patient usernames
-        for meet in completed_meets:
-            patient = patients.find_one({'email': meet.get('pemail')}, {'username': 1, '_id': 0})
-            meet['patient'] = patient.get('username', 'Unknown') if patient else 'Unknown'
-        
-        return jsonify({"completedMeets": completed_meets}), 200
-
-    # Check if user is a patient
-    patient = patients.find_one({'email': useremail}, {'completedMeets': 1, '_id': 0})
-    if patient:
-        completed_meets = patient.get('completedMeets', [])
-        
-        # Fetch doctor usernames
-        for meet in completed_meets:
-            doctor = doctors.find_one({'email': meet.get('demail')}, {'username': 1, '_id': 0})
-            meet['doctor'] = doctor.get('username', 'Unknown') if doctor else 'Unknown'
-        
-        return jsonify({"completedMeets": completed_meets}), 200
+    user = replica_directory.find_by_email(useremail, {'_id': 1})
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+    usertype = user['usertype']
 
-    return jsonify({"error": "User not found"}), 404
+    # Optional keyset pagination and YYYY-MM-DD date range
+    limit = data.get('limit')
+    try:
+        completed_meets, next_cursor = appointment_history.completed_page(
+            usertype, useremail,
+            limit=int(limit) if limit else COMPLETED_MEETS_BATCH,
+            cursor=data.get('cursor'),
+            date_from=data.get('from'),
+            date_to=data.get('to'),
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor, limit or date"}), 400
+
+    # Usernames are snapshotted at completion; older meets are filled in with one batched query
+    counterparts = replica_patients if usertype == 'doctor' else replica_doctors
+    fill_counterpart_names(completed_meets, usertype, counterparts)
+
+    if limit:
+        return jsonify({"completedMeets": completed_meets, "next_cursor": next_cursor}), 200
+
+    # Without a limit the whole history is returned, streamed a batch at a time
+    def remaining(page, cursor):
+        yield from page
+        while cursor:
+            page, cursor = appointment_history.completed_page(
+                usertype, useremail, limit=COMPLETED_MEETS_BATCH, cursor=cursor,
+                date_from=data.get('from'), date_to=data.get('to'),
+            )
+            fill_counterpart_names(page, usertype, counterparts)
+            yield from page
+
+    meets = remaining(completed_meets, next_cursor)
+    return Response(stream_with_context(stream_json({}, 'completedMeets', meets)), mimetype='application/json')
 
 # ----------- meeting routes -----------------
 
-@app.route('/make_meet', methods=['POST', 'PUT'])
+@api.route('/make_meet', methods=['POST', 'PUT'])
 def make_meet():
     data = request.get_json()
     demail = data.get('demail') or data.get('email')
 
     # Validate required fields for PUT request
     if request.method == 'PUT':
-        doctors.update_one({'email': demail}, {'$set': {'link': {'link': data['link'], "name": data['patient']}}})
-
-        required_fields = ['demail', 'pemail', 'date', 'time', 'link']
-        if not all(field in data for field in required_fields):
+        required_fields = ['demail', 'pemail', 'link']
+        if not all(field in data for field in required_fields) or not ('starts_at' in data or ('date' in data and 'time' in data)):
             return jsonify({'error': 'Missing required fields'}), 400
 
-        # Add meet link to doctor's profile
-        doctors.update_one(
-            {'email': demail},
-            {'$set': {'link': {'link': data['link'], 'name': data['patient']}}}
-        )
-
-        # Add to doctor's upcoming appointments
-        doctors.update_one(
-            {'email': demail},
-            {'$push': {'upcomingAppointments': {
-                'demail': data['demail'],
-                'pemail': data['pemail'],
-                'date': data['date'],
-                'time': data['time'],
-                'link': data['link']
-            }}}
-        )
+        # Publish the meet link on the doctor's presence
+        presence.update(demail, link={'link': data['link'], 'name': data.get('patient', '')})
 
-        # Add to patient's upcoming appointments
-        patients.update_one(
-            {'email': data['pemail']},
-            {'$push': {'upcomingAppointments': {
-                'demail': data['demail'],
-                'pemail': data['pemail'],
-                'date': data['date'],
-                'time': data['time'],
-                'link': data['link']
-            }}}
-        )
+        # Add to the doctor's and patient's upcoming appointments
+        try:
+            # One client timestamp, so the date and time can't come from different timezones
+            if 'starts_at' in data:
+                date, time = schedules.local_date_time(parse_timestamp(data['starts_at']))
+            else:
+                date, time = data['date'], data['time']
+            appointment = book_slot(
+                data['link'],
+                data['demail'],
+                date,
+                time,
+                instant=True,
+                pemail=data['pemail'],
+                patient=data.get('patient', ''),
+            )
+        except (ValueError, SlotConflict) as e:
+            presence.update(demail, unset=('link',))
+            status = 409 if isinstance(e, SlotConflict) else 400
+            return jsonify({'error': str(e)}), status
+        publish_appointment(appointment)
 
         return jsonify({'message': 'Meet link created and appointments updated successfully'}), 200
 
     # Handle POST request: Retrieve doctor's meet link
     else:
-        doc = doctors.find_one({'email': demail})
-        return jsonify({'message': 'Meet link', 'link': doc.get('link', None)}), 200
+        return jsonify({'message': 'Meet link', 'link': presence.get(demail).get('link')}), 200
     
-@app.route('/meet_status', methods=['POST'])
+@api.route('/meet_status', methods=['POST'])
 def meet_status():
     data = request.get_json()
     user = data['email']
-    details = doctors.find_one({'email': user})
+    details = presence.get(user)
     if details['meet'] == True:
         return jsonify({'message': 'Doctor is already in a meet', 'link': details.get('link', '')}), 208
     else:
         if data.get('link', '') == '':
-            doctors.update_one({'email': user}, {'$set': {'meet': True}})
+            presence.update(user, meet=True)
         else:
-            doctors.update_one({'email': user}, {'$set': {'meet': True, 'link': data['link']}})
+            presence.update(user, meet=True, link=data['link'])
         return jsonify({'message': 'Doctor status updated successfully'}), 200
 
-@app.route('/delete_meet', methods=['PUT'])
+@api.route('/delete_meet', methods=['PUT'])
 def delete_meet():
     data = request.get_json()
     email = data['email']
-    doctors.update_one({'email': email}, {'$unset': {'link': None, 'currentlyInMeet': None}})
-    doctors.update_one({'email': email}, {'$set': {'meet': False}})
+    current = presence.get(email)
+    presence.update(email, unset=('link', 'currentlyInMeet'), meet=False)
+
+    # The doctor never joined an instant meet: free their slot again
+    if current.get('link') and not current.get('currentlyInMeet'):
+        link = current['link']['link']
+        if appointments.cancel(link, kind='instant'):
+            schedules.release(email, link)
 
     return jsonify({'message': 'Meet link deleted successfully'}), 200
 
-@app.route('/currently_in_meet', methods=['POST', 'PUT'])
+@api.route('/currently_in_meet', methods=['POST', 'PUT'])
 def currently_in_meet():
     data = request.get_json()
     email = data['email']
     if request.method == 'PUT':
-        doctors.update_one({'email': email}, {'$set': {'currentlyInMeet': True}})
+        presence.update(email, currentlyInMeet=True)
         return jsonify({'message': 'Currently in meet'}), 200
     else:
-        doc = doctors.find_one({'email': email})
-        return jsonify({'message': 'Currently in meet', 'curmeet': doc.get('currentlyInMeet', False)}), 200
+        return jsonify({'message': 'Currently in meet', 'curmeet': presence.get(email)['currentlyInMeet']}), 200
  
-@app.route("/doctor_avilability", methods=['PUT'])
+@api.route("/doctor_avilability", methods=['PUT'])
 def doctor_avilability():
     data = request.get_json()
     demail = data['demail']
-    doctors.update_one({'email': demail}, {'$set': {'status': 'online'}})
+    presence.heartbeat(demail)
     return jsonify({'message': 'Doctor status updated successfully'}), 200
+
+@api.route('/events', methods=['GET'])
+def stream_events():
+    # Server-Sent Events replacing the meet_status/make_meet/currently_in_meet polls.
+    # ?email=<user>&role=doctor|patient[&watch=<doctor email>...]
+    email = request.args.get('email')
+    role = request.args.get('role')
+    if not email or role not in ('doctor', 'patient'):
+        return jsonify({'message': 'email and role (doctor or patient) are required'}), 400
+
+    watched = set(request.args.getlist('watch'))
+    if role == 'doctor':
+        watched.add(email)
+    channels = [channel_for(role, email)] + [channel_for('presence', d) for d in watched]
+    subscription = events.subscribe(channels)
+
+    # Start every stream with the current presence of the watched doctors
+    current = presence.get_many(list(watched))
+    initial = [('presence', dict(current[d], email=d)) for d in watched]
+
+    return Response(
+        stream_with_context(sse_stream(events, subscription, initial)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@api.route('/heartbeat', methods=['PUT'])
+def heartbeat():
+    # Sent periodically by a logged-in doctor's dashboard to stay online
+    data = request.get_json()
+    presence.heartbeat(data['email'])
+    return jsonify({'message': 'Heartbeat received', 'ttl': presence.ttl}), 200
  
-@app.route('/update_details', methods=['PUT'])
+UPDATED_USER_PROJECTION = dict(LEADERBOARD_FIELDS, _id=0, username=1, gender=1, phone=1, age=1, profile_picture=1)
+
+@api.route('/update_details', methods=['PUT'])
 def update_details():
     data = None
     email = None
@@ -762,7 +1165,10 @@ def update_details():
         if 'specialization' in data:
             update_data['specialization'] = data['specialization']
         if 'fee' in data:
-            update_data['fee'] = data['fee']
+            try:
+                update_data['fee'] = parse_fee(data['fee'])
+            except ValueError:
+                return jsonify({'message': 'Fee must be a number'}), 400
         if 'doctorId' in data:
             update_data['doctorId'] = data['doctorId']
     else:  # usertype == 'patient'
@@ -771,30 +1177,38 @@ def update_details():
 
     # Handle password update separately
     if 'passwd' in data and data['passwd']:
-        hashed_password = bcrypt.generate_password_hash(data['passwd']).decode('utf-8')
+        hashed_password = hasher.hash(data['passwd'])
         update_data['passwd'] = hashed_password
 
-    # Update in MongoDB
+    if not update_data:
+        return jsonify({'message': 'No changes made'}), 200
+
+    # Update and read back the changed user in one round trip
     collection = doctors if usertype == 'doctor' else patients
-    result = collection.update_one({'email': email}, {'$set': update_data})
+    updated_user = collection.find_one_and_update(
+        {'email': email},
+        {'$set': update_data},
+        projection=UPDATED_USER_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
 
     # Check if a document was updated
-    if result.matched_count == 0:
+    if updated_user is None:
         return jsonify({'message': 'User Not Found'}), 404
+    profiles.put(updated_user, usertype)
+    if usertype == 'doctor':
+        doctor_directory.invalidate()
+        if 'specialization' in update_data:
+            leaderboard.record(updated_user)
 
-    if result.modified_count > 0:
-        updated_user = collection.find_one({'email': email}) 
+    response = {'message': f'{usertype.capitalize()} details updated successfully'}
 
-        response = {'message': f'{usertype.capitalize()} details updated successfully'}
+    # Add only existing fields to the response
+    for field in ["username", "usertype", "gender", "phone", "email", "age", "profile_picture"]:
+        if field in updated_user:
+            response[field] = updated_user[field]
 
-        # Add only existing fields to the response
-        for field in ["username", "usertype", "gender", "phone", "email", "age", "profile_picture"]:
-            if field in updated_user:
-                response[field] = updated_user[field]
-
-        return jsonify(response), 200
-    else:
-        return jsonify({'message': 'No changes made'}), 200 
+    return jsonify(response), 200
 
     
 # @app.route('/get_wallet', methods=['POST'])
@@ -809,23 +1223,24 @@ def update_details():
 #         return jsonify({'message': 'Wallet', 'wallet': var.get('wallet', 0)}), 200
 
 #------------ Website feedback route ------------------------------
-@app.route('/website_feedback', methods=['POST'])
+@api.route('/website_feedback', methods=['POST'])
 def save_website_feedback():
     if not request.is_json:
         return jsonify({"msg": "Missing JSON in request"}), 400
     data = request.get_json()
    
     user_email = data.get("email")
-    rating = data.get("rating", 0)
     comments = data.get("comments", "")
     feedback_type = data.get("feedback_type", "")
     timestamp = data.get("timestamp", "")
     keep_it_anonymous = data.get("keep_it_anonymous", False)
+    try:
+        rating = parse_rating(data.get("rating"))
+    except ValueError:
+        return jsonify({"error": "Rating must be a whole number from 1 to 5"}), 400
+
+    user = profiles.get(user_email)
 
-    user = patients.find_one({"email": user_email}, {"_id": 0, "username": 1, "profile_picture": 1})
-    if not user :
-       user = doctors.find_one({"email": user_email}, {"_id": 0, "username": 1, "profile_picture": 1})
-    
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -841,30 +1256,52 @@ def save_website_feedback():
     }
 
     try:
-        website_feedback.insert_one(feedback_entry)
-        return jsonify({"message": "Feedback Saved Successfully"}), 200
+        # The entry and its type's rollup are written together
+        feedback_id = run_in_transaction(client, lambda session: feedback.submit(feedback_entry, session), MONGO_TRANSACTIONS)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-        
-@app.route('/website_feedback/<id>', methods=['GET'])
-def get_website_feedback(id):
+    if rating == 5 and comments:
+        featured_feedback.invalidate()
+    return jsonify({"message": "Feedback Saved Successfully", "id": str(feedback_id)}), 200
+
+@api.route('/website_feedback', methods=['GET'])
+def list_website_feedback():
+    # Newest first: ?type=&rating=|min_rating=&limit=&cursor=<next_cursor of the previous page>
     try:
-        object_id = ObjectId(id)
-        result = website_feedback.find({'_id': object_id}, {"_id": 0})
-
-        if result:
-            if result.get("keep_it_anonymous"):
-                result.pop("username", None)
-                result.pop("user_email", None)
-            return jsonify({"message": "Feedback found", "data": result}), 200
-        else:
-            return jsonify({"message": "Feedback Not Found"}), 404    
+        rating = parse_rating(request.args['rating']) if request.args.get('rating') else None
+        min_rating = parse_rating(request.args['min_rating']) if request.args.get('min_rating') else None
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        entries, next_cursor = feedback.list(
+            feedback_type=request.args.get('type'),
+            rating=rating,
+            min_rating=min_rating,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"feedback": [public_feedback(entry) for entry in entries], "next_cursor": next_cursor}), 200
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+@api.route('/website_feedback/stats', methods=['GET'])
+def website_feedback_stats():
+    return jsonify(feedback.stats()), 200
+
+@api.route('/website_feedback/featured', methods=['GET'])
+def featured_website_feedback():
+    resp = jsonify({"feedback": featured_feedback.get()})
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+@api.route('/website_feedback/<id>', methods=['GET'])
+def get_website_feedback(id):
+    result = feedback.get(id)
+    if result:
+        return jsonify({"message": "Feedback found", "data": public_feedback(result)}), 200
+    else:
+        return jsonify({"message": "Feedback Not Found"}), 404    
     
 # ----------- Contact Us routes -----------------
-@app.route('/contact', methods=['POST'])
+@api.route('/contact', methods=['POST'])
 def contact():
     data = request.json
     try:
@@ -881,7 +1318,14 @@ def contact():
             Message: {data['message']}
             """
         )
-        mail.send(msg)
+        outbox.send(msg)
         return jsonify({"message": "Message sent successfully"}), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/outbox/stats', methods=['GET'])
+def outbox_stats():
+    return jsonify(outbox.stats()), 200
+
+# WSGI entry point for wsgi.py, index.py and gunicorn (app:app)
+app = create_app()
@@ -0,0 +1,100 @@
+"""
+Cold start budget: time to import app.py and serve a first request in a
+fresh interpreter, as a serverless cold start or a new gunicorn worker
+would. Fails if the median import goes over --budget-ms, or if importing
+the app created a MongoDB client or initialized Firebase.
+
+DBURL points at an unroutable address, so anything that waits on MongoDB
+during import or on "/" shows up as a multi-second outlier.
+
+Run from the backend directory:
+
+    python -m benchmarks.cold_start [--runs 5] [--budget-ms 1500]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import app as medicare
+imported = time.perf_counter()
+response = medicare.app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'status': response.status_code,
+    'mongo_connected': medicare.client.connected,
+    'firebase_imported': 'firebase_admin' in sys.modules,
+    'cloudinary_imported': 'cloudinary' in sys.modules,
+}))
+'''
+
+
+def run_probe(env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    result = subprocess.run(command, env=env, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        # Nested imports are indented by two spaces per level
+        if not name[1:].startswith(' '):
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=1500)
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports to list')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DBURL'] = 'mongodb://192.0.2.1:27017/?serverSelectionTimeoutMS=5000'
+
+    # The first run also warms the bytecode cache, like a deployed image would have
+    run_probe(env)
+    samples = [run_probe(env)[0] for _ in range(args.runs)]
+    _, importtime = run_probe(env, importtime=True)
+
+    imports = [s['import_ms'] for s in samples]
+    first = [s['first_request_ms'] for s in samples]
+    print(f"import       median {statistics.median(imports):8.1f} ms  max {max(imports):8.1f} ms  (budget {args.budget_ms:.0f} ms)")
+    print(f"first '/'    median {statistics.median(first):8.1f} ms  max {max(first):8.1f} ms")
+    print("slowest top-level imports (cumulative):")
+    for cumulative_us, name in slowest_imports(importtime, args.top):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if statistics.median(imports) > args.budget_ms:
+        failures.append(f"import took {statistics.median(imports):.0f} ms, budget is {args.budget_ms:.0f} ms")
+    if any(s['status'] != 200 for s in samples):
+        failures.append("'/' didn't return 200")
+    if any(s['mongo_connected'] for s in samples):
+        failures.append("a MongoDB client was created before any request needed one")
+    if any(s['firebase_imported'] for s in samples):
+        failures.append("firebase_admin was imported at startup")
+    if any(s['cloudinary_imported'] for s in samples):
+        failures.append("cloudinary was imported at startup")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Shows that listing completed meets costs a constant number of database
+commands as a doctor's history grows.
+
+Run from the backend directory against a local mongod:
+
+    python -m benchmarks.completed_meets [--url mongodb://localhost:27017]
+"""
+import argparse
+import datetime
+import time
+import pymongo
+from pymongo import monitoring
+from utils.appointments import Appointments, fill_counterpart_names, COMPLETED
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def seed(db, meets, snapshot_ratio):
+    db.appointments.delete_many({})
+    db.patients.delete_many({})
+    patients = [{'email': f'patient{i}@bench.local', 'username': f'Patient {i}'} for i in range(max(meets // 4, 1))]
+    db.patients.insert_many(patients)
+    docs = []
+    for i in range(meets):
+        starts_at = datetime.datetime(2024, 1 + i % 12, 1 + i % 28, 8 + i % 10)
+        doc = {
+            'link': f'/instant-meet?meetId=bench{i}',
+            'demail': 'doctor@bench.local',
+            'pemail': patients[i % len(patients)]['email'],
+            'date': starts_at.date().isoformat(),
+            'time': starts_at.strftime('%H:%M'),
+            'starts_at': starts_at,
+            'status': COMPLETED,
+            'stars': 1 + i % 5,
+        }
+        # Older meets were completed before usernames were snapshotted
+        if i < meets * snapshot_ratio:
+            doc['patient'] = patients[i % len(patients)]['username']
+        docs.append(doc)
+    db.appointments.insert_many(docs)
+    db.appointments.create_index([('demail', 1), ('status', 1), ('starts_at', 1), ('_id', 1)])
+    db.patients.create_index('email', unique=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='mongodb://localhost:27017')
+    parser.add_argument('--sizes', default='10,100,1000,2000')
+    parser.add_argument('--snapshot-ratio', type=float, default=0.5)
+    args = parser.parse_args()
+
+    counter = CommandCounter()
+    client = pymongo.MongoClient(args.url, event_listeners=[counter])
+    db = client.get_database('medicare_bench')
+    appointments = Appointments(db.appointments)
+
+    print(f"{'meets':>8} {'commands':>9} {'ms':>8}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        seed(db, size, args.snapshot_ratio)
+        counter.count = 0
+        start = time.perf_counter()
+        meets, _ = appointments.completed_page('doctor', 'doctor@bench.local')
+        fill_counterpart_names(meets, 'doctor', db.patients)
+        elapsed = (time.perf_counter() - start) * 1000
+        assert len(meets) == size
+        print(f"{size:>8} {counter.count:>9} {elapsed:>8.1f}")
+
+    client.drop_database('medicare_bench')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Latency of /doctors/search queries over a synthetic doctor directory, with
+random filters, every sort, and pages reached by following keyset cursors.
+Also reports any query whose plan needs an in-memory SORT or a COLLSCAN.
+
+Run from the backend directory against a local mongod:
+
+    python -m benchmarks.doctor_search [--url mongodb://localhost:27017] [--doctors 100000]
+"""
+import argparse
+import random
+import time
+import pymongo
+from utils.doctor_search import DoctorSearch, SORTS, PROJECTION
+from utils.indexes import ensure_indexes, _plan_stages
+
+SPECIALIZATIONS = ['Cardiology', 'Dermatology', 'Neurology', 'Pediatrics', 'Orthopedics',
+                   'Psychiatry', 'Oncology', 'Gynecology', 'ENT', 'General Physician']
+
+
+def seed(db, count, batch_size=10000):
+    db.doctors.drop()
+    rng = random.Random(42)
+    batch = []
+    for i in range(count):
+        appointments = rng.randint(0, 500)
+        stars = round(rng.uniform(1, 5) * appointments)
+        batch.append({
+            'email': f'doctor{i}@bench.local',
+            'username': f'Doctor {i}',
+            'specialization': rng.choice(SPECIALIZATIONS),
+            'gender': rng.choice(['male', 'female']),
+            'phone': '0',
+            'fee': float(rng.randrange(100, 2000, 50)),
+            'appointments': appointments,
+            'stars': stars,
+            'rating': stars / appointments if appointments else 0,
+            'status': 'online' if rng.random() < 0.1 else 'offline',
+            'verified': rng.random() < 0.95,
+        })
+        if len(batch) >= batch_size:
+            db.doctors.insert_many(batch)
+            batch = []
+    if batch:
+        db.doctors.insert_many(batch)
+    ensure_indexes(db)
+
+
+def random_filters(rng):
+    filters = {}
+    if rng.random() < 0.6:
+        filters['specialization'] = rng.choice(SPECIALIZATIONS)
+    if rng.random() < 0.3:
+        filters['gender'] = rng.choice(['male', 'female'])
+    if rng.random() < 0.3:
+        filters['min_fee'] = float(rng.randrange(100, 1000, 50))
+    if rng.random() < 0.3:
+        filters['max_fee'] = float(rng.randrange(1000, 2000, 50))
+    if rng.random() < 0.2:
+        filters['online'] = True
+    if rng.random() < 0.3:
+        filters['min_rating'] = rng.choice([3.0, 3.5, 4.0, 4.5])
+    return filters
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='mongodb://localhost:27017')
+    parser.add_argument('--doctors', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.url)
+    db = client.get_database('medicare_bench')
+    start = time.perf_counter()
+    seed(db, args.doctors)
+    print(f"Seeded {args.doctors} doctors in {time.perf_counter() - start:.1f}s")
+
+    search = DoctorSearch(db.doctors)
+    rng = random.Random(7)
+    print(f"{'sort':<14} {'requests':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    in_memory = set()
+    for sort, (field, direction) in SORTS.items():
+        samples = []
+        for _ in range(args.queries):
+            filters = random_filters(rng)
+            plan = (db.doctors.find(search.query(**filters), PROJECTION)
+                    .sort([(field, direction), ('_id', direction)])
+                    .limit(args.limit + 1).explain())
+            stages = set(_plan_stages(plan['queryPlanner']['winningPlan']))
+            if stages & {'SORT', 'COLLSCAN'}:
+                in_memory.add((sort, tuple(sorted(filters)), tuple(sorted(stages & {'SORT', 'COLLSCAN'}))))
+
+            cursor = None
+            for _ in range(args.pages):
+                begin = time.perf_counter()
+                _, cursor = search.search(sort=sort, limit=args.limit, cursor=cursor, **filters)
+                samples.append((time.perf_counter() - begin) * 1000)
+                if not cursor:
+                    break
+        print(f"{sort:<14} {len(samples):>9} {percentile(samples, 50):>8.2f} {percentile(samples, 95):>8.2f} {percentile(samples, 99):>8.2f}")
+
+    for sort, filters, stages in sorted(in_memory):
+        print(f"  {sort} with {', '.join(filters) or 'no filters'}: {', '.join(stages)}")
+
+    client.drop_database('medicare_bench')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Keeps benchmarks that seed and drop data away from real deployments: they
+use their own database (BENCH_DB) and refuse a MongoDB URL that isn't on
+this machine unless --allow-remote is passed.
+"""
+import sys
+
+BENCH_DB = 'medicare_bench'
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def hosts(url):
+    """Host names in a mongodb:// URL, without ports or credentials."""
+    rest = url.split('://', 1)[-1]
+    rest = rest.split('/', 1)[0].split('?', 1)[0]
+    rest = rest.rsplit('@', 1)[-1]
+    found = []
+    for node in rest.split(','):
+        if node.startswith('['):
+            found.append(node[1:node.find(']')])
+        else:
+            found.append(node.split(':', 1)[0])
+    return found
+
+
+def is_local(url):
+    # An SRV record always points somewhere else
+    if url.startswith('mongodb+srv://'):
+        return False
+    return all(host in LOCAL_HOSTS for host in hosts(url))
+
+
+def add_remote_flag(parser):
+    parser.add_argument('--allow-remote', action='store_true',
+                        help=f'run against a non-local MongoDB (only the {BENCH_DB} database is touched)')
+
+
+def refuse_remote(url, allow_remote):
+    if not allow_remote and not is_local(url):
+        sys.exit(f"refusing to run against {', '.join(hosts(url))}: pass --allow-remote to use a non-local MongoDB")
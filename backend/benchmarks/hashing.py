@@ -0,0 +1,50 @@
+"""
+Measures password checks per second (the CPU cost of a login) as the
+hashing pool grows.
+
+Run from the backend directory:
+
+    python -m benchmarks.hashing [--workers 1,2,4,8] [--logins 200] [--rounds 12]
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.hashing import PasswordHasher
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--concurrency', type=int, default=32, help='simulated request threads')
+    args = parser.parse_args()
+
+    results = []
+    for workers in (int(w) for w in args.workers.split(',')):
+        hasher = PasswordHasher(workers=workers, rounds=args.rounds, max_pending=args.concurrency, timeout=60)
+        hashed = hasher.hash('correct horse battery staple')
+        # Warm up every worker process before timing
+        list(ThreadPoolExecutor(workers).map(lambda _: hasher.check(hashed, 'warmup'), range(workers)))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            ok = list(pool.map(lambda _: hasher.check(hashed, 'correct horse battery staple'), range(args.logins)))
+        elapsed = time.perf_counter() - start
+        assert all(ok)
+
+        stats = hasher.stats()
+        results.append({
+            'workers': workers,
+            'logins_per_sec': round(args.logins / elapsed, 1),
+            'avg_wait_ms': round(stats['avg_wait_ms'], 2),
+            'avg_total_ms': round(stats['avg_total_ms'], 1),
+        })
+        hasher._pool().shutdown()
+
+    print(json.dumps({'rounds': args.rounds, 'logins': args.logins, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
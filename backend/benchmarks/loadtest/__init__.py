@@ -0,0 +1,24 @@
+"""
+Load test for the backend API.
+
+Boots app.py in-process against a local mongod with Firebase, Cloudinary,
+SMTP and WhatsApp stubbed out, seeds synthetic doctors, patients and
+appointment histories, then has concurrent virtual users run the
+register -> login -> get_status -> make_meet -> update_doctor_ratings
+scenario. The JSON report holds RPS,
+latency percentiles and MongoDB commands per request for each step, so
+runs can be diffed across commits.
+
+Run from the backend directory:
+
+    python -m benchmarks.loadtest --users 20 --iterations 50
+    python -m benchmarks.loadtest --users 2 --iterations 5 --bcrypt-rounds 4   # smoke run
+
+A real mongod is needed: mongomock lacks $unionWith, which the user
+directory's lookups use. Pass --no-transactions for a standalone mongod.
+Reports are written to loadtest-<commit>.json by default; diff two of
+them to compare commits.
+
+Seeding replaces the collections of the medicare_bench database, never the
+application's; non-local URLs are refused unless --allow-remote is passed.
+"""
@@ -0,0 +1,106 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from ..guard import add_remote_flag, refuse_remote
+from .harness import boot
+from .scenario import STEPS, run
+from .seed import seed
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(samples, seconds):
+    latencies = sorted(s[0] for s in samples)
+    errors = {}
+    for _, status, _ in samples:
+        if status >= 400:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'rps': round(len(samples) / seconds, 2) if seconds else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'db_ops_per_request': round(sum(s[2] for s in samples) / len(samples), 2) if samples else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest')
+    parser.add_argument('--url', default='mongodb://localhost:27017/?replicaSet=rs0')
+    parser.add_argument('--no-transactions', action='store_true', help='for a standalone mongod')
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--patients', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=20, help='completed appointments per seeded patient')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=20, help='scenario passes per user')
+    parser.add_argument('--duration', type=float, help='run for this many seconds instead of --iterations')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--out', help='report path (default loadtest-<commit>.json)')
+    add_remote_flag(parser)
+    args = parser.parse_args()
+    refuse_remote(args.url, args.allow_remote)
+
+    medicare, counter = boot(args.url, transactions=not args.no_transactions, bcrypt_rounds=args.bcrypt_rounds)
+    medicare.ensure_indexes(medicare.db)
+    scale = seed(medicare.db, medicare.hasher, args.doctors, args.patients, args.history)
+    medicare.doctor_directory.invalidate()
+    print(f"seeded {scale['doctors']} doctors, {scale['patients']} patients, {scale['appointments']} appointments")
+
+    recorder, seconds = run(
+        medicare.app, counter, args.users, args.doctors,
+        iterations=None if args.duration else args.iterations, duration=args.duration,
+    )
+
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'transactions': medicare.MONGO_TRANSACTIONS,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'users': args.users,
+            'iterations': None if args.duration else args.iterations,
+            'duration': args.duration,
+            'seed': scale,
+        },
+        'seconds': round(seconds, 3),
+        'mongo_pool': medicare.pool_metrics.stats(),
+        'overall': summarize([s for step in STEPS for s in recorder.samples[step]], seconds),
+        'steps': {step: summarize(recorder.samples[step], seconds) for step in STEPS},
+    }
+    path = args.out or f'loadtest-{commit}.json'
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    print(f"{'step':<24} {'reqs':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'db ops':>7}  errors")
+    for name, row in [('overall', report['overall'])] + list(report['steps'].items()):
+        print(f"{name:<24} {row['requests']:>6} {row['rps'] or 0:>8} {row['p50_ms'] or 0:>8} {row['p95_ms'] or 0:>8} "
+              f"{row['p99_ms'] or 0:>8} {row['db_ops_per_request'] or 0:>7}  {row['errors'] or ''}")
+    print(f"report written to {path}")
+    sys.exit(1 if report['overall']['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import os
+import threading
+from pymongo import monitoring
+from ..guard import BENCH_DB
+
+
+class ThreadCommandCounter(monitoring.CommandListener):
+    """
+    Counts MongoDB commands per thread. Virtual users call the app through
+    Flask's test client on their own thread, so the count a user sees
+    across one request is that request's commands. Background workers
+    (outbox, presence flushes) run on other threads and are left out.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def started(self, event):
+        self._local.count = self.count() + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class NullTransport:
+    """WhatsApp transport that drops messages."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, to, body):
+        self.sent += 1
+        return f'loadtest-{self.sent}'
+
+
+def boot(url, transactions=True, bcrypt_rounds=12):
+    """
+    Imports app.py against the BENCH_DB database at `url` with every
+    external service stubbed.
+
+    :return: (app module, ThreadCommandCounter)
+    """
+    counter = ThreadCommandCounter()
+    monitoring.register(counter)
+    os.environ['DBURL'] = url
+    os.environ['MONGO_DB'] = BENCH_DB
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(bcrypt_rounds)
+    os.environ['MONGO_TRANSACTIONS'] = 'true' if transactions else 'false'
+    os.environ.pop('TWILIO_ACCOUNT_SID', None)
+    os.environ.pop('REDIS_URL', None)
+
+    import app as medicare
+
+    # Firebase certificates: nothing to fetch, tokens aren't used by the scenario
+    medicare.token_verifier.certificates.set({})
+    # Cloudinary
+    medicare.upload_file = lambda file, folder='medicare': 'https://res.cloudinary.com/loadtest/image/upload/stub.png'
+    # SMTP: flask_mail records messages instead of sending them
+    medicare.app.extensions['mail'].suppress = True
+    # WhatsApp
+    medicare.whatsapp.transport = NullTransport()
+    return medicare, counter
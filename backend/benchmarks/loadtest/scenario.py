@@ -0,0 +1,80 @@
+import datetime
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .seed import doctor_email
+
+STEPS = ('register', 'login', 'get_status', 'make_meet', 'update_doctor_ratings')
+
+
+class Recorder:
+    """Collects (step, seconds, status, db commands) samples from every virtual user."""
+
+    def __init__(self):
+        self.samples = {step: [] for step in STEPS}
+        self._lock = threading.Lock()
+
+    def add(self, step, seconds, status, commands):
+        with self._lock:
+            self.samples[step].append((seconds, status, commands))
+
+
+def virtual_user(http, counter, recorder, user, users, doctors, iterations, deadline, run_id):
+    """
+    One user's loop over the scenario. Each user books only its own doctors
+    (user, user + users, ...), so concurrent users never compete for a slot;
+    409s in the report mean the slot engine rejected a booking it shouldn't.
+    """
+    own = list(range(user, doctors, users)) or [user % doctors]
+    i = 0
+    while (iterations is None or i < iterations) and (deadline is None or time.perf_counter() < deadline):
+        email = f'lt-{run_id}-{user}-{i}@loadtest.local'
+        demail = doctor_email(own[i % len(own)])
+        link = f'/instant-meet?meetId=lt-{run_id}-{user}-{i}'
+        now = datetime.datetime.now()
+        steps = (
+            ('register', lambda: http.post('/register', data={
+                'registerer': 'patient', 'email': email, 'passwd': 'loadtest-password',
+                'username': f'Load {user}-{i}', 'phone': '9000000000', 'gender': 'female', 'age': '30',
+            })),
+            ('login', lambda: http.post('/login', json={'email': email, 'passwd': 'loadtest-password'})),
+            ('get_status', lambda: http.get('/get_status')),
+            ('make_meet', lambda: http.put('/make_meet', json={
+                'demail': demail, 'pemail': email, 'patient': f'Load {user}-{i}',
+                'date': now.date().isoformat(), 'time': now.strftime('%H:%M'), 'link': link,
+            })),
+            ('update_doctor_ratings', lambda: http.put('/update_doctor_ratings', json={
+                'demail': demail, 'pemail': email, 'meetLink': link, 'stars': 1 + (user + i) % 5,
+            })),
+        )
+        for step, send in steps:
+            before = counter.count()
+            start = time.perf_counter()
+            response = send()
+            recorder.add(step, time.perf_counter() - start, response.status_code, counter.count() - before)
+            # A failed step ends this iteration; later steps depend on it
+            if response.status_code >= 400:
+                break
+        i += 1
+
+
+def run(app, counter, users, doctors, iterations=None, duration=None):
+    """
+    Runs `users` concurrent virtual users, each for `iterations` passes of
+    the scenario or until `duration` seconds have passed.
+
+    :return: (Recorder, wall clock seconds)
+    """
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        futures = [
+            pool.submit(virtual_user, app.test_client(), counter, recorder, user, users, doctors, iterations, deadline, run_id)
+            for user in range(users)
+        ]
+        for future in futures:
+            future.result()
+    return recorder, time.perf_counter() - start
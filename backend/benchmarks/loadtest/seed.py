@@ -0,0 +1,76 @@
+import datetime
+import random
+from ..guard import BENCH_DB
+
+SPECIALIZATIONS = ['Cardiology', 'Dermatology', 'Neurology', 'Pediatrics', 'Orthopedics',
+                   'Psychiatry', 'Oncology', 'Gynecology', 'ENT', 'General Physician']
+PASSWORD = 'loadtest-password'
+
+
+def doctor_email(i):
+    return f'doctor{i}@loadtest.local'
+
+
+def patient_email(i):
+    return f'patient{i}@loadtest.local'
+
+
+def seed(db, hasher, doctors=200, patients=1000, history=20, batch_size=5000, seed=42):
+    """
+    Replaces the doctors, patients and appointments collections of the
+    benchmark database with synthetic data: verified doctors with ratings,
+    patients sharing one password, and `history` completed appointments
+    per patient.
+
+    :return: counts of what was inserted
+    :raises ValueError: if `db` isn't the benchmark database
+    """
+    if db.name != BENCH_DB:
+        raise ValueError(f"Refusing to seed {db.name}; the load test only writes to {BENCH_DB}")
+    rng = random.Random(seed)
+    for name in ('doctors', 'patients', 'appointments', 'schedules', 'password_resets'):
+        db[name].delete_many({})
+    passwd = hasher.hash(PASSWORD)
+
+    docs = []
+    for i in range(doctors):
+        appointments = rng.randint(0, 300)
+        stars = round(rng.uniform(1, 5) * appointments)
+        docs.append({
+            'email': doctor_email(i), 'username': f'Doctor {i}', 'passwd': passwd,
+            'specialization': rng.choice(SPECIALIZATIONS), 'gender': rng.choice(['male', 'female']),
+            'phone': f'98{rng.randrange(10 ** 8):08d}', 'fee': float(rng.randrange(100, 2000, 50)),
+            'appointments': appointments, 'stars': stars, 'rating': stars / appointments if appointments else 0,
+            'status': 'offline', 'verified': True, 'meet': False, 'doctorId': str(i),
+        })
+    db.doctors.insert_many(docs)
+
+    for start in range(0, patients, batch_size):
+        db.patients.insert_many([{
+            'email': patient_email(i), 'username': f'Patient {i}', 'passwd': passwd,
+            'age': str(rng.randint(18, 80)), 'gender': rng.choice(['male', 'female']),
+            'phone': f'97{rng.randrange(10 ** 8):08d}', 'meet': False,
+        } for i in range(start, min(start + batch_size, patients))])
+
+    now = datetime.datetime.utcnow()
+    batch = []
+    total = 0
+    for i in range(patients):
+        for j in range(history):
+            d = rng.randrange(doctors)
+            starts_at = now - datetime.timedelta(days=rng.randint(1, 365), hours=rng.randint(0, 10))
+            batch.append({
+                'link': f'/instant-meet?meetId=seed-{i}-{j}', 'demail': doctor_email(d), 'pemail': patient_email(i),
+                'doctor': f'Doctor {d}', 'patient': f'Patient {i}',
+                'date': starts_at.date().isoformat(), 'time': starts_at.strftime('%H:%M'),
+                'starts_at': starts_at, 'ends_at': starts_at + datetime.timedelta(hours=1),
+                'status': 'completed', 'stars': rng.randint(1, 5), 'created_at': starts_at,
+            })
+            if len(batch) >= batch_size:
+                db.appointments.insert_many(batch)
+                total += len(batch)
+                batch = []
+    if batch:
+        db.appointments.insert_many(batch)
+        total += len(batch)
+    return {'doctors': doctors, 'patients': patients, 'appointments': total}
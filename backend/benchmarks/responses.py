@@ -0,0 +1,93 @@
+"""
+Bytes on the wire and serialization time for the largest JSON responses,
+comparing Flask's default encoder with orjson and identity with gzip and
+brotli. Payloads are synthetic but shaped like each route's response.
+
+Run from the backend directory:
+
+    python -m benchmarks.responses [--rows 2000]
+"""
+import argparse
+import datetime
+import gzip
+import json
+import random
+import time
+from utils.responses import dumps_bytes, orjson, brotli
+
+
+def get_status(rows, rng):
+    return {'details': [{
+        'email': f'doctor{i}@example.com', 'status': rng.choice(['online', 'offline']),
+        'username': f'Doctor {i}', 'specialization': rng.choice(['Cardiology', 'Dermatology', 'Neurology']),
+        'gender': rng.choice(['male', 'female']), 'phone': f'98{rng.randrange(10 ** 8):08d}',
+        'isInMeet': False, 'noOfAppointments': rng.randrange(500), 'noOfStars': rng.randrange(2500),
+        'id': i + 1, 'fee': float(rng.randrange(100, 2000, 50)),
+    } for i in range(rows)]}
+
+
+def appointment(i, rng):
+    starts_at = datetime.datetime(2024, 1, 1) + datetime.timedelta(hours=i)
+    return {
+        'link': f'/instant-meet?meetId={1700000000000 + i}&selectedDoc=Doctor&selectedMail=doctor%40example.com'
+                f'&name=Patient {i}&age=30&gender=female&pemail=patient{i}@example.com&fee=500',
+        'demail': 'doctor@example.com', 'pemail': f'patient{i}@example.com',
+        'doctor': 'Doctor', 'patient': f'Patient {i}',
+        'date': starts_at.date().isoformat(), 'time': starts_at.strftime('%H:%M'),
+        'starts_at': starts_at, 'ends_at': starts_at + datetime.timedelta(hours=1),
+        'status': 'upcoming', 'created_at': starts_at - datetime.timedelta(days=rng.randrange(30)),
+    }
+
+
+def doctor_apo(rows, rng):
+    return {'message': 'Doctor Appointments', 'upcomingAppointments': [appointment(i, rng) for i in range(rows)]}
+
+
+def completed_meets(rows, rng):
+    meets = []
+    for i in range(rows):
+        meet = appointment(i, rng)
+        meet.update(status='completed', stars=rng.randint(1, 5), prescription=f'https://res.cloudinary.com/medicare/raw/upload/v1/{i}.pdf')
+        meets.append(meet)
+    return {'completedMeets': meets}
+
+
+def flask_default(obj):
+    # What Flask's DefaultJSONProvider does: sorted keys, ASCII only, http-date datetimes
+    return json.dumps(obj, sort_keys=True, ensure_ascii=True, default=lambda v: v.strftime('%a, %d %b %Y %H:%M:%S GMT')).encode()
+
+
+def timed(fn, obj, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(obj)
+        best = min(best, time.perf_counter() - start)
+    return body, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"encoder: {'orjson' if orjson else 'json (orjson not installed)'}, brotli: {'yes' if brotli else 'not installed'}")
+    print(f"{'route':<18} {'flask ms':>9} {'new ms':>7} {'raw B':>9} {'gzip B':>8} {'br B':>8} {'gzip ms':>8} {'br ms':>7}")
+    for name, build in (('get_status', get_status), ('doctor_apo', doctor_apo), ('patient_apo', doctor_apo), ('completed_meets', completed_meets)):
+        payload = build(args.rows, rng)
+        _, default_ms = timed(flask_default, payload, args.repeat)
+        body, new_ms = timed(dumps_bytes, payload, args.repeat)
+        gzipped, gzip_ms = timed(lambda b: gzip.compress(b, compresslevel=6), body, args.repeat)
+        if brotli:
+            brotlied, br_ms = timed(lambda b: brotli.compress(b, quality=5), body, args.repeat)
+            br = f"{len(brotlied):>8} {br_ms:>7.2f}"
+        else:
+            br = f"{'-':>8} {'-':>7}"
+        br_bytes, br_time = br.split()
+        print(f"{name:<18} {default_ms:>9.2f} {new_ms:>7.2f} {len(body):>9} {len(gzipped):>8} {br_bytes:>8} {gzip_ms:>8.2f} {br_time:>7}")
+
+
+if __name__ == '__main__':
+    main()
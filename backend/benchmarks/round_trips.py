@@ -0,0 +1,128 @@
+"""
+Counts the database commands each write-heavy route sends per request and
+fails if any route goes over its budget, so extra round trips don't creep
+back into these endpoints.
+
+Run from the backend directory against a local replica set (transactions
+need one; pass --no-transactions for a standalone mongod):
+
+    python -m benchmarks.round_trips [--url mongodb://localhost:27017/?replicaSet=rs0]
+
+It seeds and then drops the medicare_bench database; non-local URLs are
+refused unless --allow-remote is passed.
+
+Only commands issued by the request thread are counted; background work
+(mail outbox, presence flushes, job workers) is left out.
+"""
+import argparse
+import os
+import sys
+import threading
+from pymongo import monitoring
+from .guard import BENCH_DB, add_remote_flag, refuse_remote
+
+# Route -> most commands it may send for one request
+BUDGETS = {
+    'login': 1,
+    'verify': 1,
+    'forgot_password': 3,
+    'reset_password': 2,
+    # existing-link check, slot reservation, booking, commit
+    'make_meet PUT': 4,
+    # working hours, slot reservation, booking, commit, listing
+    'doctor_apo PUT': 5,
+    # patient name, rating, completion, slot release, commit
+    'update_doctor_ratings': 5,
+}
+
+
+class RequestThreadCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.thread = None
+        self.count = 0
+        self.commands = []
+
+    def reset(self):
+        self.thread = threading.get_ident()
+        self.count = 0
+        self.commands = []
+
+    def started(self, event):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+            self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='mongodb://localhost:27017/?replicaSet=rs0')
+    parser.add_argument('--no-transactions', action='store_true')
+    add_remote_flag(parser)
+    args = parser.parse_args()
+    refuse_remote(args.url, args.allow_remote)
+
+    counter = RequestThreadCounter()
+    monitoring.register(counter)
+    os.environ['DBURL'] = args.url
+    os.environ['MONGO_DB'] = BENCH_DB
+    os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+    os.environ['MONGO_TRANSACTIONS'] = 'false' if args.no_transactions else 'true'
+    import app as medicare
+
+    medicare.client.drop_database(BENCH_DB)
+    medicare.ensure_indexes(medicare.db)
+    medicare.patients.insert_one({
+        'email': 'patient@bench.local', 'username': 'Patient', 'gender': 'female',
+        'phone': '0', 'passwd': medicare.hasher.hash('secret'),
+    })
+    medicare.doctors.insert_one({
+        'email': 'doctor@bench.local', 'username': 'Doctor', 'appointments': 0, 'stars': 0,
+    })
+    # Steady state: the doctor already has a schedule document
+    medicare.db.schedules.insert_one({'demail': 'doctor@bench.local', 'booked': []})
+    http = medicare.app.test_client()
+
+    def measure(name, send):
+        counter.reset()
+        response = send()
+        assert response.status_code < 400, (name, response.status_code, response.get_json())
+        return name, counter.count, list(counter.commands)
+
+    booking = {'demail': 'doctor@bench.local', 'pemail': 'patient@bench.local', 'patient': 'Patient',
+               'date': '2024-05-01', 'time': '10:00', 'link': '/instant-meet?meetId=bench'}
+    results = [
+        measure('login', lambda: http.post('/login', json={'email': 'patient@bench.local', 'passwd': 'secret'})),
+        measure('verify', lambda: http.post('/verify', json={'email': 'doctor@bench.local'})),
+        measure('forgot_password', lambda: http.post('/forgot_password', json={'email': 'patient@bench.local'})),
+    ]
+    # Only the token's hash is stored, so issue one whose raw value we know
+    token = medicare.password_resets.issue('patient@bench.local', 'patient')
+    results += [
+        measure('reset_password', lambda: http.post(f'/reset_password/{token}', json={'password': 'secret2'})),
+        measure('make_meet PUT', lambda: http.put('/make_meet', json=booking)),
+        measure('doctor_apo PUT', lambda: http.put('/doctor_apo', json=booking)),
+        measure('update_doctor_ratings', lambda: http.put('/update_doctor_ratings', json={
+            'demail': 'doctor@bench.local', 'pemail': 'patient@bench.local',
+            'meetLink': booking['link'], 'stars': 4,
+        })),
+    ]
+
+    over = 0
+    print(f"{'route':<24} {'commands':>8} {'budget':>7}  sent")
+    for name, count, commands in results:
+        flag = '' if count <= BUDGETS[name] else '  OVER BUDGET'
+        over += bool(flag)
+        print(f"{name:<24} {count:>8} {BUDGETS[name]:>7}  {', '.join(commands)}{flag}")
+
+    medicare.client.drop_database(BENCH_DB)
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Books appointments into random slots across many doctors from several
+threads at once, then checks that no doctor ended up with overlapping
+bookings and times free-slot queries.
+
+Run from the backend directory against a local replica set (pass
+--no-transactions for a standalone mongod):
+
+    python -m benchmarks.slot_booking [--url mongodb://localhost:27017/?replicaSet=rs0]
+"""
+import argparse
+import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pymongo
+from utils.appointments import Appointments
+from utils.db import run_in_transaction
+from utils.indexes import ensure_indexes
+from utils.schedule import Schedules, SlotConflict, SlotIndex
+
+SLOT_TIMES = ['08:00', '09:00', '10:00', '11:00', '12:00', '15:00', '16:00', '17:00', '18:00']
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='mongodb://localhost:27017/?replicaSet=rs0')
+    parser.add_argument('--no-transactions', action='store_true')
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.url, maxPoolSize=args.threads * 2)
+    db = client.get_database('medicare_bench')
+    db.schedules.drop()
+    db.appointments.drop()
+    ensure_indexes(db)
+    schedules = Schedules(db.schedules)
+    appointments = Appointments(db.appointments)
+    first_day = datetime.date.today() + datetime.timedelta(days=1)
+
+    def book(i):
+        rng = random.Random(i)
+        demail = f'doctor{rng.randrange(args.doctors)}@bench.local'
+        date = (first_day + datetime.timedelta(days=rng.randrange(args.days))).isoformat()
+        slot_time = rng.choice(SLOT_TIMES)
+        link = f'/instant-meet?meetId=bench{i}'
+
+        def write(session):
+            start, end = schedules.slot(date, slot_time)
+            schedules.reserve(demail, link, start, end, session)
+            appointments.book(link, session=session, demail=demail, pemail=f'patient{i}@bench.local',
+                              date=date, time=slot_time, starts_at=start, ends_at=end)
+
+        begin = time.perf_counter()
+        try:
+            run_in_transaction(client, write, not args.no_transactions)
+            booked = True
+        except SlotConflict:
+            booked = False
+        return booked, (time.perf_counter() - begin) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        results = list(pool.map(book, range(args.bookings), chunksize=100))
+    elapsed = time.perf_counter() - start
+
+    latencies = [ms for _, ms in results]
+    accepted = sum(1 for booked, _ in results if booked)
+    print(f"{args.bookings} attempts in {elapsed:.1f}s ({args.bookings / elapsed:.0f}/s), "
+          f"{accepted} booked, {args.bookings - accepted} rejected as conflicts")
+    print(f"booking latency ms: p50 {percentile(latencies, 50):.2f}  p95 {percentile(latencies, 95):.2f}  p99 {percentile(latencies, 99):.2f}")
+
+    # Every accepted booking is in exactly one schedule and none overlap
+    intervals = 0
+    for schedule in db.schedules.find({}, {'booked': 1}):
+        booked = schedule['booked']
+        intervals += len(booked)
+        index = SlotIndex(booked)
+        assert all(index.ends[k] <= index.starts[k + 1] for k in range(len(booked) - 1)), schedule['_id']
+    assert intervals == accepted == db.appointments.count_documents({}), (intervals, accepted)
+    print(f"verified {intervals} non-overlapping bookings")
+
+    rng = random.Random(0)
+    samples = []
+    for _ in range(1000):
+        begin = time.perf_counter()
+        schedules.free_slots(f'doctor{rng.randrange(args.doctors)}@bench.local', first_day, 7)
+        samples.append((time.perf_counter() - begin) * 1000)
+    print(f"free_slots (7 days) ms: p50 {percentile(samples, 50):.2f}  p99 {percentile(samples, 99):.2f}")
+
+    client.drop_database('medicare_bench')
+
+
+if __name__ == '__main__':
+    main()
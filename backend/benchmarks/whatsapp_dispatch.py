@@ -0,0 +1,87 @@
+"""
+Drives the WhatsApp dispatcher against a local stand-in for the Twilio API
+and reports how many HTTP requests were needed for a burst of messages.
+
+Run from the backend directory against a local mongod:
+
+    python -m benchmarks.whatsapp_dispatch [--messages 1000] [--recipients 50]
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import pymongo
+from utils.jobs import QUEUED, RUNNING
+from utils.whatsapp import TwilioTransport, WhatsAppDispatcher
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    requests = 0
+    lock = Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with StandInHandler.lock:
+            StandInHandler.requests += 1
+            sid = f"SM{StandInHandler.requests:032d}"
+        body = json.dumps({'sid': sid}).encode()
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='mongodb://localhost:27017')
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--recipients', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--window', type=float, default=0.5)
+    args = parser.parse_args()
+
+    server = start_stand_in()
+    client = pymongo.MongoClient(args.url)
+    collection = client.get_database('medicare_bench').whatsapp_queue
+    collection.delete_many({})
+
+    transport = TwilioTransport('ACbench', 'token', 'whatsapp:+10000000000',
+                                base_url=f"http://127.0.0.1:{server.server_port}", pool_size=args.workers)
+    dispatcher = WhatsAppDispatcher(collection, transport, workers=args.workers,
+                                    coalesce_window=args.window, poll_interval=0.05)
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        dispatcher.send({'to': f"whatsapp:+9100000{i % args.recipients:05d}", 'body': f"Message {i}"})
+    enqueue_ms = (time.perf_counter() - start) * 1000
+
+    time.sleep(args.window)
+    while collection.count_documents({'status': {'$in': [QUEUED, RUNNING]}}):
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'messages': args.messages,
+        'recipients': args.recipients,
+        'http_requests': StandInHandler.requests,
+        'enqueue_ms': round(enqueue_ms, 1),
+        'drain_seconds': round(elapsed, 2),
+    }, indent=2))
+
+    server.shutdown()
+    client.drop_database('medicare_bench')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import base64
+import datetime
+import json
+import os
+import sys
+import pymongo
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.server_api import ServerApi
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from utils.schedule import Schedules, calendar_range, clinic_timezone, local_to_utc
+
+load_dotenv()
+
+UPCOMING = 'upcoming'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+
+# Appointment fields owned by one side of the booking; everything else is
+# shared and only written when the appointment is first created.
+SIDE_FIELDS = ('doctor', 'patient', 'prescription', 'stars')
+
+# The counterpart of each role: (email field, username field)
+COUNTERPART = {
+    'doctor': ('pemail', 'patient'),
+    'patient': ('demail', 'doctor'),
+}
+
+
+def encode_cursor(appointment):
+    starts_at = appointment.get('starts_at')
+    key = [starts_at.isoformat() if starts_at else None, str(appointment['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        starts_at, oid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(starts_at) if starts_at else None, ObjectId(oid)
+    except (TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class Appointments:
+    """
+    Appointments stored one document per meet link in their own collection,
+    instead of embedded upcomingAppointments/completedMeets arrays.
+
+    Listings are ordered by `starts_at`, the UTC start; appointments booked
+    before it existed get it from `python -m utils.appointments migrate-datetimes`.
+    """
+
+    def __init__(self, collection, tz=None):
+        self.collection = collection
+        self.tz = tz or clinic_timezone()
+
+    def book(self, link, session=None, **fields):
+        """
+        Creates the appointment for `link`, or merges `fields` into it when the
+        other side of the booking has already created it.
+
+        :return: the appointment after the write
+        """
+        update = {
+            '$set': fields,
+            '$setOnInsert': {'status': UPCOMING, 'created_at': datetime.datetime.utcnow()},
+        }
+        options = {'projection': {'_id': 0}, 'return_document': ReturnDocument.AFTER, 'session': session}
+        try:
+            return self.collection.find_one_and_update({'link': link}, update, upsert=True, **options)
+        except DuplicateKeyError:
+            # A concurrent upsert inserted the same link first; merge into it
+            return self.collection.find_one_and_update({'link': link}, update, **options)
+
+    def find(self, link, session=None):
+        return self.collection.find_one({'link': link}, {'_id': 0}, session=session)
+
+    def cancel(self, link, kind=None, session=None):
+        """
+        Cancels an upcoming appointment, optionally only one of the given kind.
+
+        :return: the cancelled appointment, or None if nothing matched
+        """
+        query = {'link': link, 'status': UPCOMING}
+        if kind:
+            query['kind'] = kind
+        return self.collection.find_one_and_update(
+            query,
+            {'$set': {'status': CANCELLED, 'cancelled_at': datetime.datetime.utcnow()}},
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+
+    def list(self, role, email, status=UPCOMING):
+        """
+        :param role: "doctor" or "patient"
+        :return: appointments with the given status, oldest first
+        """
+        field = 'demail' if role == 'doctor' else 'pemail'
+        cursor = self.collection.find({field: email, 'status': status}, {'_id': 0})
+        return list(cursor.sort([('starts_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]))
+
+    def calendar(self, role, email, start, end):
+        """
+        Appointments (upcoming and completed) starting in [start, end), in
+        chronological order, as a cursor so they can be streamed.
+
+        :param start: naive UTC datetime
+        :param end: naive UTC datetime
+        """
+        field = 'demail' if role == 'doctor' else 'pemail'
+        query = {field: email, 'starts_at': {'$gte': start, '$lt': end}, 'status': {'$ne': CANCELLED}}
+        return self.collection.find(query, {'_id': 0}).sort([('starts_at', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])
+
+    def completed_page(self, role, email, limit=None, cursor=None, date_from=None, date_to=None):
+        """
+        Completed appointments for a user, newest first, using keyset
+        pagination on (starts_at, _id).
+
+        :param cursor: value of `next_cursor` from the previous page
+        :param date_from: inclusive lower bound, a local YYYY-MM-DD date
+        :param date_to: inclusive upper bound, a local YYYY-MM-DD date
+        :return: (appointments, next_cursor)
+        :raises ValueError: for a malformed cursor or date
+        """
+        field = 'demail' if role == 'doctor' else 'pemail'
+        query = {field: email, 'status': COMPLETED}
+        if date_from or date_to:
+            query['starts_at'] = {}
+            if date_from:
+                query['starts_at']['$gte'] = calendar_range('day', datetime.date.fromisoformat(date_from), self.tz)[0]
+            if date_to:
+                query['starts_at']['$lt'] = calendar_range('day', datetime.date.fromisoformat(date_to), self.tz)[1]
+        if cursor:
+            starts_at, oid = decode_cursor(cursor)
+            query['$or'] = [
+                {'starts_at': {'$lt': starts_at}},
+                {'starts_at': starts_at, '_id': {'$lt': oid}},
+            ]
+
+        found = self.collection.find(query).sort([('starts_at', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)])
+        if limit:
+            found = found.limit(limit + 1)
+        page = list(found)
+
+        next_cursor = None
+        if limit and len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1])
+        for appointment in page:
+            del appointment['_id']
+        return page, next_cursor
+
+    def complete(self, link, demail, pemail, stars, names=None, session=None):
+        """
+        Atomically moves an upcoming appointment to completed.
+
+        :param names: username snapshot to store on the appointment, e.g.
+                      {'doctor': ..., 'patient': ...}
+        :return: the completed appointment, or None if no upcoming appointment
+                 matched (unknown link or already completed)
+        """
+        update = dict(names or {}, status=COMPLETED, stars=stars, completed_at=datetime.datetime.utcnow())
+        return self.collection.find_one_and_update(
+            {'link': link, 'demail': demail, 'pemail': pemail, 'status': UPCOMING},
+            {'$set': update},
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+
+    def set_prescription(self, link, url):
+        """
+        :return: the updated appointment, or None if there is none for `link`
+        """
+        return self.collection.find_one_and_update(
+            {'link': link},
+            {'$set': {'prescription': url}},
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+
+def fill_counterpart_names(meets, role, users):
+    """
+    Sets the counterpart's username on meets completed before usernames were
+    snapshotted, with one $in query regardless of how many meets there are.
+
+    :param role: role of the user the meets belong to
+    :param users: collection holding the counterparts (patients for a doctor)
+    """
+    email_field, name_field = COUNTERPART[role]
+    missing = {m.get(email_field) for m in meets if not m.get(name_field)}
+    missing.discard(None)
+    names = {}
+    if missing:
+        for user in users.find({'email': {'$in': list(missing)}}, {'email': 1, 'username': 1, '_id': 0}):
+            names[user['email']] = user.get('username', 'Unknown')
+    for meet in meets:
+        if not meet.get(name_field):
+            meet[name_field] = names.get(meet.get(email_field), 'Unknown')
+    return meets
+
+
+def _migration_op(owner_field, owner_email, appointment, status):
+    appointment = dict(appointment)
+    link = appointment.pop('link', None)
+    if not link:
+        return None
+
+    side = {k: appointment.pop(k) for k in SIDE_FIELDS if k in appointment}
+    side[owner_field] = owner_email
+    appointment.pop(owner_field, None)
+    on_insert = dict(appointment, created_at=datetime.datetime.utcnow())
+    try:
+        on_insert['starts_at'] = local_to_utc(appointment['date'], appointment['time'], clinic_timezone())
+    except (KeyError, TypeError, ValueError):
+        pass
+    if status == COMPLETED:
+        side['status'] = COMPLETED
+    else:
+        on_insert['status'] = UPCOMING
+    return UpdateOne({'link': link}, {'$set': side, '$setOnInsert': on_insert}, upsert=True)
+
+
+def migrate_embedded(db, unset=False, batch_size=500):
+    """
+    Copies the embedded upcomingAppointments/completedMeets arrays of every
+    doctor and patient into the appointments collection. Safe to re-run:
+    appointments are upserted by link.
+
+    :param unset: remove the embedded arrays once they have been copied
+    :return: number of embedded appointments processed
+    """
+    collection = db.appointments
+    processed = 0
+    for name, owner_field in (('doctors', 'demail'), ('patients', 'pemail')):
+        users = db[name]
+        query = {'$or': [{'upcomingAppointments.0': {'$exists': True}}, {'completedMeets.0': {'$exists': True}}]}
+        ops = []
+        for user in users.find(query, {'email': 1, 'upcomingAppointments': 1, 'completedMeets': 1}):
+            for key, status in (('upcomingAppointments', UPCOMING), ('completedMeets', COMPLETED)):
+                for appointment in user.get(key, []):
+                    op = _migration_op(owner_field, user['email'], appointment, status)
+                    if op:
+                        ops.append(op)
+                        processed += 1
+            if len(ops) >= batch_size:
+                collection.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            collection.bulk_write(ops, ordered=False)
+        if unset:
+            users.update_many(query, {'$unset': {'upcomingAppointments': '', 'completedMeets': ''}})
+    return processed
+
+
+def migrate_datetimes(db, tz=None, batch_size=500):
+    """
+    Parses the display `date` and `time` strings of appointments that have
+    no `starts_at` yet into a UTC datetime, reading them as local to `tz`
+    (CLINIC_TIMEZONE by default). Safe to re-run.
+
+    :return: (migrated, unparseable) counts; unparseable appointments are
+             left as they are and listed on stdout
+    """
+    tz = tz or clinic_timezone()
+    collection = db.appointments
+    ops = []
+    migrated = unparseable = 0
+    for appointment in collection.find({'starts_at': {'$exists': False}}, {'date': 1, 'time': 1, 'link': 1}):
+        try:
+            starts_at = local_to_utc(appointment['date'], appointment['time'], tz)
+        except (KeyError, TypeError, ValueError):
+            unparseable += 1
+            print(f"Can't parse date/time of {appointment.get('link')}: {appointment.get('date')!r} {appointment.get('time')!r}")
+            continue
+        ops.append(UpdateOne({'_id': appointment['_id']}, {'$set': {'starts_at': starts_at}}))
+        migrated += 1
+        if len(ops) >= batch_size:
+            collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+    return migrated, unparseable
+
+
+def backfill_schedules(db, now=None):
+    """
+    Adds the upcoming appointments booked before schedules existed to their
+    doctor's `booked` intervals, so new bookings can't overlap them. Run
+    after migrate_datetimes; appointments without `starts_at` are skipped.
+    Appointments without `ends_at` get the doctor's slot length (half an
+    hour for instant meets). Intervals already present for a link are
+    replaced, so it is safe to re-run and to run while bookings come in.
+
+    :return: (doctors, intervals) counts written
+    """
+    now = now or datetime.datetime.utcnow()
+    schedules = Schedules(db.schedules)
+    by_doctor = {}
+    found = db.appointments.find(
+        {'status': UPCOMING, 'starts_at': {'$exists': True}},
+        {'_id': 0, 'link': 1, 'demail': 1, 'starts_at': 1, 'ends_at': 1, 'kind': 1},
+    )
+    for appointment in found:
+        if appointment.get('demail'):
+            by_doctor.setdefault(appointment['demail'], []).append(appointment)
+
+    doctors = intervals = 0
+    for demail, upcoming in by_doctor.items():
+        slot_minutes = schedules.get(demail)['slot_minutes']
+        booked = []
+        for appointment in upcoming:
+            minutes = schedules.instant_minutes if appointment.get('kind') == 'instant' else slot_minutes
+            end = appointment.get('ends_at') or appointment['starts_at'] + datetime.timedelta(minutes=minutes)
+            if end > now:
+                booked.append({'start': appointment['starts_at'], 'end': end, 'link': appointment['link']})
+        if not booked:
+            continue
+        links = [interval['link'] for interval in booked]
+        # One pipeline update, so bookings made meanwhile aren't overwritten
+        db.schedules.update_one({'demail': demail}, [{'$set': {'booked': {'$sortArray': {
+            'input': {'$concatArrays': [
+                {'$filter': {
+                    'input': {'$ifNull': ['$booked', []]},
+                    'cond': {'$not': [{'$in': ['$$this.link', links]}]},
+                }},
+                booked,
+            ]},
+            'sortBy': {'start': 1},
+        }}}}], upsert=True)
+        doctors += 1
+        intervals += len(booked)
+    return doctors, intervals
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('migrate', 'migrate-datetimes', 'backfill-schedules'):
+        print("usage: python -m utils.appointments migrate [--unset] | migrate-datetimes | backfill-schedules")
+        sys.exit(1)
+    client = pymongo.MongoClient(os.getenv("DBURL"), server_api=ServerApi('1'))
+    if sys.argv[1] == 'migrate':
+        count = migrate_embedded(client.get_database(os.getenv("MONGO_DB", "medicare")), unset='--unset' in sys.argv)
+        print(f"Migrated {count} embedded appointments")
+    elif sys.argv[1] == 'migrate-datetimes':
+        migrated, unparseable = migrate_datetimes(client.get_database(os.getenv("MONGO_DB", "medicare")))
+        print(f"Added starts_at to {migrated} appointments ({unparseable} could not be parsed)")
+    else:
+        doctors, intervals = backfill_schedules(client.get_database(os.getenv("MONGO_DB", "medicare")))
+        print(f"Backfilled {intervals} upcoming appointments into {doctors} schedules")
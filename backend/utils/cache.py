@@ -0,0 +1,42 @@
+import time
+from threading import Lock
+
+
+class SnapshotCache:
+    """
+    Holds the result of `loader()` in process memory until it is invalidated
+    or `ttl` seconds have passed. The ttl bounds staleness for writes made by
+    other worker processes, which cannot invalidate this process' copy.
+    """
+
+    def __init__(self, loader, ttl=10):
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = Lock()
+        self._value = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        with self._lock:
+            if self._value is not None and time.monotonic() - self._loaded_at < self.ttl:
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            generation = self._generation
+
+        value = self.loader()
+
+        with self._lock:
+            # Don't store a snapshot that was invalidated while it was loading
+            if generation == self._generation:
+                self._value = value
+                self._loaded_at = time.monotonic()
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._value = None
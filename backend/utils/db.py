@@ -0,0 +1,201 @@
+"""
+MongoDB helpers: a lazily created, fork-safe client and transactions.
+
+pymongo clients start monitor threads and open sockets, neither of which
+survives fork, and creating one at import makes every cold start and every
+gunicorn worker pay for it before serving anything. LazyClient builds the
+client on first use in each process; LazyDatabase and LazyCollection can be
+handed to components at import time and resolve to the current process's
+client when they're used.
+"""
+import os
+from threading import Lock
+from pymongo.database import Database
+from pymongo.read_preferences import ReadPreference, SecondaryPreferred
+
+# Environment variable -> MongoClient option. Unset variables keep pymongo's
+# defaults; the pool limits apply per process, i.e. per gunicorn worker.
+CLIENT_OPTIONS = (
+    ('MONGO_MAX_POOL_SIZE', 'maxPoolSize', int),
+    ('MONGO_MIN_POOL_SIZE', 'minPoolSize', int),
+    ('MONGO_MAX_IDLE_TIME_MS', 'maxIdleTimeMS', int),
+    ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS', int),
+    ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS', int),
+    # e.g. "zstd,snappy,zlib"; zstd and snappy need their Python packages
+    ('MONGO_COMPRESSORS', 'compressors', str),
+    ('MONGO_ZLIB_COMPRESSION_LEVEL', 'zlibCompressionLevel', int),
+)
+
+# Smallest maxStalenessSeconds MongoDB accepts
+MIN_MAX_STALENESS = 90
+
+
+def client_options(environ=os.environ):
+    """
+    :return: MongoClient keyword arguments for the MONGO_* variables that are set
+    """
+    return {option: cast(environ[name]) for name, option, cast in CLIENT_OPTIONS if environ.get(name)}
+
+
+def replica_read_preference(environ=os.environ):
+    """
+    Read preference for read-only routes that tolerate replication lag:
+    secondaryPreferred when MONGO_SECONDARY_READS is true (bounded by
+    MONGO_MAX_STALENESS_SECONDS if set), primary otherwise.
+
+    MongoDB rejects a staleness bound under 90 seconds when the client is
+    created, which would fail every route, so smaller values are raised to
+    90; negative values and values that aren't whole seconds mean no bound.
+    """
+    if environ.get('MONGO_SECONDARY_READS', 'false').lower() != 'true':
+        return ReadPreference.PRIMARY
+    value = environ.get('MONGO_MAX_STALENESS_SECONDS')
+    max_staleness = -1
+    if value:
+        try:
+            max_staleness = int(value)
+        except ValueError:
+            print(f"Ignoring MONGO_MAX_STALENESS_SECONDS={value!r}: not a whole number of seconds")
+        else:
+            # -1 (or any negative value) means no bound
+            if 0 <= max_staleness < MIN_MAX_STALENESS:
+                print(f"Raising MONGO_MAX_STALENESS_SECONDS={value} to the minimum of {MIN_MAX_STALENESS}")
+                max_staleness = MIN_MAX_STALENESS
+    return SecondaryPreferred(max_staleness=max_staleness)
+
+
+class LazyClient:
+    """
+    Creates its MongoClient with `factory()` on first use in each process,
+    then calls every `on_connect(client)` hook once in that process.
+    Attribute access is forwarded to the process's client.
+    """
+
+    def __init__(self, factory, on_connect=()):
+        self._factory = factory
+        self.on_connect = list(on_connect)
+        self._client = None
+        self._pid = None
+        self._lock = Lock()
+        self._transactions = (None, None)
+
+    @property
+    def connected(self):
+        """Whether this process has created its client yet."""
+        return self._client is not None and self._pid == os.getpid()
+
+    def get(self):
+        if self._pid == os.getpid():
+            return self._client
+        with self._lock:
+            if self._pid == os.getpid():
+                return self._client
+            # A client inherited across fork is abandoned, not closed: closing
+            # it would touch sockets the parent still owns
+            self._client = self._factory()
+            self._pid = os.getpid()
+            client = self._client
+        for hook in self.on_connect:
+            hook(client)
+        return client
+
+    def supports_transactions(self):
+        """
+        Whether the deployment is a replica set or sharded cluster; a
+        standalone mongod has no multi-document transactions. Asked once
+        per process.
+        """
+        pid, supported = self._transactions
+        if pid != os.getpid():
+            hello = self.get().admin.command('hello')
+            supported = bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+            if not supported:
+                print("MongoDB is a standalone server; running without transactions (set MONGO_TRANSACTIONS to override)")
+            self._transactions = (os.getpid(), supported)
+        return supported
+
+    def database(self, name):
+        return LazyDatabase(self, name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __getitem__(self, name):
+        return self.get()[name]
+
+
+class LazyDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._cached = (None, None)
+
+    def get(self):
+        client = self.client.get()
+        cached_client, database = self._cached
+        if cached_client is not client:
+            database = client[self.name]
+            self._cached = (client, database)
+        return database
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        # Same rule as Database: methods are methods, anything else is a collection
+        if hasattr(Database, name):
+            return getattr(self.get(), name)
+        return LazyCollection(self, name)
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+
+class LazyCollection:
+    def __init__(self, database, name, options=None):
+        self.database = database
+        self.name = name
+        self.options = options or {}
+        self._cached = (None, None)
+
+    def get(self):
+        database = self.database.get()
+        cached_database, collection = self._cached
+        if cached_database is not database:
+            collection = database[self.name]
+            if self.options:
+                collection = collection.with_options(**self.options)
+            self._cached = (database, collection)
+        return collection
+
+    def with_options(self, **options):
+        """Collection.with_options, applied when the collection is used."""
+        return LazyCollection(self.database, self.name, dict(self.options, **options))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __getitem__(self, name):
+        return self.database[f'{self.name}.{name}']
+
+
+def run_in_transaction(client, fn, enabled=True):
+    """
+    Calls `fn(session)` inside a multi-document transaction, retrying on
+    transient errors. When transactions are disabled (a standalone mongod in
+    development) `fn(None)` is called directly.
+
+    :param enabled: None to use transactions only if the LazyClient's
+                    deployment supports them
+    :return: whatever `fn` returns; exceptions raised by `fn` abort the
+             transaction and propagate
+    """
+    if enabled is None:
+        enabled = client.supports_transactions()
+    if not enabled:
+        return fn(None)
+    with client.start_session() as session:
+        return session.with_transaction(fn)
@@ -0,0 +1,44 @@
+class UserDirectory:
+    """
+    Resolves a user across the patients and doctors collections in a single
+    round trip using a $unionWith aggregation. Matching documents carry a
+    `usertype` field ("patient" or "doctor"). Patients win over doctors when
+    the same email exists in both, matching the original lookup order.
+    """
+
+    def __init__(self, patients, doctors):
+        self.patients = patients
+        self.doctors = doctors
+
+    def _pipeline(self, query, projection=None):
+        def branch(usertype):
+            stages = [{'$match': query}]
+            if projection:
+                stages.append({'$project': projection})
+            stages.append({'$addFields': {'usertype': usertype}})
+            return stages
+
+        return branch('patient') + [
+            {'$unionWith': {'coll': self.doctors.name, 'pipeline': branch('doctor')}},
+        ]
+
+    def find_one(self, query, projection=None):
+        """
+        :param query: filter applied to both collections
+        :param projection: optional inclusion projection
+        :return: matching document with `usertype` set, or None
+        """
+        pipeline = self._pipeline(query, projection) + [{'$limit': 1}]
+        return next(self.patients.aggregate(pipeline), None)
+
+    def find_many(self, query, projection=None):
+        return list(self.patients.aggregate(self._pipeline(query, projection)))
+
+    def find_by_email(self, email, projection=None):
+        return self.find_one({'email': email}, projection)
+
+    def exists(self, email):
+        return self.find_by_email(email, {'_id': 1}) is not None
+
+    def collection_for(self, usertype):
+        return self.doctors if usertype == 'doctor' else self.patients
@@ -0,0 +1,172 @@
+import base64
+import json
+import os
+import sys
+import pymongo
+from pymongo.server_api import ServerApi
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Sort name -> (field, default direction)
+SORTS = {
+    'rating': ('rating', pymongo.DESCENDING),
+    'fee': ('fee', pymongo.ASCENDING),
+    'appointments': ('appointments', pymongo.DESCENDING),
+}
+
+# Fee shown for doctors who never set one (same default as /get_status)
+DEFAULT_FEE = 199
+
+PROJECTION = {
+    'email': 1, 'username': 1, 'specialization': 1, 'gender': 1, 'phone': 1,
+    'status': 1, 'meet': 1, 'appointments': 1, 'stars': 1, 'rating': 1, 'fee': 1,
+}
+
+
+def rating_update(stars, count=1):
+    """
+    Update pipeline that records `count` more completed appointments rated
+    `stars` each (count=-1 takes one back) and recomputes the stored average
+    `rating` and the 1-5 star histogram in `ratings` in the same write.
+    """
+    bucket = str(stars)
+    return [
+        {'$set': {
+            'appointments': {'$add': [{'$ifNull': ['$appointments', 0]}, count]},
+            'stars': {'$add': [{'$ifNull': ['$stars', 0]}, stars * count]},
+            'ratings': {'$mergeObjects': [
+                {'$ifNull': ['$ratings', {}]},
+                {bucket: {'$add': [{'$ifNull': [f'$ratings.{bucket}', 0]}, count]}},
+            ]},
+        }},
+        {'$set': {'rating': {'$cond': [
+            {'$gt': ['$appointments', 0]},
+            {'$divide': ['$stars', '$appointments']},
+            0,
+        ]}}},
+    ]
+
+
+def parse_fee(value):
+    """Fees arrive as form strings; store them as numbers so they sort and range-filter."""
+    if value in (None, ''):
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid fee: {value}")
+
+
+def encode_cursor(doctor, field):
+    key = [doctor.get(field), str(doctor['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value, oid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, ObjectId(oid)
+    except (TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class DoctorSearch:
+    """
+    Filtered, sorted search over verified doctors, paginated by keyset on
+    (sort field, _id) so every page is an index range scan regardless of how
+    deep it is. The doctor_search_* indexes in utils.indexes serve each sort
+    with and without a specialization filter; the other filters are checked
+    against the fetched documents.
+
+    Online status is the persisted `status` field, which trails live
+    presence by at most one presence flush interval.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def query(self, specialization=None, gender=None, min_fee=None, max_fee=None, online=None, min_rating=None):
+        query = {'verified': True}
+        if specialization:
+            query['specialization'] = specialization
+        if gender:
+            query['gender'] = gender
+        if online is not None:
+            query['status'] = 'online' if online else {'$ne': 'online'}
+        fee = {}
+        if min_fee is not None:
+            fee['$gte'] = min_fee
+        if max_fee is not None:
+            fee['$lte'] = max_fee
+        if fee:
+            query['fee'] = fee
+        if min_rating is not None:
+            query['rating'] = {'$gte': min_rating}
+        return query
+
+    def search(self, sort='rating', descending=None, limit=20, cursor=None, **filters):
+        """
+        :param filters: keyword arguments of `query`
+        :param descending: sort direction; defaults to the one in SORTS
+        :return: (doctors, next_cursor); next_cursor is None on the last page
+        :raises ValueError: for an unknown sort or a malformed cursor
+        """
+        if sort not in SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+        field, direction = SORTS[sort]
+        if descending is not None:
+            direction = pymongo.DESCENDING if descending else pymongo.ASCENDING
+
+        query = self.query(**filters)
+        if cursor:
+            value, oid = decode_cursor(cursor)
+            op = '$lt' if direction == pymongo.DESCENDING else '$gt'
+            after = {'$or': [{field: {op: value}}, {field: value, '_id': {op: oid}}]}
+            query = {'$and': [query, after]}
+
+        found = (
+            self.collection.find(query, PROJECTION)
+            .sort([(field, direction), ('_id', direction)])
+            .limit(limit + 1)
+        )
+        page = list(found)
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1], field)
+        return page, next_cursor
+
+
+def backfill(db):
+    """
+    Gives every doctor the numeric fee, appointments, stars and rating
+    fields that search sorts and filters on. Safe to re-run.
+
+    :return: number of doctors changed
+    """
+    result = db.doctors.update_many({}, [
+        {'$set': {
+            'fee': {'$convert': {'input': '$fee', 'to': 'double', 'onError': 0, 'onNull': DEFAULT_FEE}},
+            'appointments': {'$ifNull': ['$appointments', 0]},
+            'stars': {'$ifNull': ['$stars', 0]},
+        }},
+        {'$set': {'rating': {'$cond': [
+            {'$gt': ['$appointments', 0]},
+            {'$divide': ['$stars', '$appointments']},
+            0,
+        ]}}},
+    ])
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print("usage: python -m utils.doctor_search backfill")
+        sys.exit(1)
+    client = pymongo.MongoClient(os.getenv("DBURL"), server_api=ServerApi('1'))
+    count = backfill(client.get_database(os.getenv("MONGO_DB", "medicare")))
+    print(f"Backfilled search fields on {count} doctors")
@@ -0,0 +1,167 @@
+"""
+Meet, presence and appointment events pushed to browsers over Server-Sent
+Events instead of being polled.
+
+Every process keeps an EventBus that fans events out to its own SSE
+connections. Events reach the bus from one feed: Redis pub/sub when a
+Redis client is given (so all workers see every event), otherwise the bus
+delivers in-process, which is what tests use. Appointment events can
+instead come from a MongoDB change stream on the appointments collection
+with `watch_appointments`.
+
+SSE connections are long-lived, so run gunicorn with a threaded or async
+worker class (e.g. `--worker-class gthread --threads 50`).
+"""
+import json
+import os
+import queue
+import time
+from threading import Lock, Thread
+
+
+class Subscription:
+    def __init__(self, channels, maxsize=100):
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    def __init__(self, redis_client=None, redis_channel='medicare:events', max_queue=100):
+        self.redis = redis_client
+        self.redis_channel = redis_channel
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._lock = Lock()
+        self._pid = None
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, channels):
+        self.start()
+        subscription = Subscription(channels, self.max_queue)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.closed = True
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, channel, event, data):
+        """
+        Sends `event` with JSON-serializable `data` to every subscriber of
+        `channel` in every worker.
+        """
+        if self.redis is not None:
+            self.redis.publish(self.redis_channel, json.dumps({'channel': channel, 'event': event, 'data': data}, default=str))
+        else:
+            self.deliver(channel, event, data)
+
+    def deliver(self, channel, event, data):
+        """Fans an event out to this process' subscribers only."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        self.published += 1
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event, data))
+            except queue.Full:
+                # A client that can't keep up is disconnected and will reconnect
+                self.dropped += 1
+                self.unsubscribe(subscription)
+
+    def start(self):
+        if self.redis is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        Thread(target=self._listen, name='event-bus', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.redis_channel)
+                for message in pubsub.listen():
+                    payload = json.loads(message['data'])
+                    self.deliver(payload['channel'], payload['event'], payload['data'])
+            except Exception as e:
+                print(f"Event bus lost its Redis subscription: {e}")
+                time.sleep(1)
+
+
+def channel_for(role, email):
+    return f"{role}:{email}"
+
+
+def sse_stream(bus, subscription, initial=(), keepalive=15):
+    """
+    Generator of Server-Sent Events for a Flask streaming response.
+
+    :param initial: (event, data) pairs sent before anything from the bus
+    """
+    try:
+        yield "retry: 5000\n\n"
+        for event, data in initial:
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        while not subscription.closed:
+            item = subscription.get(keepalive)
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            event, data = item
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    finally:
+        bus.unsubscribe(subscription)
+
+
+def appointment_event(appointment):
+    keys = ('link', 'demail', 'pemail', 'doctor', 'patient', 'date', 'time', 'status', 'stars', 'prescription')
+    return {k: appointment[k] for k in keys if k in appointment}
+
+
+def watch_appointments(bus, collection):
+    """
+    Publishes an `appointment` event to the doctor and the patient for every
+    change to the appointments collection, from a MongoDB change stream.
+    Requires a replica set. Runs in a background thread per process.
+    """
+    def watch():
+        resume_token = None
+        while True:
+            try:
+                with collection.watch(full_document='updateLookup', resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        appointment = change.get('fullDocument')
+                        if not appointment:
+                            continue
+                        data = appointment_event(appointment)
+                        for role, field in (('doctor', 'demail'), ('patient', 'pemail')):
+                            if appointment.get(field):
+                                bus.deliver(channel_for(role, appointment[field]), 'appointment', data)
+            except Exception as e:
+                print(f"Appointment change stream interrupted: {e}")
+                time.sleep(1)
+
+    Thread(target=watch, name='appointments-change-stream', daemon=True).start()
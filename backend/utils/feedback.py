@@ -0,0 +1,173 @@
+"""
+Website feedback: storage, keyset-paginated listing and per-type rollups.
+
+Every submission also increments a rollup document per `feedback_type` in
+`feedback_rollups` (count, rating total and 1-5 histogram), so statistics
+are a read of a handful of small documents instead of a scan of the
+feedback collection. The mean is derived from the total on read.
+"""
+import datetime
+import os
+import sys
+import pymongo
+from pymongo import ReplaceOne
+from pymongo.server_api import ServerApi
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RATINGS = (1, 2, 3, 4, 5)
+
+# Fields shown publicly; the submitter's email never is
+PUBLIC_PROJECTION = {
+    'rating': 1, 'comments': 1, 'feedback_type': 1, 'username': 1,
+    'profile_picture': 1, 'keep_it_anonymous': 1, 'timestamp': 1, 'created_at': 1,
+}
+ANONYMOUS_FIELDS = ('username', 'user_email', 'profile_picture')
+
+
+def parse_rating(value):
+    """
+    :raises ValueError: unless `value` is a whole number of stars from 1 to 5
+    """
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid rating: {value}")
+    if rating not in RATINGS or rating != float(value):
+        raise ValueError(f"Invalid rating: {value}")
+    return rating
+
+
+def public_view(entry):
+    """A feedback document as served: string id, identity removed if anonymous."""
+    entry = dict(entry)
+    if '_id' in entry:
+        entry['id'] = str(entry.pop('_id'))
+    if entry.get('keep_it_anonymous'):
+        for field in ANONYMOUS_FIELDS:
+            entry.pop(field, None)
+    return entry
+
+
+def rollup_view(rollup):
+    count = rollup.get('count', 0)
+    histogram = rollup.get('histogram') or {}
+    return {
+        'count': count,
+        'mean': rollup.get('total', 0) / count if count else 0,
+        'histogram': [histogram.get(str(rating), 0) for rating in RATINGS],
+    }
+
+
+class Feedback:
+    def __init__(self, collection, rollups):
+        self.collection = collection
+        self.rollups = rollups
+
+    def submit(self, entry, session=None):
+        """
+        Stores a feedback entry (its `rating` already validated) and adds it
+        to its type's rollup.
+
+        :return: id of the new entry
+        """
+        entry = dict(entry, created_at=datetime.datetime.utcnow())
+        result = self.collection.insert_one(entry, session=session)
+        self.rollups.update_one(
+            {'_id': entry.get('feedback_type', '')},
+            {'$inc': {'count': 1, 'total': entry['rating'], f"histogram.{entry['rating']}": 1}},
+            upsert=True,
+            session=session,
+        )
+        return result.inserted_id
+
+    def get(self, feedback_id):
+        try:
+            return self.collection.find_one({'_id': ObjectId(feedback_id)}, PUBLIC_PROJECTION)
+        except InvalidId:
+            return None
+
+    def list(self, feedback_type=None, rating=None, min_rating=None, limit=20, cursor=None):
+        """
+        Feedback newest first, optionally filtered by type and by exact or
+        minimum rating, paginated by keyset on _id. The type_id, type_rating_id
+        and rating_id indexes serve the filters and the sort.
+
+        :param cursor: `next_cursor` of the previous page
+        :return: (entries, next_cursor)
+        :raises ValueError: for an invalid cursor
+        """
+        query = {}
+        if feedback_type is not None:
+            query['feedback_type'] = feedback_type
+        if rating is not None:
+            query['rating'] = rating
+        elif min_rating is not None:
+            query['rating'] = {'$gte': min_rating}
+        if cursor:
+            try:
+                query['_id'] = {'$lt': ObjectId(cursor)}
+            except InvalidId as e:
+                raise ValueError(f"Invalid cursor: {cursor}") from e
+
+        page = list(self.collection.find(query, PUBLIC_PROJECTION).sort('_id', pymongo.DESCENDING).limit(limit + 1))
+        next_cursor = str(page[limit - 1]['_id']) if len(page) > limit else None
+        return page[:limit], next_cursor
+
+    def featured(self, limit=10):
+        """Latest five-star entries that have a comment, for the testimonial carousel."""
+        found = self.collection.find(
+            {'rating': 5, 'comments': {'$nin': ['', None]}}, PUBLIC_PROJECTION,
+        ).sort('_id', pymongo.DESCENDING).limit(limit)
+        return [public_view(entry) for entry in found]
+
+    def stats(self):
+        """
+        :return: rollup per feedback type plus the overall rollup under 'all'
+        """
+        types = {}
+        overall = {'count': 0, 'total': 0, 'histogram': {}}
+        for rollup in self.rollups.find():
+            types[rollup['_id']] = rollup_view(rollup)
+            overall['count'] += rollup.get('count', 0)
+            overall['total'] += rollup.get('total', 0)
+            for bucket, count in (rollup.get('histogram') or {}).items():
+                overall['histogram'][bucket] = overall['histogram'].get(bucket, 0) + count
+        return {'types': types, 'all': rollup_view(overall)}
+
+
+def rebuild_rollups(db):
+    """
+    Recomputes every feedback_type rollup from the feedback collection, for
+    existing data and to repair drift. Safe to re-run.
+
+    :return: number of rollups written
+    """
+    pipeline = [
+        {'$match': {'rating': {'$in': list(RATINGS)}}},
+        {'$group': {'_id': {'type': {'$ifNull': ['$feedback_type', '']}, 'rating': '$rating'}, 'count': {'$sum': 1}}},
+    ]
+    rollups = {}
+    for row in db.website_feedback.aggregate(pipeline):
+        rating = int(row['_id']['rating'])
+        rollup = rollups.setdefault(row['_id']['type'], {'count': 0, 'total': 0, 'histogram': {}})
+        rollup['count'] += row['count']
+        rollup['total'] += rating * row['count']
+        rollup['histogram'][str(rating)] = row['count']
+    db.feedback_rollups.delete_many({'_id': {'$nin': list(rollups)}})
+    if rollups:
+        db.feedback_rollups.bulk_write([
+            ReplaceOne({'_id': feedback_type}, rollup, upsert=True) for feedback_type, rollup in rollups.items()
+        ])
+    return len(rollups)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != 'rollups':
+        print("usage: python -m utils.feedback rollups")
+        sys.exit(1)
+    client = pymongo.MongoClient(os.getenv("DBURL"), server_api=ServerApi('1'))
+    print(f"Rebuilt {rebuild_rollups(client.get_database(os.getenv('MONGO_DB', 'medicare')))} feedback rollups")
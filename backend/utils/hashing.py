@@ -0,0 +1,120 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+import bcrypt
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a process pool so hashing doesn't hold a web worker's CPU.
+    At most `max_pending` operations may be queued or running; callers that
+    can't get a slot within `timeout` seconds get HashingBusy. Hashes are
+    compatible with flask_bcrypt.
+    """
+
+    def __init__(self, workers=None, rounds=12, max_pending=None, timeout=5):
+        self.workers = workers or os.cpu_count() or 1
+        self.rounds = rounds
+        self.max_pending = max_pending or self.workers * 8
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(self.max_pending)
+        self._lock = Lock()
+        self._executor = None
+        self._pid = None
+        self._stats_lock = Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def _pool(self):
+        # A pool inherited across fork is unusable, so create one per process
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _submit(self, fn, *args):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self.rejected += 1
+            raise HashingBusy("Password hashing queue is full")
+        with self._stats_lock:
+            self.in_flight += 1
+            self.wait_seconds += time.monotonic() - start
+
+        def done(_):
+            self._slots.release()
+            with self._stats_lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.run_seconds += time.monotonic() - start
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            done(None)
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def hash(self, password):
+        return self._submit(_hash, password, self.rounds).result()
+
+    def check(self, hashed, password):
+        return self._submit(_check, hashed, password).result()
+
+    def needs_rehash(self, hashed):
+        # bcrypt hashes look like $2b$<cost>$<salt+hash>
+        try:
+            return int(hashed.split('$')[2]) < self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def rehash_in_background(self, password, save):
+        """
+        Hashes `password` at the current work factor and passes the new hash
+        to `save` once done, without making the caller wait.
+        """
+        def finished(future):
+            if future.exception() is None:
+                save(future.result())
+                with self._stats_lock:
+                    self.rehashed += 1
+
+        try:
+            self._submit(_hash, password, self.rounds).add_done_callback(finished)
+        except HashingBusy:
+            pass  # Try again on the next login
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'max_pending': self.max_pending,
+                'in_flight': self.in_flight,
+                'saturation': self.in_flight / self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+                'avg_wait_ms': self.wait_seconds / self.completed * 1000 if self.completed else 0,
+                'avg_total_ms': self.run_seconds / self.completed * 1000 if self.completed else 0,
+            }
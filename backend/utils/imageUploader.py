@@ -1,27 +1,36 @@
-import cloudinary
-import cloudinary.uploader
 import os
 from dotenv import load_dotenv
+from utils.metrics import external_call
 
 load_dotenv()
 
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.getenv('CLOUDINARY_API_KEY'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET')
-)
+_uploader = None
+
+def uploader():
+    # Cloudinary is imported and configured on the first upload, not at startup
+    global _uploader
+    if _uploader is None:
+        import cloudinary
+        import cloudinary.uploader
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET')
+        )
+        _uploader = cloudinary.uploader
+    return _uploader
 
 def upload_file(file_path, folder="medicare"):
     """
     Uploads a file to Cloudinary and returns the secure URL.
 
-    :param file_path: Path to the file (string)
+    :param file_path: Path to the file (string) or a file-like object
     :param folder: Folder name in Cloudinary (optional, default: "uploads")
     :return: Secure URL of the uploaded file
     """
     try:
-        response = cloudinary.uploader.upload(file_path, folder=folder)
+        with external_call('cloudinary'):
+            response = uploader().upload(file_path, folder=folder)
         return response["secure_url"]
     except Exception as e:
         return str(e)
\ No newline at end of file
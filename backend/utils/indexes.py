@@ -0,0 +1,172 @@
+import os
+import sys
+import pymongo
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Indexes required by the routes in app.py, keyed by collection name.
+# Each entry is (keys, options) as accepted by Collection.create_index.
+INDEXES = {
+    "doctors": [
+        ([("email", pymongo.ASCENDING)], {"name": "email_unique", "unique": True}),
+        ([("verified", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "verified_id"}),
+        # /doctors/search: one (sort field, _id) keyset index per sort, with and
+        # without the specialization equality prefix
+        ([("verified", pymongo.ASCENDING), ("rating", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_search_rating"}),
+        ([("verified", pymongo.ASCENDING), ("fee", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_search_fee"}),
+        ([("verified", pymongo.ASCENDING), ("appointments", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_search_appointments"}),
+        ([("verified", pymongo.ASCENDING), ("specialization", pymongo.ASCENDING), ("rating", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_search_specialization_rating"}),
+        ([("verified", pymongo.ASCENDING), ("specialization", pymongo.ASCENDING), ("fee", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_search_specialization_fee"}),
+        ([("verified", pymongo.ASCENDING), ("specialization", pymongo.ASCENDING), ("appointments", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_search_specialization_appointments"}),
+    ],
+    "patients": [
+        ([("email", pymongo.ASCENDING)], {"name": "email_unique", "unique": True}),
+    ],
+    "password_resets": [
+        ([("token_hash", pymongo.ASCENDING)], {"name": "token_hash_unique", "unique": True}),
+        ([("email", pymongo.ASCENDING)], {"name": "email_unique", "unique": True}),
+        # expireAfterSeconds=0 deletes each entry once its own expires_at passes
+        ([("expires_at", pymongo.ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+    "appointments": [
+        ([("link", pymongo.ASCENDING)], {"name": "link_unique", "unique": True}),
+        # Upcoming and completed listings, in start order, keyset on _id
+        ([("demail", pymongo.ASCENDING), ("status", pymongo.ASCENDING), ("starts_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_status_starts_at"}),
+        ([("pemail", pymongo.ASCENDING), ("status", pymongo.ASCENDING), ("starts_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "patient_status_starts_at"}),
+        # Calendar range queries, in chronological order
+        ([("demail", pymongo.ASCENDING), ("starts_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "doctor_starts_at"}),
+        ([("pemail", pymongo.ASCENDING), ("starts_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "patient_starts_at"}),
+    ],
+    "schedules": [
+        ([("demail", pymongo.ASCENDING)], {"name": "demail_unique", "unique": True}),
+    ],
+    "jobs": [
+        ([("status", pymongo.ASCENDING), ("run_at", pymongo.ASCENDING)], {"name": "status_run_at"}),
+        ([("status", pymongo.ASCENDING), ("lease_until", pymongo.ASCENDING)], {"name": "status_lease"}),
+    ],
+    "outbox": [
+        ([("status", pymongo.ASCENDING), ("run_at", pymongo.ASCENDING)], {"name": "status_run_at"}),
+        ([("status", pymongo.ASCENDING), ("lease_until", pymongo.ASCENDING)], {"name": "status_lease"}),
+    ],
+    "whatsapp_queue": [
+        ([("status", pymongo.ASCENDING), ("run_at", pymongo.ASCENDING)], {"name": "status_run_at"}),
+        ([("status", pymongo.ASCENDING), ("lease_until", pymongo.ASCENDING)], {"name": "status_lease"}),
+        # Queued messages to one recipient, merged into the claimed one
+        ([("payload.to", pymongo.ASCENDING), ("status", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "to_status_id"}),
+        ([("merged_into", pymongo.ASCENDING)], {"name": "merged_into", "sparse": True}),
+    ],
+    "website_feedback": [
+        ([("user_email", pymongo.ASCENDING)], {"name": "user_email"}),
+        # Feedback listing, newest first, filtered by type and/or rating
+        ([("feedback_type", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "type_id"}),
+        ([("feedback_type", pymongo.ASCENDING), ("rating", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "type_rating_id"}),
+        ([("rating", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], {"name": "rating_id"}),
+    ],
+}
+
+# Indexes that are no longer used and are dropped by ensure_indexes.
+RETIRED_INDEXES = {
+    "doctors": ["reset_token"],
+    "patients": ["reset_token"],
+    "website_feedback": ["type_rating"],
+    "appointments": ["doctor_status_datetime", "patient_status_datetime"],
+}
+
+# Representative filters issued by each route, used by the query plan guard.
+ROUTE_QUERIES = [
+    ("register", "patients", {"email": "guard@example.com"}),
+    ("register", "doctors", {"email": "guard@example.com"}),
+    ("login", "patients", {"email": "guard@example.com"}),
+    ("login", "doctors", {"email": "guard@example.com"}),
+    ("forgot_password", "patients", {"email": "guard@example.com"}),
+    ("forgot_password", "doctors", {"email": "guard@example.com"}),
+    ("forgot_password", "password_resets", {"email": "guard@example.com"}),
+    ("reset_password", "password_resets", {"token_hash": "guard"}),
+    ("doctor_apo", "appointments", {"demail": "guard@example.com", "status": "upcoming"}),
+    ("patient_apo", "appointments", {"pemail": "guard@example.com", "status": "upcoming"}),
+    ("update_doctor_ratings", "appointments", {"link": "guard", "status": "upcoming"}),
+    ("update_doctor_ratings", "doctors", {"email": "guard@example.com"}),
+    ("make_meet", "doctors", {"email": "guard@example.com"}),
+    ("make_meet", "appointments", {"link": "guard"}),
+    ("make_meet", "schedules", {"demail": "guard@example.com"}),
+    ("calendar", "appointments", {"demail": "guard@example.com", "starts_at": {"$gte": 0}}),
+    ("calendar", "appointments", {"pemail": "guard@example.com", "starts_at": {"$gte": 0}}),
+    ("completed_meets", "appointments", {"demail": "guard@example.com", "status": "completed"}),
+    ("mail_file", "appointments", {"link": "guard"}),
+    ("get_status", "doctors", {"verified": True}),
+    ("doctors_search", "doctors", {"verified": True, "specialization": "guard", "rating": {"$gte": 4}}),
+    ("doctors_search", "doctors", {"verified": True, "fee": {"$lte": 500}}),
+    ("website_feedback", "website_feedback", {"user_email": "guard@example.com"}),
+    ("website_feedback_list", "website_feedback", {"feedback_type": "guard", "rating": {"$gte": 4}}),
+    ("website_feedback_featured", "website_feedback", {"rating": 5, "comments": {"$nin": ["", None]}}),
+]
+
+
+class CollectionScanError(Exception):
+    pass
+
+
+def ensure_indexes(db):
+    """
+    Creates every index declared in INDEXES and drops the ones listed in
+    RETIRED_INDEXES. create_index is a no-op for indexes that already exist
+    with the same options.
+
+    :param db: pymongo Database
+    :return: dict of collection name -> list of index names
+    """
+    created = {}
+    for name, specs in INDEXES.items():
+        collection = db[name]
+        created[name] = [collection.create_index(keys, **options) for keys, options in specs]
+    for name, index_names in RETIRED_INDEXES.items():
+        existing = set(db[name].index_information())
+        for index_name in index_names:
+            if index_name in existing:
+                db[name].drop_index(index_name)
+    return created
+
+
+def _plan_stages(plan):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def winning_plan_stages(collection, query):
+    explain = collection.find(query).explain()
+    planner = explain.get("queryPlanner", {})
+    return list(_plan_stages(planner.get("winningPlan", {})))
+
+
+def check_query_plans(db, queries=ROUTE_QUERIES):
+    """
+    Runs explain() for every route query and raises CollectionScanError
+    listing the routes whose winning plan contains a COLLSCAN stage.
+    """
+    failures = []
+    for route, name, query in queries:
+        if "COLLSCAN" in winning_plan_stages(db[name], query):
+            failures.append(f"{route}: {name}.find({query})")
+    if failures:
+        raise CollectionScanError("Queries falling back to COLLSCAN:\n  " + "\n  ".join(failures))
+    return True
+
+
+if __name__ == "__main__":
+    client = pymongo.MongoClient(os.getenv("DBURL"), server_api=ServerApi('1'))
+    db = client.get_database(os.getenv("MONGO_DB", "medicare"))
+    for name, index_names in ensure_indexes(db).items():
+        print(f"{name}: {', '.join(index_names)}")
+    if "--check" in sys.argv:
+        try:
+            check_query_plans(db)
+            print("All route queries are served by an index.")
+        except CollectionScanError as e:
+            print(e)
+            sys.exit(1)
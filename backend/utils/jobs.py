@@ -0,0 +1,142 @@
+import datetime
+import os
+import socket
+import traceback
+from threading import Event, Lock, Thread
+import pymongo
+from pymongo import ReturnDocument
+from bson import ObjectId
+from bson.errors import InvalidId
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    Jobs persisted in a MongoDB collection and processed by a pool of worker
+    threads in every process that uses the queue. A job that raises is retried
+    with exponential backoff until `max_attempts`; a job whose worker died is
+    picked up again once its lease expires.
+
+    Handlers receive the job document and may call `queue.step(job, name, fn)`
+    so that steps which already succeeded are skipped on retry. `on_failed`
+    is called with the job once it has run out of attempts.
+    """
+
+    def __init__(self, collection, handlers, workers=2, max_attempts=5, backoff=5, lease=300, poll_interval=2, on_failed=None):
+        self.collection = collection
+        self.handlers = handlers
+        self.on_failed = on_failed
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._wakeup = Event()
+        self._lock = Lock()
+        self._pid = None
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        # Threads don't survive fork, so start them once per process
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._worker_id = f"{socket.gethostname()}:{self._pid}"
+            for i in range(self.workers):
+                Thread(target=self._work, name=f"{self.collection.name}-worker-{i}", daemon=True).start()
+
+    def enqueue(self, kind, payload, delay=0):
+        """
+        :param delay: seconds before the job may run
+        :return: id of the new job as a string
+        """
+        now = datetime.datetime.utcnow()
+        result = self.collection.insert_one({
+            'kind': kind,
+            'payload': payload,
+            'status': QUEUED,
+            'attempts': 0,
+            'steps': {},
+            'created_at': now,
+            'run_at': now + datetime.timedelta(seconds=delay),
+        })
+        self.start()
+        self._wakeup.set()
+        return str(result.inserted_id)
+
+    def get(self, job_id):
+        try:
+            return self.collection.find_one({'_id': ObjectId(job_id)}, {'payload': 0})
+        except InvalidId:
+            return None
+
+    def step(self, job, name, fn):
+        """
+        Runs `fn` unless step `name` already completed on a previous attempt,
+        and records its result on the job.
+        """
+        if name in job['steps']:
+            return job['steps'][name]
+        result = fn()
+        self.collection.update_one({'_id': job['_id']}, {'$set': {f'steps.{name}': result}})
+        job['steps'][name] = result
+        return result
+
+    def _claim(self):
+        now = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {'$or': [
+                {'status': QUEUED, 'run_at': {'$lte': now}},
+                {'status': RUNNING, 'lease_until': {'$lt': now}},
+            ]},
+            {
+                '$set': {'status': RUNNING, 'worker': self._worker_id, 'started_at': now,
+                         'lease_until': now + datetime.timedelta(seconds=self.lease)},
+                '$inc': {'attempts': 1},
+            },
+            sort=[('run_at', pymongo.ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _run(self, job):
+        try:
+            result = self.handlers[job['kind']](job)
+        except Exception as e:
+            print(f"Job {job['_id']} ({job['kind']}) attempt {job['attempts']} failed: {e}")
+            traceback.print_exc()
+            update = {'last_error': str(e)}
+            if job['attempts'] >= self.max_attempts:
+                update['status'] = FAILED
+                update['finished_at'] = datetime.datetime.utcnow()
+            else:
+                delay = self.backoff * 2 ** (job['attempts'] - 1)
+                update['status'] = QUEUED
+                update['run_at'] = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+            self.collection.update_one({'_id': job['_id']}, {'$set': update, '$unset': {'lease_until': ''}})
+            if update.get('status') == FAILED and self.on_failed:
+                self.on_failed(job)
+            return
+
+        self.collection.update_one(
+            {'_id': job['_id']},
+            {'$set': {'status': DONE, 'result': result, 'finished_at': datetime.datetime.utcnow()},
+             '$unset': {'lease_until': ''}},
+        )
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Error claiming job from {self.collection.name}: {e}")
+                job = None
+            if job:
+                self._run(job)
+                continue
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
@@ -0,0 +1,158 @@
+"""
+Per-specialization top-rated doctor leaderboards.
+
+Without Redis, `IndexLeaderboard` reads the top doctors straight off the
+doctor_search_*rating indexes, which are already ordered by rating, so a
+top-N lookup is an O(log n) seek plus N entries. With Redis,
+`RedisLeaderboard` keeps one sorted set per specialization (and one across
+all of them), updated on every rating, and only goes to MongoDB to fetch
+the N doctors' details.
+"""
+import os
+import sys
+import time
+import pymongo
+from pymongo import UpdateOne
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ALL = '*'
+
+PROJECTION = {
+    '_id': 0, 'email': 1, 'username': 1, 'specialization': 1, 'gender': 1,
+    'fee': 1, 'appointments': 1, 'rating': 1, 'ratings': 1, 'profile_picture': 1,
+}
+
+
+def histogram(doctor):
+    """The doctor's 1-5 star counts as a list, index 0 holding 1-star ratings."""
+    ratings = doctor.get('ratings') or {}
+    return [ratings.get(str(stars), 0) for stars in range(1, 6)]
+
+
+class IndexLeaderboard:
+    def __init__(self, doctors):
+        self.doctors = doctors
+
+    def record(self, doctor):
+        # The indexes stay ordered on their own
+        pass
+
+    def top(self, specialization=None, limit=10):
+        query = {'verified': True, 'appointments': {'$gt': 0}}
+        if specialization:
+            query['specialization'] = specialization
+        found = self.doctors.find(query, PROJECTION).sort([('rating', -1), ('_id', -1)]).limit(limit)
+        return list(found)
+
+
+class RedisLeaderboard:
+    """
+    Sorted sets `<prefix>:<specialization>` and `<prefix>:*` scored by
+    average rating. A hash remembers each doctor's specialization so a
+    change of specialization moves them between sets, and `<prefix>:built`
+    marks that the sets have been built, even when they are all empty.
+    """
+
+    def __init__(self, client, doctors, prefix='leaderboard'):
+        self.client = client
+        self.doctors = doctors
+        self.prefix = prefix
+        self.specializations_key = f'{prefix}:specializations'
+        self.built_key = f'{prefix}:built'
+
+    def _key(self, specialization):
+        return f'{self.prefix}:{specialization}'
+
+    def record(self, doctor):
+        """
+        Adds, rescores or removes one doctor. `doctor` needs email, rating,
+        appointments, specialization and verified.
+        """
+        email = doctor['email']
+        specialization = doctor.get('specialization') or ''
+        previous = self.client.hget(self.specializations_key, email)
+        pipe = self.client.pipeline()
+        if previous is not None and previous.decode() != specialization:
+            pipe.zrem(self._key(previous.decode()), email)
+        if doctor.get('verified') and doctor.get('appointments', 0) > 0:
+            score = doctor.get('rating', 0)
+            pipe.zadd(self._key(ALL), {email: score})
+            pipe.zadd(self._key(specialization), {email: score})
+            pipe.hset(self.specializations_key, email, specialization)
+        else:
+            pipe.zrem(self._key(ALL), email)
+            pipe.zrem(self._key(specialization), email)
+            pipe.hdel(self.specializations_key, email)
+        pipe.execute()
+
+    def top(self, specialization=None, limit=10):
+        key = self._key(specialization or ALL)
+        # Redis drops empty sorted sets, so check the marker rather than the set
+        if not self.client.exists(self.built_key):
+            self.rebuild()
+        emails = [e.decode() for e in self.client.zrevrange(key, 0, limit - 1)]
+        if not emails:
+            return []
+        found = {d['email']: d for d in self.doctors.find({'email': {'$in': emails}}, PROJECTION)}
+        return [found[email] for email in emails if email in found]
+
+    def rebuild(self):
+        """Repopulates every set from the doctors collection."""
+        stale = list(self.client.scan_iter(f'{self.prefix}:*'))
+        pipe = self.client.pipeline()
+        if stale:
+            pipe.delete(*stale)
+        query = {'verified': True, 'appointments': {'$gt': 0}}
+        for doctor in self.doctors.find(query, {'email': 1, 'rating': 1, 'specialization': 1}):
+            specialization = doctor.get('specialization') or ''
+            pipe.zadd(self._key(ALL), {doctor['email']: doctor.get('rating', 0)})
+            pipe.zadd(self._key(specialization), {doctor['email']: doctor.get('rating', 0)})
+            pipe.hset(self.specializations_key, doctor['email'], specialization)
+        pipe.set(self.built_key, int(time.time()))
+        pipe.execute()
+
+
+def backfill_histograms(db, batch_size=500):
+    """
+    Rebuilds every doctor's star histogram from their completed
+    appointments. Safe to re-run.
+
+    :return: number of doctors updated
+    """
+    pipeline = [
+        {'$match': {'status': 'completed', 'stars': {'$in': [1, 2, 3, 4, 5]}}},
+        {'$group': {'_id': {'demail': '$demail', 'stars': '$stars'}, 'count': {'$sum': 1}}},
+        {'$group': {'_id': '$_id.demail', 'ratings': {'$push': {'k': {'$toString': '$_id.stars'}, 'v': '$count'}}}},
+    ]
+    ops = []
+    updated = 0
+    for row in db.appointments.aggregate(pipeline):
+        ratings = {entry['k']: entry['v'] for entry in row['ratings']}
+        ops.append(UpdateOne({'email': row['_id']}, {'$set': {'ratings': ratings}}))
+        if len(ops) >= batch_size:
+            updated += db.doctors.bulk_write(ops, ordered=False).matched_count
+            ops = []
+    if ops:
+        updated += db.doctors.bulk_write(ops, ordered=False).matched_count
+    return updated
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('histograms', 'rebuild'):
+        print("usage: python -m utils.leaderboard histograms|rebuild")
+        sys.exit(1)
+    client = pymongo.MongoClient(os.getenv("DBURL"), server_api=ServerApi('1'))
+    db = client.get_database(os.getenv("MONGO_DB", "medicare"))
+    if sys.argv[1] == 'histograms':
+        print(f"Rebuilt star histograms for {backfill_histograms(db)} doctors")
+    else:
+        from utils.presence import redis_from_env
+        redis_client = redis_from_env()
+        if redis_client is None:
+            print("REDIS_URL is not set; the index leaderboard needs no rebuild")
+            sys.exit(1)
+        RedisLeaderboard(redis_client, db.doctors).rebuild()
+        print("Rebuilt the Redis leaderboards")
@@ -0,0 +1,343 @@
+"""
+Request, MongoDB command, connection pool and external call metrics in the
+Prometheus text format, plus an optional slow-request log.
+
+MongoCommandListener attributes every command to the Flask request running
+on the same thread (pymongo runs commands synchronously on the caller's
+thread), so each request knows how many commands it sent, how long they
+took, and their query shapes. Metrics are kept per process; under gunicorn
+every worker serves its own /metrics.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import request
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+logger = logging.getLogger('medicare.slow_requests')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, labels)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for labels, (counts, total, value_sum) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_labels(names, labels + (_number(bound),))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_labels(names, labels + ("+Inf",))} {total}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {_number(value_sum)}')
+                lines.append(f'{self.name}_count{_labels(self.labels, labels)} {total}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauges(self, prefix, collect):
+        """
+        Exposes every numeric value of the dict returned by `collect()` (for
+        example an existing stats() method) as a gauge named prefix_<key>.
+        """
+        self._gauges.append((prefix, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, collect in self._gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                lines.append(f'# {prefix} unavailable: {e}')
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'# TYPE {prefix}_{key} gauge')
+                    lines.append(f'{prefix}_{key} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+http_duration = REGISTRY.histogram(
+    'medicare_http_request_duration_seconds', 'Time to build a response, by route.', ('route', 'method', 'status'))
+mongo_commands = REGISTRY.histogram(
+    'medicare_mongo_commands_per_request', 'MongoDB commands sent while handling one request.', ('route',), COUNT_BUCKETS)
+mongo_duration = REGISTRY.histogram(
+    'medicare_mongo_command_duration_seconds', 'MongoDB command round trip time.', ('route', 'command'))
+mongo_failures = REGISTRY.counter(
+    'medicare_mongo_command_failures_total', 'MongoDB commands that returned an error.', ('route', 'command'))
+pool_wait = REGISTRY.histogram(
+    'medicare_mongo_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.', ('route',))
+pool_failures = REGISTRY.counter(
+    'medicare_mongo_pool_checkout_failures_total', 'Connection checkouts that failed, by reason.', ('reason',))
+external_duration = REGISTRY.histogram(
+    'medicare_external_call_duration_seconds', 'Calls to external services.', ('service', 'outcome'))
+
+# Route of the request being handled on this thread, with its command log
+_current = threading.local()
+
+
+@contextmanager
+def external_call(service):
+    """Times a call to an external service (Cloudinary, SMTP, Firebase, ...)."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        external_duration.observe(time.perf_counter() - start, service, outcome)
+
+
+def _shape(value, depth=0):
+    if isinstance(value, dict):
+        return {k: _shape(v, depth + 1) for k, v in value.items()} if depth < 6 else '{...}'
+    if isinstance(value, (list, tuple)):
+        return [_shape(value[0], depth + 1)] if value else []
+    return '?'
+
+
+def query_shape(event):
+    """The command with every literal value replaced by "?", for logging."""
+    command = event.command
+    name = event.command_name
+    shape = {'command': name, 'collection': command.get(name) if isinstance(command.get(name), str) else None}
+    for key in ('filter', 'query', 'sort', 'projection'):
+        if key in command:
+            shape[key] = _shape(command[key])
+    if 'pipeline' in command:
+        shape['pipeline'] = [_shape(stage) for stage in command['pipeline']]
+    for key in ('updates', 'deletes'):
+        if command.get(key):
+            shape['q'] = _shape(command[key][0].get('q', {}))
+    return shape
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        state = getattr(_current, 'state', None)
+        if state is not None:
+            state['commands'] += 1
+            if state['log_shapes']:
+                state['pending'][event.request_id] = query_shape(event)
+
+    def _finished(self, event, failed):
+        state = getattr(_current, 'state', None)
+        route = state['route'] if state is not None else 'background'
+        seconds = event.duration_micros / 1e6
+        mongo_duration.observe(seconds, route, event.command_name)
+        if failed:
+            mongo_failures.inc(route, event.command_name)
+        if state is not None:
+            state['db_seconds'] += seconds
+            shape = state['pending'].pop(event.request_id, None)
+            if shape is not None:
+                state['shapes'].append(dict(shape, ms=round(seconds * 1000, 2)))
+
+    def succeeded(self, event):
+        self._finished(event, False)
+
+    def failed(self, event):
+        self._finished(event, True)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool usage of this process's client: checkout wait times by
+    route, failed checkouts (e.g. waitQueueTimeoutMS expiring) and, through
+    stats(), connections open, in use and waited for. Counts start over in
+    a process that inherited them across fork.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waits = threading.local()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self.open = 0
+        self.in_use = 0
+        self.in_use_peak = 0
+        self.waiting = 0
+        self.checkouts = 0
+
+    def _update(self, **deltas):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+            self.in_use_peak = max(self.in_use_peak, self.in_use)
+
+    def stats(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            return {
+                'connections_open': self.open,
+                'connections_in_use': self.in_use,
+                'connections_in_use_peak': self.in_use_peak,
+                'checkouts_waiting': self.waiting,
+                'checkouts': self.checkouts,
+            }
+
+    def connection_check_out_started(self, event):
+        # Checkout events for one request arrive on the thread that made it
+        self._waits.started = time.perf_counter()
+        self._update(waiting=1)
+
+    def connection_checked_out(self, event):
+        started = getattr(self._waits, 'started', None)
+        self._waits.started = None
+        self._update(waiting=-1, in_use=1, checkouts=1)
+        if started is not None:
+            state = getattr(_current, 'state', None)
+            pool_wait.observe(time.perf_counter() - started, state['route'] if state is not None else 'background')
+
+    def connection_check_out_failed(self, event):
+        self._waits.started = None
+        self._update(waiting=-1)
+        pool_failures.inc(event.reason)
+
+    def connection_checked_in(self, event):
+        self._update(in_use=-1)
+
+    def connection_created(self, event):
+        self._update(open=1)
+
+    def connection_closed(self, event):
+        self._update(open=-1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+class RequestMetrics:
+    """
+    Flask extension timing every request by route template and recording
+    its MongoDB command count. Requests slower than `slow_ms` are logged
+    with the shapes of the queries they ran (disabled when None).
+    """
+
+    def __init__(self, app=None, slow_ms=None):
+        self.slow_ms = slow_ms
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        _current.state = {
+            'route': rule, 'start': time.perf_counter(), 'commands': 0, 'db_seconds': 0.0,
+            'log_shapes': self.slow_ms is not None, 'pending': {}, 'shapes': [],
+        }
+
+    def after_request(self, response):
+        state = getattr(_current, 'state', None)
+        if state is None:
+            return response
+        elapsed = time.perf_counter() - state['start']
+        http_duration.observe(elapsed, state['route'], request.method, response.status_code)
+        mongo_commands.observe(state['commands'], state['route'])
+        response.headers['Server-Timing'] = f"app;dur={elapsed * 1000:.1f}, db;dur={state['db_seconds'] * 1000:.1f}"
+
+        if self.slow_ms is not None and elapsed * 1000 >= self.slow_ms:
+            logger.warning(json.dumps({
+                'route': state['route'], 'method': request.method, 'status': response.status_code,
+                'ms': round(elapsed * 1000, 1), 'db_ms': round(state['db_seconds'] * 1000, 1),
+                'commands': state['commands'], 'queries': state['shapes'],
+            }, default=str))
+        return response
+
+    def teardown_request(self, exc=None):
+        _current.state = None
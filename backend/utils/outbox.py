@@ -0,0 +1,153 @@
+"""
+Outgoing mail persisted in MongoDB and sent by a small pool of workers, each
+reusing one SMTP connection across messages.
+
+To try it locally, run a debugging SMTP server and point the app at it:
+
+    python -m aiosmtpd -n -l localhost:1025
+    MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=false flask run
+"""
+import datetime
+import smtplib
+import time
+from collections import deque
+from threading import Lock, local
+from bson import Binary
+from flask_mail import Message
+from utils.jobs import JobQueue, QUEUED, RUNNING, FAILED
+from utils.metrics import external_call
+
+MESSAGE_FIELDS = ('subject', 'sender', 'recipients', 'cc', 'bcc', 'reply_to', 'body', 'html')
+
+
+def serialize_message(msg):
+    data = {field: getattr(msg, field, None) for field in MESSAGE_FIELDS}
+    if isinstance(data['sender'], tuple):
+        data['sender'] = list(data['sender'])
+    data['attachments'] = [
+        {'filename': a.filename, 'content_type': a.content_type, 'data': Binary(a.data)}
+        for a in msg.attachments
+    ]
+    return data
+
+
+def deserialize_message(data):
+    sender = data.get('sender')
+    msg = Message(
+        subject=data.get('subject') or '',
+        sender=tuple(sender) if isinstance(sender, list) else sender,
+        recipients=data.get('recipients'),
+        cc=data.get('cc'),
+        bcc=data.get('bcc'),
+        reply_to=data.get('reply_to'),
+        body=data.get('body'),
+        html=data.get('html'),
+    )
+    for attachment in data.get('attachments', []):
+        msg.attach(attachment['filename'], attachment['content_type'], bytes(attachment['data']))
+    return msg
+
+
+class Outbox(JobQueue):
+    """
+    Each worker claims up to `batch_size` messages at a time and sends them
+    over its own SMTP connection, which is kept open between batches until it
+    has been idle for `idle_timeout` seconds.
+    """
+
+    def __init__(self, collection, app, mail, workers=2, batch_size=20, idle_timeout=30, **kwargs):
+        kwargs.setdefault('backoff', 10)
+        super().__init__(collection, {'mail': self._deliver}, workers=workers, **kwargs)
+        self.app = app
+        self.mail = mail
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self._local = local()
+        self._stats_lock = Lock()
+        self._latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed_attempts = 0
+        self.connections_opened = 0
+
+    def send(self, msg):
+        """
+        Persists `msg` for delivery and returns immediately.
+
+        :return: outbox id of the message
+        """
+        return self.enqueue('mail', serialize_message(msg))
+
+    def _connection(self):
+        if getattr(self._local, 'conn', None) is None:
+            conn = self.mail.connect()
+            conn.__enter__()
+            self._local.conn = conn
+            with self._stats_lock:
+                self.connections_opened += 1
+        self._local.last_used = time.monotonic()
+        return self._local.conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except Exception:
+                pass
+
+    def _deliver(self, job):
+        try:
+            with external_call('smtp'):
+                self._connection().send(deserialize_message(job['payload']))
+        except (smtplib.SMTPException, OSError):
+            # The connection may be unusable; reconnect on the next message
+            with self._stats_lock:
+                self.failed_attempts += 1
+            self._close()
+            raise
+        latency = (datetime.datetime.utcnow() - job['created_at']).total_seconds()
+        with self._stats_lock:
+            self.sent += 1
+            self._latencies.append(latency)
+        return {'sent_at': datetime.datetime.utcnow()}
+
+    def _work(self):
+        with self.app.app_context():
+            while True:
+                batch = []
+                try:
+                    while len(batch) < self.batch_size:
+                        job = self._claim()
+                        if not job:
+                            break
+                        batch.append(job)
+                except Exception as e:
+                    print(f"Error claiming mail from {self.collection.name}: {e}")
+
+                for job in batch:
+                    self._run(job)
+                if batch:
+                    continue
+
+                if getattr(self._local, 'conn', None) and time.monotonic() - self._local.last_used > self.idle_timeout:
+                    self._close()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'sent': self.sent,
+                'failed_attempts': self.failed_attempts,
+                'connections_opened': self.connections_opened,
+            }
+
+        def percentile(p):
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] if latencies else None
+
+        stats['queue_depth'] = self.collection.count_documents({'status': {'$in': [QUEUED, RUNNING]}})
+        stats['dead_letters'] = self.collection.count_documents({'status': FAILED})
+        stats['latency_seconds'] = {'p50': percentile(0.5), 'p95': percentile(0.95), 'max': percentile(1.0)}
+        return stats
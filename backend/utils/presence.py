@@ -0,0 +1,323 @@
+import json
+import os
+import time
+from threading import Lock, Thread
+from pymongo import UpdateOne
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Presence fields that used to be written straight to the doctors collection
+FIELDS = ('status', 'meet', 'currentlyInMeet', 'link')
+OFFLINE = {'status': 'offline', 'meet': False, 'currentlyInMeet': False}
+OFFLINE_UPDATE = {
+    '$set': {'status': 'offline', 'meet': False},
+    '$unset': {'link': '', 'currentlyInMeet': ''},
+}
+PERSISTED_PROJECTION = dict({'_id': 0, 'email': 1}, **{field: 1 for field in FIELDS})
+
+
+def alive(presence, expires_at, now):
+    # A doctor in a meet stays online without heartbeats, e.g. while the
+    # meet tab is in the background; leaving the meet ends that
+    return expires_at > now or bool(presence.get('meet') or presence.get('currentlyInMeet'))
+
+
+class MemoryPresenceStore:
+    """
+    Per-process presence store used when Redis isn't configured. Other
+    processes' changes only reach it through the doctors collection, so the
+    registry reads doctors it holds no heartbeat for from there, and a flush
+    only writes the fields this process changed. Heartbeats also record
+    `presence_until` on the doctor, so an entry expiring here doesn't mark
+    offline a doctor whose heartbeats go to another worker.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._entries = {}
+        # email -> [whether the entry was deleted, names of the changed fields]
+        self._dirty = {}
+        self._lock = Lock()
+
+    def get_many(self, emails, now):
+        with self._lock:
+            found = {}
+            for email in emails:
+                entry = self._entries.get(email)
+                if entry and alive(entry[0], entry[1], now):
+                    found[email] = dict(entry[0])
+            return found
+
+    def update(self, email, fields, unset, ttl, now, refresh):
+        with self._lock:
+            entry = self._entries.get(email)
+            created = not entry or not alive(entry[0], entry[1], now)
+            if created:
+                entry = [{}, now + ttl]
+                self._entries[email] = entry
+            elif refresh:
+                entry[1] = now + ttl
+            entry[0].update(fields)
+            for field in unset:
+                entry[0].pop(field, None)
+            changed = self._dirty.setdefault(email, [False, set()])[1]
+            changed.update(fields)
+            changed.update(unset)
+            return created
+
+    def delete(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+            self._dirty[email] = [True, set()]
+
+    def pop_changes(self, now):
+        """
+        :return: (emails whose entry expired, UpdateOnes for the doctors collection)
+        """
+        with self._lock:
+            expired = [email for email, entry in self._entries.items() if not alive(entry[0], entry[1], now)]
+            entries = {email: self._entries.pop(email) for email in expired}
+            dirty, self._dirty = self._dirty, {}
+            entries.update((email, self._entries[email]) for email in dirty if email in self._entries)
+            entries = {email: (dict(presence), expires_at) for email, (presence, expires_at) in entries.items()}
+
+        ops = [
+            UpdateOne({'email': email, 'presence_until': {'$not': {'$gt': now}}}, OFFLINE_UPDATE)
+            for email in expired
+        ]
+        for email, (deleted, changed) in dirty.items():
+            presence, expires_at = entries.get(email, ({}, None))
+            if email in expired:
+                # The expiry above decides the status; other changes still count
+                changed.discard('status')
+            update = {'$set': {}, '$unset': {}}
+            if deleted:
+                # Signed out here, so other workers' heartbeats don't count any more
+                update['$set'].update(OFFLINE_UPDATE['$set'], presence_until=0)
+                update['$unset'].update(OFFLINE_UPDATE['$unset'])
+            for field in changed:
+                if field in presence:
+                    update['$set'][field] = presence[field]
+                    update['$unset'].pop(field, None)
+                else:
+                    update['$unset'][field] = ''
+                    update['$set'].pop(field, None)
+            if 'status' in changed and expires_at is not None:
+                update['$set'].pop('presence_until', None)
+                update['$max'] = {'presence_until': expires_at}
+            update = {op: fields for op, fields in update.items() if fields}
+            if update:
+                ops.append(UpdateOne({'email': email}, update))
+        return expired, ops
+
+
+class RedisPresenceStore:
+    """
+    Presence shared by every worker. Each doctor is a hash; a sorted set of
+    expiry times decides who is online and lets the flusher find doctors
+    that went offline, and a set tracks doctors changed since the last
+    flush. The hashes have no Redis ttl, so a doctor in a meet doesn't
+    vanish when their heartbeats stop; the flusher deletes expired ones.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix='presence'):
+        self.client = client
+        self.prefix = prefix
+        self.expiry_key = f'{prefix}:expiry'
+        self.dirty_key = f'{prefix}:dirty'
+
+    def _key(self, email):
+        return f'{self.prefix}:{email}'
+
+    def _read(self, emails):
+        """:return: list of (presence or None, expiry or 0) in the order of `emails`"""
+        pipe = self.client.pipeline(transaction=False)
+        for email in emails:
+            pipe.hgetall(self._key(email))
+            pipe.zscore(self.expiry_key, email)
+        replies = pipe.execute()
+        return [
+            ({k.decode(): json.loads(v) for k, v in raw.items()} if raw else None, expires_at or 0)
+            for raw, expires_at in zip(replies[::2], replies[1::2])
+        ]
+
+    def get_many(self, emails, now):
+        emails = list(emails)
+        found = {}
+        for email, (presence, expires_at) in zip(emails, self._read(emails)):
+            if presence is not None and alive(presence, expires_at, now):
+                found[email] = presence
+        return found
+
+    def update(self, email, fields, unset, ttl, now, refresh):
+        key = self._key(email)
+        [(presence, expires_at)] = self._read([email])
+        created = presence is None or not alive(presence, expires_at, now)
+        pipe = self.client.pipeline()
+        if created:
+            # Drop what's left of an entry that expired but wasn't flushed yet
+            pipe.delete(key)
+        if fields:
+            pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+        if unset:
+            pipe.hdel(key, *unset)
+        if refresh or created:
+            pipe.zadd(self.expiry_key, {email: now + ttl})
+        pipe.sadd(self.dirty_key, email)
+        pipe.execute()
+        return created
+
+    def delete(self, email):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(email))
+        pipe.zrem(self.expiry_key, email)
+        pipe.sadd(self.dirty_key, email)
+        pipe.execute()
+
+    def _pop_expired(self, now):
+        candidates = [e.decode() for e in self.client.zrangebyscore(self.expiry_key, '-inf', now)]
+        expired = []
+        for email, (presence, expires_at) in zip(candidates, self._read(candidates)):
+            if presence is not None and alive(presence, expires_at, now):
+                continue
+            # zrem tells us which worker removed each entry, so only one flushes it
+            if self.client.zrem(self.expiry_key, email):
+                self.client.delete(self._key(email))
+                expired.append(email)
+        return expired
+
+    def pop_changes(self, now):
+        """
+        :return: (emails whose entry expired, UpdateOnes for the doctors collection)
+
+        This store holds each doctor's whole presence, so it's written as is.
+        """
+        expired = self._pop_expired(now)
+        dirty = {e.decode() for e in self.client.spop(self.dirty_key, 10000) or []} - set(expired)
+        current = self.get_many(dirty, now) if dirty else {}
+
+        ops = [UpdateOne({'email': email}, OFFLINE_UPDATE) for email in set(expired) | (dirty - set(current))]
+        for email, presence in current.items():
+            update = {'$set': dict(OFFLINE, **presence)}
+            missing = [f for f in FIELDS if f not in presence and f not in OFFLINE]
+            if missing:
+                update['$unset'] = {f: '' for f in missing}
+            ops.append(UpdateOne({'email': email}, update))
+        return expired, ops
+
+
+class PresenceRegistry:
+    """
+    Doctor presence (online status and meet state) kept in Redis, or in
+    process memory as a fallback, instead of the doctors collection. A doctor
+    stays online while they send heartbeats; without one for `ttl` seconds
+    they are offline, unless they are in a meet. Changes are written to the
+    doctors collection in batches every `flush_interval` seconds for
+    durability; with the per-process store, doctors it has no entry for are
+    read from there, so other workers' changes show up after their flush.
+
+    Each callable in `listeners` is called with a doctor's email whenever
+    their presence changes (a heartbeat only counts when it brings the
+    doctor online).
+    """
+
+    def __init__(self, doctors, store=None, ttl=120, flush_interval=15):
+        self.doctors = doctors
+        self.store = store or MemoryPresenceStore()
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.listeners = []
+        self._lock = Lock()
+        self._pid = None
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        Thread(target=self._flush_loop, name='presence-flush', daemon=True).start()
+
+    def _changed(self, email):
+        for listener in self.listeners:
+            try:
+                listener(email)
+            except Exception as e:
+                print(f"Error notifying presence listener: {e}")
+
+    def get(self, email):
+        return self.get_many([email])[email]
+
+    def get_many(self, emails):
+        """
+        :return: dict of email -> presence, with offline defaults for doctors
+                 that have no live presence entry
+        """
+        found = self.store.get_many(emails, time.time())
+        if not self.store.shared:
+            # Fields this process set for a doctor heartbeating elsewhere
+            # go over what the doctors collection has for them
+            missing = [email for email in emails if 'status' not in found.get(email, {})]
+            if missing:
+                for doctor in self.doctors.find({'email': {'$in': missing}}, PERSISTED_PROJECTION):
+                    email = doctor.pop('email')
+                    found[email] = dict(doctor, **found.get(email, {}))
+        return {email: dict(OFFLINE, **found.get(email, {})) for email in emails}
+
+    def overlay(self, emails):
+        """
+        Like get_many, but without reading the doctors collection: for
+        listings that already hold the persisted status. With the
+        per-process store only the fields it holds are returned.
+        """
+        found = self.store.get_many(emails, time.time())
+        if self.store.shared:
+            return {email: dict(OFFLINE, **found.get(email, {})) for email in emails}
+        return found
+
+    def heartbeat(self, email, **fields):
+        self.start()
+        fields.setdefault('status', 'online')
+        if self.store.update(email, fields, (), self.ttl, time.time(), refresh=True):
+            self._changed(email)
+
+    def update(self, email, unset=(), **fields):
+        """
+        Sets or removes presence fields without extending the doctor's ttl.
+        """
+        self.start()
+        self.store.update(email, fields, unset, self.ttl, time.time(), refresh=False)
+        self._changed(email)
+
+    def set_offline(self, email):
+        self.start()
+        self.store.delete(email)
+        self._changed(email)
+
+    def flush(self):
+        expired, ops = self.store.pop_changes(time.time())
+        if ops:
+            self.doctors.bulk_write(ops, ordered=False)
+        for email in expired:
+            self._changed(email)
+        return len(ops)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing doctor presence: {e}")
+
+
+def redis_from_env():
+    url = os.getenv('REDIS_URL')
+    if url and redis is not None:
+        return redis.Redis.from_url(url)
+    return None
@@ -0,0 +1,156 @@
+"""
+Cache of the small profile view (username, phone, gender, picture, role)
+that most routes need about a user, keyed by email.
+
+Entries live in a bounded in-process LRU for `local_ttl` seconds and, when
+Redis is configured, in Redis for `ttl` seconds so workers share fills.
+Routes that change a profile write the new view through (or invalidate it);
+the writing worker and Redis see the change at once, other workers'
+in-process copies within `local_ttl` seconds, with or without Redis.
+"""
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+FIELDS = ('email', 'username', 'phone', 'gender', 'profile_picture', 'usertype')
+PROJECTION = {'_id': 0, 'email': 1, 'username': 1, 'phone': 1, 'gender': 1, 'profile_picture': 1}
+
+
+def profile_view(user, usertype=None):
+    """The cached fields of a user document; `usertype` if it doesn't carry one."""
+    profile = {field: user[field] for field in FIELDS if field in user}
+    if usertype:
+        profile['usertype'] = usertype
+    return profile
+
+
+class ProfileCache:
+    def __init__(self, directory, max_entries=10000, ttl=300, redis_client=None, local_ttl=10, prefix='profile'):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis = redis_client
+        # In-process copies can't be invalidated by other workers, so they are
+        # kept short-lived; a phone number changed on one worker must reach
+        # the WhatsApp paths on the others quickly
+        self.local_ttl = min(ttl, local_ttl)
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._generation = 0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, email):
+        return f'{self.prefix}:{email}'
+
+    def _local(self, email, now):
+        entry = self._entries.get(email)
+        if entry is None:
+            return None
+        profile, expires_at = entry
+        if expires_at <= now:
+            del self._entries[email]
+            return None
+        self._entries.move_to_end(email)
+        return profile
+
+    def _store(self, profiles, generation=None):
+        with self._lock:
+            # Don't store a fill that raced with a write; it may be stale
+            if generation is not None and generation != self._generation:
+                return
+            expires_at = time.monotonic() + self.local_ttl
+            for email, profile in profiles.items():
+                self._entries[email] = (profile, expires_at)
+                self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, email):
+        """
+        :return: the user's profile view with `usertype`, or None if no user has this email
+        """
+        return self.get_many([email]).get(email)
+
+    def get_many(self, emails):
+        """
+        :return: dict of email -> profile view for the emails that belong to a user
+        """
+        emails = [email for email in dict.fromkeys(emails) if email]
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for email in emails:
+                profile = self._local(email, now)
+                if profile is not None:
+                    found[email] = profile
+            self.hits += len(found)
+            generation = self._generation
+        missing = [email for email in emails if email not in found]
+        if not missing:
+            return found
+
+        filled = {}
+        if self.redis is not None:
+            for email, raw in zip(missing, self.redis.mget([self._key(email) for email in missing])):
+                if raw is not None:
+                    filled[email] = json.loads(raw)
+            with self._lock:
+                self.redis_hits += len(filled)
+            missing = [email for email in missing if email not in filled]
+
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            loaded = {}
+            # Patients come first, so they win over a doctor with the same email
+            for user in self.directory.find_many({'email': {'$in': missing}}, PROJECTION):
+                loaded.setdefault(user['email'], profile_view(user))
+            if self.redis is not None and loaded:
+                self._redis_set(loaded)
+            filled.update(loaded)
+
+        self._store(filled, generation)
+        found.update(filled)
+        return found
+
+    def put(self, user, usertype=None):
+        """Writes a changed user's profile through to every tier."""
+        profile = profile_view(user, usertype)
+        with self._lock:
+            self._generation += 1
+        self._store({profile['email']: profile})
+        if self.redis is not None:
+            self._redis_set({profile['email']: profile})
+        return profile
+
+    def invalidate(self, email):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(email, None)
+        if self.redis is not None:
+            self.redis.delete(self._key(email))
+
+    def _redis_set(self, profiles):
+        pipe = self.redis.pipeline(transaction=False)
+        for email, profile in profiles.items():
+            pipe.set(self._key(email), json.dumps(profile), ex=self.ttl)
+        pipe.execute()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.redis_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'redis_hits': self.redis_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            }
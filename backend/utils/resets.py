@@ -0,0 +1,78 @@
+import datetime
+import hashlib
+import os
+import secrets
+import sys
+import pymongo
+from pymongo.server_api import ServerApi
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class PasswordResets:
+    """
+    Password reset tokens kept in their own collection instead of on the user
+    documents. Only a SHA-256 of each token is stored, under a unique index,
+    and a TTL index on `expires_at` lets MongoDB delete expired entries.
+    A user has at most one outstanding token; issuing a new one replaces it.
+    """
+
+    def __init__(self, collection, ttl=3600):
+        self.collection = collection
+        self.ttl = ttl
+
+    def issue(self, email, usertype):
+        """
+        :return: the raw token to send to the user
+        """
+        token = secrets.token_urlsafe(16)
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+        self.collection.update_one(
+            {'email': email},
+            {'$set': {'token_hash': hash_token(token), 'usertype': usertype, 'expires_at': expires_at}},
+            upsert=True,
+        )
+        return token
+
+    def redeem(self, token):
+        """
+        Consumes a token so it can't be used twice.
+
+        :return: the reset entry (email, usertype), or None if the token is
+                 unknown or expired
+        """
+        # The TTL monitor only runs once a minute, so check expiry here too
+        return self.collection.find_one_and_delete(
+            {'token_hash': hash_token(token), 'expires_at': {'$gt': datetime.datetime.utcnow()}},
+            projection={'_id': 0, 'email': 1, 'usertype': 1},
+        )
+
+
+def remove_legacy_tokens(db):
+    """
+    Removes the reset_token fields that used to be written to user documents.
+
+    :return: number of user documents changed
+    """
+    changed = 0
+    for name in ('doctors', 'patients'):
+        result = db[name].update_many(
+            {'reset_token': {'$exists': True}},
+            {'$unset': {'reset_token': '', 'reset_token_expiration': ''}},
+        )
+        changed += result.modified_count
+    return changed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != 'cleanup':
+        print("usage: python -m utils.resets cleanup")
+        sys.exit(1)
+    client = pymongo.MongoClient(os.getenv("DBURL"), server_api=ServerApi('1'))
+    count = remove_legacy_tokens(client.get_database(os.getenv("MONGO_DB", "medicare")))
+    print(f"Removed reset tokens from {count} users")
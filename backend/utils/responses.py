@@ -0,0 +1,175 @@
+"""
+Response encoding: an orjson JSON provider, gzip/brotli compression
+negotiated on Accept-Encoding, and chunked streaming of large JSON arrays.
+
+orjson and brotli are optional; without them Flask's own JSON provider is
+kept and only gzip is offered.
+"""
+import datetime
+import gzip
+import json
+import zlib
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _stdlib_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat() + ('Z' if value.tzinfo is None else '')
+    return _default(value)
+
+
+def dumps_bytes(obj):
+    """
+    Serializes to UTF-8 JSON. Naive datetimes are UTC (that's how pymongo
+    returns them) and are written as ISO 8601 with a +00:00 offset.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_stdlib_default).encode('utf-8')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; falls back to Flask's when orjson is missing."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def stream_json(envelope, key, items, chunk_size=65536):
+    """
+    Generator of a JSON object `envelope` with `items` written as an array
+    under `key`, one chunk at a time, so the list is never held in full.
+    """
+    head = dumps_bytes(dict(envelope, **{key: []}))
+    # Reopen the empty array the envelope was serialized with
+    head = head[:head.rindex(b'[') + 1]
+    buffer = bytearray(head)
+    first = True
+    for item in items:
+        if not first:
+            buffer += b','
+        buffer += dumps_bytes(item)
+        first = False
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']}'
+    yield bytes(buffer)
+
+
+def negotiate(accept_encoding):
+    """
+    :param accept_encoding: request.accept_encodings
+    :return: "br", "gzip" or None
+    """
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress_chunks(chunks, encoding, level):
+    chunks = (c.encode('utf-8') if isinstance(c, str) else c for c in chunks)
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            # Sync-flush so each chunk reaches the client as it is produced
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class Compressor:
+    """
+    Compresses responses whose content type is compressible and whose body
+    is at least `threshold` bytes, using brotli or gzip as the client
+    accepts. Streamed responses are compressed chunk by chunk.
+    """
+
+    def __init__(self, app=None, threshold=1024, gzip_level=6, brotli_quality=5):
+        self.threshold = threshold
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        if (
+            response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or response.direct_passthrough
+        ):
+            return response
+        encoding = negotiate(request.accept_encodings)
+        response.vary.add('Accept-Encoding')
+        if encoding is None:
+            return response
+
+        level = self.brotli_quality if encoding == 'br' else self.gzip_level
+        if response.is_streamed:
+            response.response = _compress_chunks(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.threshold:
+                return response
+            if encoding == 'br':
+                response.set_data(brotli.compress(body, quality=level))
+            else:
+                response.set_data(gzip.compress(body, compresslevel=level))
+        response.headers['Content-Encoding'] = encoding
+        # The body differs per encoding, so only a weak validator still holds
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
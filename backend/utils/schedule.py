@@ -0,0 +1,252 @@
+"""
+Doctor working hours and booked time slots.
+
+Each doctor has one document in the `schedules` collection holding their
+working hours and `booked`: the intervals of their upcoming appointments,
+kept sorted by start time. A booking is a single conditional update on
+that document, which only matches when no other appointment overlaps the
+new interval, so two patients can never take the same slot. Free-slot
+queries bisect the sorted intervals (see SlotIndex).
+
+Times are stored as naive UTC datetimes. Dates and times sent by the
+frontend are local to CLINIC_TIMEZONE.
+"""
+import datetime
+import os
+from bisect import bisect_right
+from zoneinfo import ZoneInfo
+from pymongo.errors import DuplicateKeyError
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Matches the hourly slots the booking page has always offered
+DEFAULT_HOURS = [['08:00', '13:00'], ['15:00', '19:00']]
+DEFAULT_WORKING_HOURS = {day: DEFAULT_HOURS for day in WEEKDAYS}
+
+# Formats the frontend sends: "HH:MM" from the slot picker and
+# toLocaleTimeString() output for instant meets, after parse_time has
+# removed whitespace and dots
+TIME_FORMATS = ('%H:%M', '%H:%M:%S', '%I:%M:%S%p', '%I:%M%p')
+
+
+class SlotConflict(Exception):
+    pass
+
+
+class ScheduleCreated(Exception):
+    """
+    A concurrent first booking created the doctor's schedule while reserve()
+    ran inside a transaction, which aborts it; run the transaction again.
+    """
+
+
+def clinic_timezone():
+    return ZoneInfo(os.getenv('CLINIC_TIMEZONE', 'Asia/Kolkata'))
+
+
+def parse_time(value):
+    # toLocaleTimeString() puts U+202F or a no-break space before AM/PM in
+    # current browsers, and some locales write "a.m." or no space at all
+    value = ''.join(value.upper().replace('.', '').split())
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time: {value}")
+
+
+def parse_timestamp(value):
+    """
+    :param value: ISO 8601 timestamp with an offset, e.g. Date.toISOString()
+    :return: naive UTC datetime
+    :raises ValueError: if it can't be parsed or has no offset
+    """
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid timestamp: {value}")
+    if moment.tzinfo is None:
+        raise ValueError(f"Timestamp without an offset: {value}")
+    return moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def local_to_utc(date, time, tz):
+    """
+    :param date: "YYYY-MM-DD" (anything after a "T" is ignored)
+    :param time: a time in one of TIME_FORMATS
+    :return: naive UTC datetime
+    :raises ValueError: if either can't be parsed
+    """
+    day = datetime.date.fromisoformat(date.split('T')[0])
+    local = datetime.datetime.combine(day, parse_time(time), tzinfo=tz)
+    return local.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def calendar_range(view, day, tz):
+    """
+    :param view: "day", "week" (Monday to Sunday) or "month"
+    :param day: any local datetime.date inside the period
+    :return: (start, end) naive UTC datetimes of the local period containing `day`
+    :raises ValueError: for an unknown view
+    """
+    if view == 'day':
+        first, last = day, day + datetime.timedelta(days=1)
+    elif view == 'week':
+        first = day - datetime.timedelta(days=day.weekday())
+        last = first + datetime.timedelta(days=7)
+    elif view == 'month':
+        first = day.replace(day=1)
+        last = (first + datetime.timedelta(days=32)).replace(day=1)
+    else:
+        raise ValueError(f"Unknown calendar view: {view}")
+
+    def to_utc(date):
+        local = datetime.datetime.combine(date, datetime.time(0), tzinfo=tz)
+        return local.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return to_utc(first), to_utc(last)
+
+
+def validate_working_hours(hours):
+    """
+    :param hours: {"mon": [["08:00", "13:00"], ...], ...}; missing days are days off
+    :return: the hours with every range checked and sorted
+    :raises ValueError: for unknown days, malformed or overlapping ranges
+    """
+    validated = {}
+    for day, ranges in hours.items():
+        if day not in WEEKDAYS:
+            raise ValueError(f"Unknown day: {day}")
+        parsed = sorted((parse_time(start), parse_time(end)) for start, end in ranges)
+        for i, (start, end) in enumerate(parsed):
+            if start >= end or (i and parsed[i - 1][1] > start):
+                raise ValueError(f"Invalid working hours on {day}")
+        validated[day] = [[s.strftime('%H:%M'), e.strftime('%H:%M')] for s, e in parsed]
+    return validated
+
+
+class SlotIndex:
+    """
+    A doctor's booked intervals as two parallel sorted arrays. Bookings never
+    overlap, so sorting by start also sorts by end, and whether an interval
+    is free is one bisect.
+    """
+
+    def __init__(self, booked):
+        self.starts = [b['start'] for b in booked]
+        self.ends = [b['end'] for b in booked]
+
+    def is_free(self, start, end):
+        # First booking ending after `start` is the only one that can overlap
+        i = bisect_right(self.ends, start)
+        return i == len(self.starts) or self.starts[i] >= end
+
+
+class Schedules:
+    def __init__(self, collection, tz=None, slot_minutes=60, instant_minutes=30):
+        self.collection = collection
+        self.tz = tz or clinic_timezone()
+        self.slot_minutes = slot_minutes
+        self.instant_minutes = instant_minutes
+
+    def get(self, demail, session=None):
+        schedule = self.collection.find_one({'demail': demail}, {'_id': 0}, session=session) or {}
+        schedule.setdefault('working_hours', DEFAULT_WORKING_HOURS)
+        schedule.setdefault('slot_minutes', self.slot_minutes)
+        schedule.setdefault('booked', [])
+        return schedule
+
+    def set_working_hours(self, demail, hours, slot_minutes=None):
+        update = {'working_hours': validate_working_hours(hours)}
+        if slot_minutes:
+            update['slot_minutes'] = int(slot_minutes)
+        self.collection.update_one({'demail': demail}, {'$set': update}, upsert=True)
+        return update
+
+    def within_hours(self, schedule, start, end):
+        """Whether [start, end) falls inside one of the doctor's working hour ranges."""
+        local_start = start.replace(tzinfo=datetime.timezone.utc).astimezone(self.tz)
+        local_end = end.replace(tzinfo=datetime.timezone.utc).astimezone(self.tz)
+        day = local_start.date()
+        for range_start, range_end in schedule['working_hours'].get(WEEKDAYS[day.weekday()], []):
+            opens = datetime.datetime.combine(day, parse_time(range_start), tzinfo=self.tz)
+            closes = datetime.datetime.combine(day, parse_time(range_end), tzinfo=self.tz)
+            if opens <= local_start and local_end <= closes:
+                return True
+        return False
+
+    def local_date_time(self, start):
+        """:return: ("YYYY-MM-DD", "HH:MM") of the naive UTC `start` in the clinic timezone"""
+        local = start.replace(tzinfo=datetime.timezone.utc).astimezone(self.tz)
+        return local.date().isoformat(), local.strftime('%H:%M')
+
+    def slot(self, date, time, instant=False, schedule=None):
+        """
+        :return: (start, end) naive UTC datetimes of the slot starting at the
+                 local `date` and `time`
+        """
+        start = local_to_utc(date, time, self.tz)
+        minutes = self.instant_minutes if instant else (schedule or {}).get('slot_minutes', self.slot_minutes)
+        return start, start + datetime.timedelta(minutes=minutes)
+
+    def reserve(self, demail, link, start, end, session=None):
+        """
+        Books [start, end) for `link`, atomically rejecting the booking if
+        another appointment overlaps it. Re-reserving the same link moves it.
+        Intervals that have already ended are pruned on the way.
+
+        :raises SlotConflict: if the interval overlaps another booking
+        :raises ScheduleCreated: inside a transaction, if a concurrent first
+                                 booking created the schedule
+        """
+        overlapping = {'start': {'$lt': end}, 'end': {'$gt': start}, 'link': {'$ne': link}}
+        query = {'demail': demail, 'booked': {'$not': {'$elemMatch': overlapping}}}
+        now = datetime.datetime.utcnow()
+        update = [{'$set': {'booked': {'$sortArray': {
+            'input': {'$concatArrays': [
+                {'$filter': {
+                    'input': {'$ifNull': ['$booked', []]},
+                    'cond': {'$and': [{'$ne': ['$$this.link', link]}, {'$gt': ['$$this.end', now]}]},
+                }},
+                [{'start': start, 'end': end, 'link': link}],
+            ]},
+            'sortBy': {'start': 1},
+        }}}}]
+        if self.collection.update_one(query, update, session=session).matched_count:
+            return
+        # Either the interval is taken or this is the doctor's first booking
+        if self.collection.count_documents({'demail': demail}, limit=1, session=session):
+            raise SlotConflict(f"{demail} is already booked at that time")
+        try:
+            self.collection.insert_one({'demail': demail, 'booked': [{'start': start, 'end': end, 'link': link}]}, session=session)
+        except DuplicateKeyError:
+            # A concurrent first booking created the schedule. A transaction
+            # is aborted by the error, so only the caller can retry it
+            if session is not None:
+                raise ScheduleCreated(demail)
+            self.reserve(demail, link, start, end)
+
+    def release(self, demail, link, session=None):
+        self.collection.update_one({'demail': demail}, {'$pull': {'booked': {'link': link}}}, session=session)
+
+    def free_slots(self, demail, date_from, days=7):
+        """
+        :param date_from: first local day, a datetime.date
+        :return: free slots as {'date', 'time', 'starts_at'} dicts, in order
+        """
+        schedule = self.get(demail)
+        index = SlotIndex(schedule['booked'])
+        step = datetime.timedelta(minutes=schedule['slot_minutes'])
+        now = datetime.datetime.utcnow()
+        free = []
+        for offset in range(days):
+            day = date_from + datetime.timedelta(days=offset)
+            for range_start, range_end in schedule['working_hours'].get(WEEKDAYS[day.weekday()], []):
+                local = datetime.datetime.combine(day, parse_time(range_start), tzinfo=self.tz)
+                close = datetime.datetime.combine(day, parse_time(range_end), tzinfo=self.tz)
+                while local + step <= close:
+                    start = local.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                    if start >= now and index.is_free(start, start + step):
+                        free.append({'date': day.isoformat(), 'time': local.strftime('%H:%M'), 'starts_at': start.isoformat() + 'Z'})
+                    local += step
+        return free
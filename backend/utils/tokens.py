@@ -0,0 +1,158 @@
+"""
+Firebase ID token verification with a verified-token cache.
+
+Tokens are checked the same way firebase_admin.auth.verify_id_token does
+(RS256 signature against Google's securetoken certificates, audience,
+issuer, expiry, subject), but the certificates are kept in memory and
+refreshed by a background thread so a request never waits on a download.
+For tests, call `CertificateStore.set({kid: pem})` with a locally generated
+certificate and sign tokens with the matching key.
+"""
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+import requests
+from google.auth import jwt
+from utils.metrics import external_call
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class CertificateStore:
+    """
+    Google's token signing certificates, refreshed `refresh_margin` seconds
+    before the max-age advertised by the certificate endpoint runs out.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, refresh_margin=300, retry_interval=30, timeout=10):
+        self.url = url
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._certs = {}
+        self._expires_at = 0.0
+        self._lock = Lock()
+        self._loaded = Event()
+        self._pid = None
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def set(self, certs, max_age=3600):
+        with self._lock:
+            self._certs = dict(certs)
+            self._expires_at = time.time() + max_age
+        self._loaded.set()
+
+    def refresh(self):
+        with external_call('firebase_certs'):
+            response = self.session.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        self.set(response.json(), int(match.group(1)) if match else 3600)
+        self.refreshes += 1
+
+    def start(self):
+        """
+        Starts the background refresher once per process; the first fetch
+        happens immediately.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        Thread(target=self._refresh_loop, name='firebase-cert-refresh', daemon=True).start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+                delay = max(self._expires_at - time.time() - self.refresh_margin, self.retry_interval)
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"Error refreshing Firebase certificates: {e}")
+                delay = self.retry_interval
+            time.sleep(delay)
+
+    def get(self):
+        self.start()
+        if not self._loaded.is_set():
+            # Only reached before the very first fetch has finished
+            self._loaded.wait(self.timeout)
+        with self._lock:
+            return self._certs
+
+
+class TokenVerifier:
+    """
+    Verifies Firebase ID tokens and caches the decoded claims, keyed by a
+    SHA-256 of the token, until the token's own `exp`. At most `max_entries`
+    tokens are kept; the least recently used one is evicted first.
+    """
+
+    def __init__(self, project_id, certificates, max_entries=10000, clock=time.time):
+        self.project_id = project_id
+        self.certificates = certificates
+        self.max_entries = max_entries
+        self.clock = clock
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _decode(self, id_token):
+        try:
+            claims = jwt.decode(id_token, certs=self.certificates.get(), audience=self.project_id)
+        except Exception as e:
+            raise InvalidToken(str(e)) from e
+        if claims.get('iss') != f'https://securetoken.google.com/{self.project_id}':
+            raise InvalidToken('Token has an incorrect issuer')
+        if not claims.get('sub') or not isinstance(claims['sub'], str) or len(claims['sub']) > 128:
+            raise InvalidToken('Token has an invalid subject')
+        return claims
+
+    def verify(self, id_token):
+        """
+        :return: decoded token claims
+        :raises InvalidToken: if the token is malformed, expired or not signed by Google
+        """
+        key = hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+        now = self.clock()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[1] > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return dict(entry[0])
+            if entry:
+                del self._cache[key]
+            self.misses += 1
+
+        claims = self._decode(id_token)
+
+        with self._lock:
+            self._cache[key] = (claims, claims['exp'])
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return dict(claims)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'evictions': self.evictions,
+                'certificate_refreshes': self.certificates.refreshes,
+                'certificate_refresh_errors': self.certificates.refresh_errors,
+            }
@@ -0,0 +1,107 @@
+import datetime
+import os
+import uuid
+import pymongo
+import requests
+from requests.adapters import HTTPAdapter
+from utils.jobs import DONE, QUEUED, JobQueue
+from utils.metrics import external_call
+
+
+class TwilioTransport:
+    """
+    Sends WhatsApp messages through the Twilio Messages API over a pooled
+    requests.Session. `base_url` can point at a local stand-in server.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, base_url='https://api.twilio.com', pool_size=10, timeout=10):
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.from_number = from_number
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send(self, to, body):
+        with external_call('twilio'):
+            response = self.session.post(
+                self.url,
+                data={'To': to, 'From': self.from_number, 'Body': body},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        return response.json().get('sid')
+
+
+class LogTransport:
+    """Prints messages instead of sending them, for environments without Twilio credentials."""
+
+    def send(self, to, body):
+        print(f"WhatsApp to {to}: {body}")
+        return f"log-{uuid.uuid4().hex}"
+
+
+def transport_from_env():
+    account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+    if not account_sid:
+        return LogTransport()
+    return TwilioTransport(
+        account_sid,
+        os.getenv('TWILIO_AUTH_TOKEN'),
+        os.getenv('TWILIO_WHATSAPP_FROM'),
+        base_url=os.getenv('TWILIO_BASE_URL', 'https://api.twilio.com'),
+    )
+
+
+class WhatsAppDispatcher(JobQueue):
+    """
+    Non-blocking WhatsApp notifications. Every message is persisted to
+    MongoDB as soon as it is sent and becomes due `coalesce_window` seconds
+    later; the worker that claims it merges in the other queued messages to
+    the same recipient (up to `max_coalesced` in all) and sends them as one,
+    with at most `workers` concurrent senders per process and retries.
+    """
+
+    def __init__(self, collection, transport, workers=4, coalesce_window=2.0, max_coalesced=10, **kwargs):
+        super().__init__(collection, {'whatsapp': self._deliver}, workers=workers, **kwargs)
+        self.transport = transport
+        self.coalesce_window = coalesce_window
+        self.max_coalesced = max_coalesced
+
+    def send(self, message):
+        """
+        :param message: dict with "to" (e.g. "whatsapp:+911234567890") and "body"
+        :return: id of the queued job, or None if the message has no recipient or body
+        :raises pymongo.errors.PyMongoError: if it couldn't be queued
+        """
+        to = message.get('to', '')
+        body = message.get('body', '')
+        if not to or to.endswith(':') or not body:
+            return None
+        return self.enqueue('whatsapp', {'to': to, 'body': body}, delay=self.coalesce_window)
+
+    def _coalesce(self, job):
+        """
+        Marks queued messages to the job's recipient as merged into it.
+
+        :return: their bodies, oldest first; re-reading by `merged_into`
+                 makes a retried attempt see the same ones
+        """
+        to = job['payload']['to']
+        ids = [queued['_id'] for queued in self.collection.find(
+            {'payload.to': to, 'status': QUEUED, '_id': {'$ne': job['_id']}}, {'_id': 1},
+        ).sort('_id', pymongo.ASCENDING).limit(self.max_coalesced - 1)]
+        if ids:
+            self.collection.update_many(
+                {'_id': {'$in': ids}, 'status': QUEUED},
+                {'$set': {'status': DONE, 'merged_into': job['_id'], 'finished_at': datetime.datetime.utcnow()}},
+            )
+        merged = self.collection.find({'merged_into': job['_id']}, {'payload.body': 1}).sort('_id', pymongo.ASCENDING)
+        return [queued['payload']['body'] for queued in merged]
+
+    def _deliver(self, job):
+        payload = job['payload']
+        bodies = [payload['body']] + self.step(job, 'coalesce', lambda: self._coalesce(job))
+        return {'sid': self.transport.send(payload['to'], '\n\n'.join(bodies)), 'count': len(bodies)}
@@ -1,34 +1,50 @@
-import React from "react";
+import React, { useEffect } from "react";
 import { CommonProvider } from "./contexts/common/commonContext";
 import Header from "./components/common/Header";
 import RouterRoutes from "./routes/RouterRoutes";
 import Footer from "./components/common/Footer";
-import httpClient from "./httpClient";
+import { openEvents } from "./events";
 import ChatBot from "./components/common/ChatBot";
 import { DarkModeProvider } from "./contexts/DarkMode/DarkModeContext";
+import useDoctorHeartbeat from "./hooks/useDoctorHeartbeat";
 
 const App = () => {
-  setInterval(() => {
-    localStorage.getItem("usertype") === "doctor" &&
-      httpClient
-        .post("make_meet", { email: localStorage.getItem("email") })
-        .then((res) => {
-          if (res.data.link !== null) {
-            localStorage.setItem("curpname", res.data.link["name"]);
-            localStorage.setItem("curmlink", res.data.link["link"]);
-            localStorage.setItem("setSearchPatient", true);
-            localStorage.setItem("searching", 2);
-          } else {
-            localStorage.setItem("setSearchPatient", false);
-            localStorage.setItem("curpname", "");
-            localStorage.setItem("curmlink", "");
-            localStorage.setItem("searching", 1);
-          }
-        })
-        .catch((err) => {
-          console.log(err);
-        });
-  }, 25000);
+  useDoctorHeartbeat();
+  // Meet requests for the logged-in doctor, pushed over /events
+  useEffect(() => {
+    let email = null;
+    let source = null;
+    const onPresence = (event) => {
+      const presence = JSON.parse(event.data);
+      if (presence.email !== email) return;
+      if (presence.link) {
+        localStorage.setItem("curpname", presence.link["name"]);
+        localStorage.setItem("curmlink", presence.link["link"]);
+        localStorage.setItem("setSearchPatient", true);
+        localStorage.setItem("searching", 2);
+      } else {
+        localStorage.setItem("setSearchPatient", false);
+        localStorage.setItem("curpname", "");
+        localStorage.setItem("curmlink", "");
+        localStorage.setItem("searching", 1);
+      }
+    };
+    // Follows logins and logouts in this tab, which fire no storage event
+    const subscribe = () => {
+      const current = localStorage.getItem("usertype") === "doctor" ? localStorage.getItem("email") : null;
+      if (current === email) return;
+      if (source) source.close();
+      email = current;
+      source = email ? openEvents(email, "doctor") : null;
+      if (source) source.addEventListener("presence", onPresence);
+    };
+    subscribe();
+    const interval = setInterval(subscribe, 5000);
+    return () => {
+      clearInterval(interval);
+      if (source) source.close();
+    };
+  }, []);
  
   return (
     <>
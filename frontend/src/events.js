@@ -0,0 +1,26 @@
+import httpClient from "./httpClient";
+
+// Server-Sent Events from /events: the user's appointment changes and the
+// presence (status, meet, link) of the doctors in `watch`, a doctor's own included
+export const openEvents = (email, role, watch = []) => {
+  const params = new URLSearchParams({ email, role });
+  watch.forEach((doctor) => params.append("watch", doctor));
+  const base = httpClient.defaults.baseURL.replace(/\/$/, "");
+  return new EventSource(`${base}/events?${params}`, { withCredentials: true });
+};
+
+// Resolves true as soon as `doctor` joins the meet, false after `timeout` ms
+export const waitForDoctorToJoin = (email, doctor, timeout) =>
+  new Promise((resolve) => {
+    const source = openEvents(email, "patient", [doctor]);
+    const finish = (joined) => {
+      clearTimeout(timer);
+      source.close();
+      resolve(joined);
+    };
+    const timer = setTimeout(() => finish(false), timeout);
+    source.addEventListener("presence", (event) => {
+      const presence = JSON.parse(event.data);
+      if (presence.email === doctor && presence.currentlyInMeet) finish(true);
+    });
+  });
@@ -0,0 +1,22 @@
+import { useEffect } from 'react';
+import httpClient from '../httpClient';
+
+// Keeps an available doctor online on every page, the meet included; the
+// server marks them offline when heartbeats stop
+const useDoctorHeartbeat = (interval = 30000) => {
+    useEffect(() => {
+        const heartbeat = () => {
+            if (localStorage.getItem('usertype') !== 'doctor' || localStorage.getItem('available') === 'false') return;
+            httpClient
+                .put('/heartbeat', { email: localStorage.getItem('email') })
+                .catch((err) => console.log(err));
+        };
+        heartbeat();
+        const timer = setInterval(heartbeat, interval);
+        return () => clearInterval(timer);
+    }, [interval]);
+
+    return null;
+};
+
+export default useDoctorHeartbeat;
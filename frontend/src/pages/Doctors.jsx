@@ -13,6 +13,7 @@ import Preloader from "../components/common/Preloader";
 import commonContext from "../contexts/common/commonContext";
 import useScrollDisable from "../hooks/useScrollDisable";
 import httpClient from "../httpClient";
+import { waitForDoctorToJoin } from "../events";
 import useOutsideClose from "../hooks/useOutsideClose";
 
 const Doctors = () => {
@@ -124,13 +125,18 @@ const Doctors = () => {
             demail: selectEmail,
             pemail: localStorage.getItem("email"),
             patient: localStorage.getItem("username"),
-            date: new Date().toISOString().split("T")[0],
-            time: new Date().toLocaleTimeString(),
+            starts_at: new Date().toISOString(),
             link: meetLink,
           })
           .then(() => {
             localStorage.setItem("meetLink", meetLink);
-            setTimeout(() => {
+            // Join as soon as the doctor does; after 20s check once more and give up
+            waitForDoctorToJoin(localStorage.getItem("email"), selectEmail, 20000).then((joined) => {
+              if (joined) {
+                setConnecting(false);
+                navigate(meetLink);
+                return;
+              }
               httpClient
                 .post("/currently_in_meet", { email: selectEmail })
                 .then((res) => {
@@ -143,7 +149,7 @@ const Doctors = () => {
                     setMessage(res.data.message);
                   }
                 });
-            }, 20000);
+            });
           });
       } else {
         setConnecting(false);
@@ -15,6 +15,7 @@ import { useNavigate } from "react-router-dom";
 import { HiOutlineLightBulb, HiUserGroup } from "react-icons/hi";
 import { FaVideo } from "react-icons/fa";
 import httpClient from "../httpClient";
+import { waitForDoctorToJoin } from "../events";
 import Preloader from "../components/common/Preloader";
 import commonContext from "../contexts/common/commonContext";
 import useScrollDisable from "../hooks/useScrollDisable";
@@ -273,12 +274,17 @@ const Home = () => {
               demail: selectEmail,
               pemail: localStorage.getItem("email"),
               patient: localStorage.getItem("username"),
-              date: new Date().toISOString().split("T")[0],
-              time: new Date().toLocaleTimeString(),
+              starts_at: new Date().toISOString(),
               link: joinlink,
             })
             .then((res) => {
-              setTimeout(() => {
+              // Join as soon as the doctor does; after 30s check once more and give up
+              waitForDoctorToJoin(localStorage.getItem("email"), doctormail, 30000).then((joined) => {
+                if (joined) {
+                  setIsConnecting(false);
+                  navigate(joinlink);
+                  return;
+                }
                 httpClient
                   .post("/currently_in_meet", { email: doctormail })
                   .then((res) => {
@@ -291,7 +297,7 @@ const Home = () => {
                       setMessage(res.data.message);
                     }
                   });
-              }, 30000);
+              });
             })
             .catch(() => {
               console.log("Error occurred in conducting meet");